@@ -0,0 +1,112 @@
+"""
+Binary cache of decoded audio assets.
+
+Decoding the metronome click at every start needs soundfile (and its
+libsndfile binding), which is one of the slowest imports of the looper.
+Decoded sounds and precomputed arrays (e.g. metronome bars) are kept as
+.npy files instead, keyed by what they were made from:
+
+    cache = AssetCache('~/.cache/pi-looper')
+    click = cache.sound('data/high_hat_001.wav', 44100)
+    bar = cache.array(('metronome_bar', 44100, 100), build_bar, keep = False)
+
+Sounds are resampled to the sample rate asked for and converted to its
+channels, once: the cache holds the converted samples. Keys of sounds
+include the size and modification time of their source, so an edited
+wav is decoded again. Files are replaced atomically, a
+cache left half written by a power cut is just a miss. Arrays are
+read-only, and kept in memory once loaded unless asked otherwise (the
+metronome keeps its bars in its own LRU cache, see metronome.py).
+"""
+import os
+import hashlib
+import logging
+import numpy as np
+import dsp
+
+cache_version = 1
+
+
+class AssetCache(object):
+    """Assets cached in directory, or only in memory if it is None."""
+
+    def __init__(self, directory = None):
+        if directory is not None:
+            directory = os.path.expanduser(directory)
+            try:
+                os.makedirs(directory, exist_ok = True)
+            except OSError as e:
+                logging.warning('No asset cache in %s: %s'%(directory, e))
+                directory = None
+        self.directory = directory
+        self.arrays = {} # key: array
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, key):
+        digest = hashlib.sha1(repr((cache_version,)+tuple(key)).encode()).hexdigest()
+        return os.path.join(self.directory, '%s-%s.npy'%(key[0], digest[:16]))
+
+    def array(self, key, build, keep = True, store = True):
+        """
+        The array of key (a tuple of str and numbers), build() if it isn't
+        cached. Without keep, it is not kept in memory (the caller caches
+        it), without store, a built array is not written to disk.
+        """
+        key = tuple(key)
+        if key in self.arrays:
+            self.hits += 1
+            return self.arrays[key]
+        array = None
+        if self.directory is not None:
+            filename = self.filename(key)
+            try:
+                array = np.load(filename)
+            except (OSError, ValueError, EOFError):
+                pass
+        if array is None:
+            self.misses += 1
+            array = np.ascontiguousarray(build())
+            if self.directory is not None and store:
+                self.save(filename, array)
+        else:
+            self.hits += 1
+        array.flags.writeable = False
+        if keep:
+            self.arrays[key] = array
+        return array
+
+    def has(self, key):
+        """Whether key is cached on disk."""
+        return self.directory is not None and os.path.exists(self.filename(key))
+
+    def save(self, filename, array):
+        temporary = '%s.%d.tmp'%(filename, os.getpid())
+        try:
+            with open(temporary, 'wb') as f:
+                np.save(f, array)
+            os.replace(temporary, filename)
+        except OSError as e:
+            logging.warning('Could not cache %s: %s'%(os.path.basename(filename), e))
+
+    def sound(self, filename, sample_rate, channels = None):
+        """
+        The (n_samples, channels) float32 samples of a sound file at
+        sample_rate, on channels channels (default: those of the file).
+        """
+        stat = os.stat(filename)
+        key = ('sound', os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, sample_rate,
+               channels)
+        return self.array(key, lambda: read_sound(filename, sample_rate, channels))
+
+
+def read_sound(filename, sample_rate, channels = None):
+    """A sound file, resampled to sample_rate and on channels channels if need be."""
+    import soundfile as sf # only when the cache misses
+    sound, sr = sf.read(filename, dtype = 'float32', always_2d = True)
+    if sr != sample_rate:
+        logging.info('Resampling %s from %d Hz to %d Hz'%(os.path.basename(filename), sr, sample_rate))
+        sound = dsp.resample(sound, sr, sample_rate)
+    if channels is not None:
+        sound = dsp.match_channels(sound, channels)
+    return sound
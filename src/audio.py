@@ -0,0 +1,351 @@
+"""
+Audio backends the looper opens its streams on.
+
+SoundDeviceAudio opens real streams on a sound card. MemoryAudio is an
+in-memory device for simulations: its streams only run when run() is
+called, as fast as the CPU allows. TimedAudio is an in-memory device
+whose streams run in real time, on threads of their own, like a sound
+card: for checks of timing without one.
+"""
+import argparse
+import threading
+import time
+import numpy as np
+
+
+def int_or_str(text):
+    """Helper function for argument parsing."""
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def argument_parser(description):
+    """
+    Command line parser for the stream settings: input/output device,
+    sample rate, channels, block size and latency, and the file they are
+    otherwise read from (see config.py). -l lists the devices and exits.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        '-l', '--list-devices', action='store_true',
+        help='show list of audio devices and exit')
+    args, remaining = parser.parse_known_args()
+    if args.list_devices:
+        import sounddevice as sd
+        print(sd.query_devices())
+        parser.exit(0)
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        parents=[parser])
+    parser.add_argument(
+        '-i', '--input-device', type=int_or_str,
+        help='input device (numeric ID or substring)')
+    parser.add_argument(
+        '-o', '--output-device', type=int_or_str,
+        help='output device (numeric ID or substring)')
+    parser.add_argument('--sample-rate', type=int, help='sample rate in Hz')
+    parser.add_argument('--channels', type=int, help='number of channels')
+    parser.add_argument('--blocksize', type=int, help='block size')
+    parser.add_argument('--latency', type=float, help='latency in seconds')
+    parser.add_argument(
+        '--config', metavar='FILE',
+        help='audio settings (JSON), overridden by the options above '
+             '(default: ~/.pi-looper/audio.json)')
+    return parser
+
+
+class SoundDeviceAudio(object):
+    """
+    Streams on a sound card, through sounddevice.
+    device is a device ID or name, or an (input, output) pair of them.
+    """
+
+    realtime = True
+
+    def __init__(self, device = None):
+        self.device = device
+
+    @property
+    def devices(self):
+        if isinstance(self.device, (tuple, list)):
+            return tuple(self.device)
+        return self.device, self.device
+
+    @property
+    def name(self):
+        import sounddevice as sd
+        input_name = sd.query_devices(self.devices[0], 'input')['name']
+        output_name = sd.query_devices(self.devices[1], 'output')['name']
+        if input_name == output_name:
+            return output_name
+        return input_name + ' / ' + output_name
+
+    def open_duplex(self, sample_rate, channels, blocksize, latency, callback):
+        """Single stream for input and output, callback(indata, outdata, frames, time, status)."""
+        import sounddevice as sd
+        return sd.Stream(
+            device = self.device,
+            samplerate = sample_rate,
+            channels = channels,
+            blocksize = blocksize,
+            latency = latency,
+            dtype = 'float32',
+            callback = callback)
+
+    def open_output(self, sample_rate, channels, blocksize, latency, callback):
+        import sounddevice as sd
+        return sd.OutputStream(
+            device = self.devices[1],
+            samplerate = sample_rate,
+            channels = channels,
+            blocksize = blocksize,
+            latency = latency,
+            dtype = 'float32',
+            callback = callback)
+
+    def open_input(self, sample_rate, channels, blocksize, latency, callback):
+        import sounddevice as sd
+        return sd.InputStream(
+            device = self.devices[0],
+            samplerate = sample_rate,
+            channels = channels,
+            blocksize = blocksize,
+            latency = latency,
+            dtype = 'float32',
+            callback = callback)
+
+
+class StreamTime(object):
+    """Stand-in for the time argument of sounddevice callbacks."""
+
+    def __init__(self, t):
+        self.currentTime = t
+        self.inputBufferAdcTime = t
+        self.outputBufferDacTime = t
+
+
+class MemoryStream(object):
+
+    def __init__(self, audio, kind, callback):
+        self.audio = audio
+        self.kind = kind
+        self.callback = callback
+        self.active = False
+
+    @property
+    def time(self):
+        return self.audio.time
+
+    def start(self):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def close(self):
+        self.active = False
+        if self in self.audio.streams:
+            self.audio.streams.remove(self)
+
+
+class MemoryAudio(object):
+    """
+    In-memory audio device.
+
+    Sound given to play() is what the input streams capture; everything
+    the output streams produce is collected in output. Input and output
+    share a single clock with no latency between them, and a VirtualClock
+    passed as clock is advanced along with the audio.
+
+    With loopback set to a number of frames, the output is also fed back
+    into the input that many frames later, like a cable between the two
+    on a real interface. Duplex streams read their input before producing
+    their output, so they only hear loopbacks of at least one block.
+    """
+
+    realtime = False
+    name = 'memory'
+
+    def __init__(self, sample_rate, channels = 2, blocksize = 256, clock = None,
+                 loopback = None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.clock = clock
+        self.loopback = loopback
+        self.frame = 0
+        self.input = np.zeros((0, channels), dtype = 'float32')
+        self.output_blocks = []
+        self.streams = []
+
+    @property
+    def time(self):
+        return self.frame/self.sample_rate
+
+    @property
+    def output(self):
+        if not self.output_blocks:
+            return np.zeros((0, self.channels), dtype = 'float32')
+        return np.concatenate(self.output_blocks)
+
+    def open_output(self, sample_rate, channels, blocksize, latency, callback):
+        return self.open('output', sample_rate, channels, callback)
+
+    def open_input(self, sample_rate, channels, blocksize, latency, callback):
+        return self.open('input', sample_rate, channels, callback)
+
+    def open_duplex(self, sample_rate, channels, blocksize, latency, callback):
+        return self.open('duplex', sample_rate, channels, callback)
+
+    def open(self, kind, sample_rate, channels, callback):
+        if sample_rate != self.sample_rate or channels != self.channels:
+            raise ValueError('MemoryAudio runs at %d Hz with %d channels'%(
+                self.sample_rate, self.channels))
+        stream = MemoryStream(self, kind, callback)
+        self.streams.append(stream)
+        return stream
+
+    def play(self, sound, frame = None):
+        """Add sound to the input, starting at frame (default: now)."""
+        if frame is None:
+            frame = self.frame
+        end = frame + len(sound)
+        if end > len(self.input):
+            self.input = np.concatenate((
+                self.input,
+                np.zeros((end-len(self.input), self.channels), dtype = 'float32')))
+        self.input[frame:end] += sound
+
+    def run(self, seconds):
+        """Run the streams for the given (simulated) duration."""
+        self.run_frames(int(round(seconds*self.sample_rate)))
+
+    def run_frames(self, frames):
+        end = self.frame + frames
+        while self.frame < end:
+            n = min(self.blocksize, end - self.frame)
+            t = StreamTime(self.time)
+
+            outdata = np.zeros((n, self.channels), dtype = 'float32')
+            for stream in self.active_streams('duplex'):
+                stream.callback(self.read_input(n), outdata, n, t, None)
+            for stream in self.active_streams('output'):
+                stream.callback(outdata, n, t, None)
+            self.output_blocks.append(outdata)
+            if self.loopback is not None:
+                self.play(outdata, self.frame + self.loopback)
+
+            for stream in self.active_streams('input'):
+                stream.callback(self.read_input(n), n, t, None)
+
+            self.frame += n
+            if self.clock is not None:
+                self.clock.advance(n/self.sample_rate)
+
+    def read_input(self, frames):
+        indata = np.zeros((frames, self.channels), dtype = 'float32')
+        available = self.input[self.frame:self.frame+frames]
+        indata[:len(available)] = available
+        return indata
+
+    def active_streams(self, kind):
+        return [s for s in self.streams if s.kind == kind and s.active]
+
+
+class StreamStatus(object):
+    """Stand-in for the status argument of sounddevice callbacks."""
+
+    def __init__(self, output_underflow = False):
+        self.input_underflow = False
+        self.input_overflow = False
+        self.output_underflow = output_underflow
+        self.output_overflow = False
+
+    def __bool__(self):
+        return self.output_underflow
+
+
+class TimedStream(MemoryStream):
+    """
+    Calls back every block from a thread, when the block is due on the
+    wall clock. A block called back later than the one after it is due
+    is an output underflow, as on a sound card.
+    """
+
+    def __init__(self, audio, kind, callback):
+        MemoryStream.__init__(self, audio, kind, callback)
+        self.thread = None
+
+    def start(self):
+        self.active = True
+        self.thread = threading.Thread(name = 'audio', target = self.run, daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.active = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        audio = self.audio
+        n = audio.blocksize
+        block_duration = n/audio.sample_rate
+        start = time.perf_counter()
+        frame = 0
+        while self.active:
+            due = start + frame/audio.sample_rate
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            now = time.perf_counter()
+            t = StreamTime(now)
+            t.inputBufferAdcTime = due - block_duration
+            t.outputBufferDacTime = due + audio.latency
+            status = StreamStatus(output_underflow = now - due > block_duration)
+            if self.kind == 'output':
+                self.callback(np.zeros((n, audio.channels), dtype = 'float32'), n, t, status)
+            elif self.kind == 'input':
+                self.callback(audio.input_block(frame, n), n, t, status)
+            else:
+                self.callback(audio.input_block(frame, n),
+                              np.zeros((n, audio.channels), dtype = 'float32'), n, t, status)
+            frame += n
+
+
+class TimedAudio(MemoryAudio):
+    """
+    In-memory audio device running in real time: streams call back every
+    blocksize frames from their own thread, with stream times on the
+    perf_counter() clock (output played latency seconds after its block
+    is due). Sound given to play() is what the input streams capture,
+    the output goes nowhere. It only holds arrays until a stream starts,
+    so it can be handed to another process.
+    """
+
+    realtime = True
+    name = 'timed'
+
+    def __init__(self, sample_rate, channels = 2, blocksize = 256, latency = 0.01):
+        MemoryAudio.__init__(self, sample_rate, channels, blocksize)
+        self.latency = latency
+
+    def open(self, kind, sample_rate, channels, callback):
+        if sample_rate != self.sample_rate or channels != self.channels:
+            raise ValueError('TimedAudio runs at %d Hz with %d channels'%(
+                self.sample_rate, self.channels))
+        stream = TimedStream(self, kind, callback)
+        self.streams.append(stream)
+        return stream
+
+    def run_frames(self, frames):
+        raise NotImplementedError('TimedAudio runs in real time')
+
+    def input_block(self, frame, frames):
+        indata = np.zeros((frames, self.channels), dtype = 'float32')
+        available = self.input[frame:frame+frames]
+        indata[:len(available)] = available
+        return indata
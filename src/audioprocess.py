@@ -0,0 +1,766 @@
+"""
+The audio engine in a process of its own.
+
+In a single process, the audio callback shares the GIL and the garbage
+collector with everything else the looper does: button callbacks, state
+transitions, layers mixed with numpy, wav files written, log lines. Any
+of them can hold a block up for milliseconds. EngineProcess runs the
+PlaybackEngine and its stream in a child process that does nothing but
+play, and stands in for it in the looper's process (the control
+process), with the same methods and attributes:
+
+    engine = EngineProcess(44100, blocksize = 256, audio = SoundDeviceAudio(),
+                           duplex = True, cpu = 3, priority = 70)
+    engine.boundary_callback = looper.loop_boundary
+    engine.start()
+    engine.set_loop(loop)
+
+- Loops go to the child as specs of their lanes. Buffers are copied once
+  into shared memory (multiprocessing.shared_memory), where the child
+  maps them, and freed once neither process uses them. TakeLanes read
+  a RecordBuffer that is made in shared memory to begin with.
+- Commands (loops, gains, scheduled events) go down a pipe to the main
+  thread of the child, which hands them to its engine.
+- Boundaries and scheduled events that are due come back up the pipe in
+  the order they happened: the audio thread only puts them on a queue,
+  which a thread of the child sends. In the control process, a receiver
+  thread calls the callbacks, and events run on the dispatcher.
+- For output_callback, the audio thread writes its blocks into a ring in
+  shared memory (a RecordBuffer), and the receiver thread hands what was
+  played since to output_callback at least every output_interval.
+- In duplex mode, takes are recorded in the child, by a Recorder writing
+  the input blocks straight into the shared RecordBuffer (see record()).
+  Only the times takes are armed and disarmed at go down the pipe, and
+  the numbers of the takes started and finished come back up.
+- The position of the engine (frame, origin, frame_time()...) is in a
+  small shared array the audio thread updates after every block.
+
+The child can be pinned to a CPU core and run at a real-time (SCHED_FIFO)
+priority, where the system permits it. Its threads hand the GIL over
+sooner than by default (switch_interval), and the objects it has made
+when it starts playing are left out of garbage collections (gc.freeze).
+
+Callbacks run a little after the block they happened in (the time for
+the message to go through). Takes still start on time: they are armed
+at the stream time of the boundary, and the input captured then reaches
+the recorder of the child with a later block. Loops with an
+origin (see timeline.Loop) play in phase from whichever block they are
+applied on.
+"""
+import gc
+import os
+import sys
+import queue
+import logging
+import weakref
+import itertools
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from fractions import Fraction
+from functools import partial
+from time import perf_counter
+import numpy as np
+from daemons import RecordBuffer, Recorder, TakeLane
+from engine import PlaybackEngine
+from metrics import Metrics
+from timeline import Lane, Loop
+
+# Seconds a thread of the child holds the GIL before another one waiting
+# for it gets it: the audio thread, woken up for its block, doesn't wait
+# the default 5 ms for the thread sending messages or handling commands
+switch_interval = 0.0005
+
+# Seconds of output the ring read for output_callback holds, and seconds
+# between two reads at most
+output_time = 2.
+output_interval = 0.02
+
+
+def set_realtime(cpu = None, priority = None):
+    """
+    Pin the calling thread, and the threads it starts from then on, to
+    the CPU core cpu and run them at the SCHED_FIFO priority (1 to 99).
+    Returns what could not be done, e.g. for lack of permission.
+    """
+    failed = []
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except (AttributeError, OSError, ValueError) as e:
+            failed.append('pinning to CPU %d: %s'%(cpu, e))
+    if priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except (AttributeError, OSError) as e:
+            failed.append('SCHED_FIFO priority %d: %s'%(priority, e))
+    return failed
+
+
+class Status(object):
+    """
+    Position of the engine, written by the audio thread of the child after
+    every block, read by any thread of the control process. A sequence
+    number, odd while the fields are written, keeps readers from mixing
+    two blocks.
+    """
+
+    fields = ['frame', 'block_frame', 'block_time', 'current_time', 'origin',
+              'loop_start', 'pass_end', 'version']
+
+    def __init__(self, name = None):
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name = name, create = self.owner,
+                                              size = 8*(len(self.fields)+1))
+        self.values = np.ndarray(len(self.fields)+1, dtype = 'float64', buffer = self.shm.buf)
+        self.name = self.shm.name
+
+    def write(self, engine):
+        values = self.values
+        values[0] += 1
+        values[1] = engine.frame
+        values[2] = engine.block_frame
+        values[3] = engine.block_time
+        values[4] = engine.current_time
+        values[5] = engine.origin
+        values[6] = engine.loop_start
+        values[7] = engine.pass_end
+        values[8] = engine.version
+        values[0] += 1
+
+    def read(self):
+        while True:
+            values = self.values.tolist()
+            if values[0] % 2 == 0 and self.values[0] == values[0]:
+                return dict(zip(self.fields, values[1:]))
+
+    def close(self):
+        del self.values
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class Segment(object):
+    """A copy of an array in shared memory."""
+
+    def __init__(self, array):
+        self.shm = shared_memory.SharedMemory(create = True, size = max(1, array.nbytes))
+        copy = np.ndarray(array.shape, dtype = array.dtype, buffer = self.shm.buf)
+        copy[...] = array
+        del copy
+        self.name = self.shm.name
+        self.spec = (self.name, array.shape, array.dtype.str)
+        self.version = 0 # of the last loop published with it
+        self.alive = True # the array still exists
+        self.released = False # the child doesn't map it
+
+    def unlink(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedArrays(object):
+    """
+    Arrays of the control process copied into shared memory, once each
+    (they are never modified once published). A copy is removed once
+    its array is gone and the child has released it since the last loop
+    it was published with.
+    """
+
+    def __init__(self):
+        self.alive = {} # id of array: Segment
+        self.segments = {} # name: Segment
+        self.lock = threading.RLock()
+
+    def share(self, array, version):
+        """Spec of the copy of array, for the loop version."""
+        with self.lock:
+            segment = self.alive.get(id(array))
+            if segment is None:
+                segment = Segment(array)
+                self.alive[id(array)] = segment
+                self.segments[segment.name] = segment
+                weakref.finalize(array, self.dead, id(array))
+            segment.version = version
+            segment.released = False
+            return segment.spec
+
+    def dead(self, key):
+        with self.lock:
+            segment = self.alive.pop(key, None)
+            if segment is not None:
+                segment.alive = False
+                self.collect(segment)
+
+    def released(self, names, version):
+        """The child no longer maps names, as of the loop version it got last."""
+        with self.lock:
+            for name in names:
+                segment = self.segments.get(name)
+                if segment is not None and segment.version <= version:
+                    segment.released = True
+                    self.collect(segment)
+
+    def collect(self, segment):
+        if segment.released and not segment.alive:
+            del self.segments[segment.name]
+            segment.unlink()
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments.values():
+                segment.unlink()
+            self.segments = {}
+            self.alive = {}
+
+
+def loop_spec(loop, share):
+    """What the child needs to play loop, arrays shared with share(array)."""
+    if loop is None:
+        return None
+    return ([lane_spec(lane, share) for lane in loop.lanes], (loop.num, loop.den), loop.origin)
+
+
+def lane_spec(lane, share):
+    period = (lane.num, lane.den)
+    if isinstance(lane, TakeLane):
+        record = lane.record
+        if record.name is None:
+            raise ValueError('The RecordBuffer of a TakeLane played by the audio process must be shared')
+        fades = None if lane.fades is None else tuple(share(f) for f in lane.fades)
+        return ('take', (record.name,) + record.data.shape, lane.length, period, lane.start,
+                lane.latency, fades, lane.track, lane.take, lane.silent)
+    return ('lane', share(lane.buffer), period, lane.track)
+
+
+class AudioProcess(object):
+    """The child process: a PlaybackEngine, driven through conn."""
+
+    def __init__(self, conn, status_name, engine_args, output):
+        self.conn = conn
+        self.status = Status(status_name)
+        self.engine = PlaybackEngine(**engine_args)
+        self.engine.boundary_callback = self.boundary
+        self.engine.output_callback = self.block_done
+        # Ring of the output blocks, for output_callback
+        self.output = None if output is None else RecordBuffer.attach(*output)
+        self.recorder = None # in duplex mode, once record() is given its buffer
+        self.handled = 0 # arm() and disarm() commands
+        self.take = (0, 0, 0) # number, started, finished, as last sent
+        self.outbox = queue.SimpleQueue() # to the control process, None to stop
+        self.arrays = {} # name: (SharedMemory, array)
+        self.closing = [] # SharedMemory still used by the audio thread when released
+        self.records = {} # name: RecordBuffer
+        self.names = {} # loop version: names of its arrays
+
+    # Audio thread
+
+    def boundary(self, frame):
+        self.outbox.put(('boundary', frame))
+
+    def input(self, indata, frames, time):
+        recorder = self.recorder
+        recorder.process(indata, frames, time)
+        if recorder.started != self.take[1] or recorder.finished != self.take[2]:
+            self.send_take()
+
+    def block_done(self, outdata):
+        self.status.write(self.engine)
+        if self.output is not None:
+            self.output.write(outdata)
+
+    # Other threads
+
+    def run(self):
+        # What was given before start() applies from the first block on
+        running = True
+        while running and self.conn.poll():
+            running = self.handle(self.conn.recv())
+        self.status.write(self.engine)
+        if running:
+            self.engine.start()
+        sender = threading.Thread(name = 'sender', target = self.send, daemon = True)
+        sender.start()
+        # Only what is allocated from now on is looked at by collections
+        gc.freeze()
+        try:
+            while running:
+                try:
+                    running = self.handle(self.conn.recv())
+                except EOFError:
+                    break # the control process is gone
+        finally:
+            self.engine.stop()
+            self.outbox.put(None)
+            sender.join()
+            self.close()
+
+    def handle(self, command):
+        """Run command, False to stop."""
+        if command[0] == 'stop':
+            return False
+        try:
+            getattr(self, command[0])(*command[1:])
+        except Exception:
+            logging.exception('Audio process command %r failed'%command[0])
+        return True
+
+    def send(self):
+        while True:
+            message = self.outbox.get()
+            if message is None:
+                self.conn.send(('stopped',))
+                return
+            self.conn.send(message)
+
+    def publish(self, version, spec, mode):
+        loop, names = (None, set()) if spec is None else self.attach_loop(spec)
+        self.names[version] = names
+        self.engine.published = (version, loop, mode)
+        # Loops published since the one playing will never be played
+        playing = self.engine.version
+        for v in list(self.names):
+            if v != playing and v != version:
+                del self.names[v]
+        released = self.release(self.names.get(playing, set()) | names)
+        if released:
+            self.outbox.put(('released', released, version))
+
+    def gains(self, gains):
+        self.engine.set_gains(gains)
+
+    def schedule(self, frame, n):
+        self.engine.schedule(frame, partial(self.outbox.put, ('event', n)))
+
+    def record(self, spec, sample_rate):
+        name, n_samples, channels = spec
+        if name not in self.records:
+            self.records[name] = RecordBuffer.attach(name, n_samples, channels)
+        self.recorder = Recorder(self.records[name], sample_rate, audio = self.engine.audio)
+        self.engine.input_callback = self.input
+
+    def arm(self, start_time):
+        self.recorder.arm(start_time)
+        self.handled += 1
+        self.send_take()
+
+    def disarm(self, stop_time):
+        self.recorder.disarm(stop_time)
+        self.handled += 1
+        self.send_take()
+
+    def send_take(self):
+        # From the audio thread too: all the numbers only ever grow
+        recorder = self.recorder
+        self.take = (recorder.take[0], recorder.started, recorder.finished)
+        self.outbox.put(('take', self.handled) + self.take)
+
+    def metrics(self, reset):
+        metrics = self.engine.metrics
+        self.outbox.put(('metrics', metrics.as_dict(), metrics.summary()))
+        if reset:
+            metrics.reset()
+
+    def attach_loop(self, spec):
+        lane_specs, (num, den), origin = spec
+        lanes = []
+        names = set()
+        for lane in lane_specs:
+            if lane[0] == 'take':
+                kind, (name, n_samples, channels), length, (pnum, pden), start, latency, \
+                    fades, track, take, silent = lane
+                if name not in self.records:
+                    self.records[name] = RecordBuffer.attach(name, n_samples, channels)
+                if fades is not None:
+                    names.update(f[0] for f in fades)
+                    fades = tuple(self.array(f) for f in fades)
+                lane = TakeLane(self.records[name], length, Fraction(pnum, pden), start = start,
+                                latency = latency, fades = fades, track = track, take = take)
+                lane.silent = silent
+            else:
+                kind, array, (pnum, pden), track = lane
+                names.add(array[0])
+                lane = Lane(self.array(array), Fraction(pnum, pden), track = track)
+            lanes.append(lane)
+        return Loop(lanes, Fraction(num, den), origin), names
+
+    def array(self, spec):
+        name, shape, dtype = spec
+        if name not in self.arrays:
+            shm = shared_memory.SharedMemory(name = name)
+            self.arrays[name] = (shm, np.ndarray(shape, dtype = dtype, buffer = shm.buf))
+        return self.arrays[name][1]
+
+    def release(self, keep):
+        """Unmap the arrays not in keep, returns their names."""
+        released = []
+        for name in list(self.arrays):
+            if name not in keep:
+                self.closing.append(self.arrays.pop(name)[0])
+                released.append(name)
+        closing = self.closing
+        self.closing = []
+        for shm in closing:
+            try:
+                shm.close()
+            except BufferError:
+                # The audio thread still plays it, next time
+                self.closing.append(shm)
+        return released
+
+    def close(self):
+        # The engine is stopped, nothing plays the loops any more
+        self.engine.loop = None
+        self.engine.published = (0, None, 'boundary')
+        self.names = {}
+        self.release(set())
+        for record in self.records.values():
+            record.close()
+        if self.output is not None:
+            self.output.close()
+        self.status.close()
+
+
+def run_process(conn, status_name, engine_args, output, cpu, priority,
+                log_level, log_format):
+    """Main function of the child process."""
+    logging.basicConfig(level = log_level, format = log_format)
+    sys.setswitchinterval(switch_interval)
+    for problem in set_realtime(cpu, priority):
+        logging.warning('Audio process: %s'%problem)
+    AudioProcess(conn, status_name, engine_args, output).run()
+
+
+class RemoteRecorder(object):
+    """
+    Stands in for the Recorder of the audio process (see
+    EngineProcess.record()), with the same methods: arm() and disarm()
+    are sent to it, and it tells which takes it has started and finished.
+    """
+
+    def __init__(self, engine, buffer):
+        self.engine = engine
+        self.buffer = buffer
+        self.sent = 0 # arm() and disarm() commands
+        self.handled = 0 # of them, by the audio process
+        self.take = 0 # numbers of the current take and of the last ones
+        self.started = 0 # started and finished
+        self.finished = 0
+        self.changed = threading.Condition()
+
+    def stop(self):
+        pass # the audio process records until it stops
+
+    @property
+    def state(self):
+        """'idle', 'armed' or 'recording'"""
+        with self.changed:
+            if self.finished == self.take:
+                return 'idle'
+            return 'recording' if self.started == self.take else 'armed'
+
+    @property
+    def is_recording(self):
+        return self.state != 'idle'
+
+    def arm(self, start_time):
+        """Start a new take with the sample captured at start_time."""
+        self.command('arm', start_time)
+
+    def disarm(self, stop_time = float('-inf')):
+        """End the take just before the sample captured at stop_time (default: now)."""
+        self.command('disarm', stop_time)
+
+    def command(self, *command):
+        with self.changed:
+            self.sent += 1
+            self.engine.send(command)
+
+    def wait(self, timeout = None):
+        """Block until the current take is complete."""
+        with self.changed:
+            return self.changed.wait_for(self.complete, timeout)
+
+    def complete(self):
+        return self.handled == self.sent and self.finished == self.take
+
+    def update(self, handled, take, started, finished):
+        # Sent from two threads of the child, maybe out of order
+        with self.changed:
+            self.handled = max(self.handled, handled)
+            self.take = max(self.take, take)
+            self.started = max(self.started, started)
+            self.finished = max(self.finished, finished)
+            self.changed.notify_all()
+
+
+class EngineProcess(object):
+    """
+    A PlaybackEngine in a child process, with the same methods and
+    attributes, its callbacks called on the 'receiver' thread of this
+    process (see above). Instead of input_callback, record() records the
+    input of a duplex stream in the child. cpu and priority are those of the child, see
+    set_realtime(). audio must run in real time and be picklable. The
+    child logs to stderr, with log_format.
+
+    self.metrics holds the times of the tasks dispatched in this process,
+    audio_metrics() those of the child.
+    """
+
+    def __init__(self, sample_rate, channels=2, blocksize=0, latency=0.05,
+                 audio=None, duplex=False, metrics=None, cpu=None, priority=None,
+                 log_format=None):
+        if audio is None:
+            from audio import SoundDeviceAudio
+            audio = SoundDeviceAudio()
+        if not audio.realtime:
+            raise ValueError('The audio process needs an audio device that runs in real time')
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.latency = latency
+        self.audio = audio
+        self.duplex = duplex
+        self.cpu = cpu
+        self.priority = priority
+        self.log_format = log_format
+
+        self.boundary_callback = None
+        self.output_callback = None
+        self.recorder = None
+        self.metrics = Metrics() if metrics is None else metrics
+
+        self.versions = itertools.count(1)
+        self.loops = {} # version: Loop, from the one playing on
+        self.events = {} # n: function scheduled
+        self.n_events = itertools.count()
+        self.tasks = queue.SimpleQueue()
+        self.replies = queue.SimpleQueue()
+        self.arrays = SharedArrays()
+        self.lock = threading.Lock() # commands are sent in order of their versions
+
+        # Commands given before start() wait in the pipe
+        self.status = Status()
+        self.conn, self.child_conn = multiprocessing.get_context('spawn').Pipe()
+        self.process = None
+        self.receiver = None
+        self.dispatcher = None
+        self.output = None # ring of the output, with output_callback
+        self.n_forwarded = 0 # samples of it handed to output_callback
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        engine_args = dict(sample_rate = self.sample_rate, channels = self.channels,
+                           blocksize = self.blocksize, latency = self.latency,
+                           audio = self.audio, duplex = self.duplex)
+        output = None
+        if self.output_callback is not None:
+            self.output = RecordBuffer(int(output_time*self.sample_rate), self.channels,
+                                       shared = True)
+            output = (self.output.name,) + self.output.data.shape
+        self.process = context.Process(
+            name = 'audio',
+            target = run_process,
+            args = (self.child_conn, self.status.name, engine_args,
+                    output, self.cpu, self.priority,
+                    logging.getLogger().level, self.log_format),
+            daemon = True)
+        self.process.start()
+        self.child_conn.close()
+        self.receiver = threading.Thread(name = 'receiver', target = self.receive, daemon = True)
+        self.receiver.start()
+        self.dispatcher = threading.Thread(name = 'dispatcher', target = self.run_dispatcher,
+                                           daemon = True)
+        self.dispatcher.start()
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.send(('stop',))
+            except OSError:
+                pass # already gone
+            self.receiver.join(timeout = 5.)
+            self.process.join(timeout = 5.)
+            if self.process.is_alive():
+                logging.warning('Audio process did not stop, terminating it')
+                self.process.terminate()
+            self.process = None
+            self.arrays.close()
+            self.status.close()
+            if self.output is not None:
+                self.output.close()
+                self.output = None
+        if self.dispatcher is not None:
+            self.tasks.put(None)
+            self.dispatcher.join()
+            self.dispatcher = None
+
+    def send(self, command):
+        with self.lock:
+            self.conn.send(command)
+
+    def receive(self):
+        while True:
+            try:
+                message = self.conn.recv() if self.conn.poll(output_interval) else None
+            except EOFError:
+                logging.error('Audio process gone')
+                return
+            if self.output is not None:
+                # Before 'stopped': the last blocks are in the ring by then
+                try:
+                    self.forward_output()
+                except Exception:
+                    logging.exception('Handing the output of the audio process over failed')
+            if message is None:
+                continue
+            kind = message[0]
+            if kind == 'stopped':
+                return
+            try:
+                if kind == 'boundary':
+                    if self.boundary_callback is not None:
+                        self.boundary_callback(message[1])
+                elif kind == 'take':
+                    self.recorder.update(*message[1:])
+                elif kind == 'event':
+                    self.dispatch(self.events.pop(message[1]))
+                elif kind == 'released':
+                    self.arrays.released(*message[1:])
+                elif kind == 'metrics':
+                    self.replies.put(message[1:])
+            except Exception:
+                logging.exception('Handling %r from the audio process failed'%kind)
+
+    def forward_output(self):
+        """Hand the output played since the last call to output_callback, in one block."""
+        output = self.output
+        n_written = output.n_written
+        size = len(output.data)
+        start = max(self.n_forwarded, n_written - size)
+        if start == n_written:
+            return
+        block = output.read(start, n_written)
+        # Overwritten while it was copied, if the audio thread went round
+        overwritten = output.n_written - size - start
+        if overwritten > 0:
+            block = block[overwritten:]
+        lost = start - self.n_forwarded + max(0, overwritten)
+        if lost > 0:
+            logging.warning('%d samples of output lost before output_callback'%lost)
+        self.n_forwarded = n_written
+        self.output_callback(block)
+
+    # Dispatcher, as PlaybackEngine's
+
+    def run_dispatcher(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            self.run_task(task)
+
+    def dispatch(self, function):
+        """Run function on the dispatcher thread, in order of submission."""
+        self.tasks.put(function)
+
+    def run_task(self, task):
+        start = perf_counter()
+        try:
+            task()
+        except Exception:
+            logging.exception('Dispatched task %r failed' % task)
+        if self.metrics is not None:
+            self.metrics.task.add(perf_counter()-start)
+
+    # Engine commands
+
+    def schedule(self, frame, function):
+        """Dispatch function once playback reaches the absolute frame."""
+        n = next(self.n_events)
+        self.events[n] = function
+        self.send(('schedule', frame, n))
+
+    def publish(self, loop, mode):
+        if isinstance(loop, np.ndarray):
+            loop = Loop.from_array(loop)
+        with self.lock:
+            version = next(self.versions)
+            spec = loop_spec(loop, partial(self.arrays.share, version = version))
+            playing = self.version
+            for v in [v for v in self.loops if v < playing]:
+                del self.loops[v]
+            self.loops[version] = loop
+            self.conn.send(('publish', version, spec, mode))
+
+    def set_loop(self, loop):
+        """Play loop from the next loop boundary on."""
+        self.publish(loop, 'boundary')
+
+    def record(self, recorder):
+        """
+        Record the input of the duplex stream in the audio process, into
+        the shared buffer of recorder, at its sample rate. Returns the
+        RemoteRecorder to arm and disarm takes with instead of recorder.
+        """
+        buffer = recorder.buffer
+        if not self.duplex:
+            raise ValueError('The audio process only records the input of a duplex stream')
+        if buffer.name is None:
+            raise ValueError('The RecordBuffer recorded in the audio process must be shared')
+        self.recorder = RemoteRecorder(self, buffer)
+        self.send(('record', (buffer.name,) + buffer.data.shape, recorder.sample_rate))
+        return self.recorder
+
+    def set_gains(self, gains):
+        """Mix the lanes of tracks with this (tracks, channels) matrix from the next block on."""
+        self.send(('gains', gains))
+
+    def start_loop(self, loop, keep_phase=False):
+        """Play loop from the next block on, see PlaybackEngine.start_loop()."""
+        self.publish(loop, 'phase' if keep_phase else 'restart')
+
+    def audio_metrics(self, reset = False, timeout = 1.):
+        """(as_dict(), summary()) of the metrics of the child, or None if it doesn't answer."""
+        self.send(('metrics', reset))
+        try:
+            return self.replies.get(timeout = timeout)
+        except queue.Empty:
+            return None
+
+    # Position, as of the last block played
+
+    def frame_time(self, frame):
+        """Stream time at which the absolute frame is played."""
+        status = self.status.read()
+        return status['block_time'] + (frame-status['block_frame'])/self.sample_rate
+
+    @property
+    def frame(self):
+        return int(self.status.read()['frame'])
+
+    @property
+    def current_time(self):
+        return self.status.read()['current_time']
+
+    @property
+    def origin(self):
+        return int(self.status.read()['origin'])
+
+    @property
+    def loop_start(self):
+        return int(self.status.read()['loop_start'])
+
+    @property
+    def pass_end(self):
+        return int(self.status.read()['pass_end'])
+
+    @property
+    def version(self):
+        return int(self.status.read()['version'])
+
+    @property
+    def loop(self):
+        """The loop playing."""
+        return self.loops.get(self.version)
@@ -0,0 +1,142 @@
+"""
+Measure the round-trip latency of the audio interface.
+
+A burst of noise is played and recorded back through a loopback cable
+(output plugged into input). The delay between the two is found to the
+sample by FFT cross-correlation, on top of the stream timestamps, and
+saved per device and block size (see utility/test_latency.py). Looper.trim
+then removes exactly that many samples from every take.
+"""
+import os
+import json
+import threading
+from datetime import datetime
+import numpy as np
+
+store_filename = os.path.expanduser('~/.pi-looper/latency.json')
+
+
+def test_signal(sample_rate, duration = 0.5, channels = 2, seed = 0):
+    """White noise burst, identical on all channels."""
+    rng = np.random.default_rng(seed)
+    noise = rng.uniform(-0.25, 0.25, int(duration*sample_rate)).astype('float32')
+    return np.tile(noise[:,np.newaxis], (1, channels))
+
+
+def measure_delay(played, recorded):
+    """
+    Number of samples by which recorded lags behind played,
+    from the peak of their cross-correlation (computed with FFTs).
+    """
+    if played.ndim > 1:
+        played = played.mean(axis = 1)
+    if recorded.ndim > 1:
+        recorded = recorded.mean(axis = 1)
+    n = len(played) + len(recorded)
+    n_fft = 1 << (n-1).bit_length()
+    correlation = np.fft.irfft(
+        np.fft.rfft(recorded, n_fft)*np.conj(np.fft.rfft(played, n_fft)),
+        n_fft)
+    # Only non-negative lags: the recording can't come before the signal
+    return int(np.argmax(correlation[:len(recorded)]))
+
+
+class Measurement(object):
+    """Plays the test signal and records the input, with stream timestamps."""
+
+    def __init__(self, sample_rate, channels, signal, record_time):
+        self.sample_rate = sample_rate
+        self.signal = signal
+        self.recording = np.zeros((int(record_time*sample_rate), channels), dtype = 'float32')
+        self.n_played = 0
+        self.n_recorded = 0
+        self.signal_time = None # stream time at which the signal starts playing
+        self.recording_time = None # stream time of the first recorded sample
+        self.done = threading.Event()
+
+    def output_callback(self, outdata, frames, time, status):
+        if self.signal_time is None:
+            self.signal_time = time.outputBufferDacTime
+        n = max(0, min(frames, len(self.signal)-self.n_played))
+        outdata[:n] = self.signal[self.n_played:self.n_played+n]
+        outdata[n:] = 0
+        self.n_played += frames
+
+    def input_callback(self, indata, frames, time, status):
+        if self.signal_time is None:
+            return
+        if self.recording_time is None:
+            self.recording_time = time.inputBufferAdcTime
+        n = max(0, min(frames, len(self.recording)-self.n_recorded))
+        self.recording[self.n_recorded:self.n_recorded+n] = indata[:n]
+        self.n_recorded += n
+        if self.n_recorded == len(self.recording):
+            self.done.set()
+
+    def latency(self):
+        """Round trip in seconds, beyond what the stream timestamps account for."""
+        delay = measure_delay(self.signal, self.recording)
+        return self.recording_time + delay/self.sample_rate - self.signal_time
+
+
+def calibrate(audio, sample_rate, channels = 2, blocksize = 0, latency = 0.05,
+              record_time = 1.5):
+    """Measure the round-trip latency of audio (needs a loopback)."""
+    signal = test_signal(sample_rate, channels = channels)
+    measurement = Measurement(sample_rate, channels, signal, record_time)
+
+    output_stream = audio.open_output(sample_rate, channels, blocksize, latency, measurement.output_callback)
+    input_stream = audio.open_input(sample_rate, channels, blocksize, latency, measurement.input_callback)
+    input_stream.start()
+    output_stream.start()
+    if audio.realtime:
+        finished = measurement.done.wait(timeout = 10*record_time)
+    else:
+        while not measurement.done.is_set():
+            audio.run(record_time)
+        finished = True
+    for stream in [output_stream, input_stream]:
+        stream.stop()
+        stream.close()
+    if not finished:
+        raise RuntimeError('Calibration did not record anything')
+    return measurement.latency()
+
+
+def key(device_name, blocksize, sample_rate = None):
+    if sample_rate is None:
+        return '%s|%d'%(device_name, blocksize) # measured before sample rates were configurable
+    return '%s|%d|%d'%(device_name, blocksize, sample_rate)
+
+
+def load(filename = store_filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save(device_name, blocksize, sample_rate, latency, filename = store_filename):
+    store = load(filename)
+    store[key(device_name, blocksize, sample_rate)] = {
+        'latency': latency,
+        'samples': int(round(latency*sample_rate)),
+        'sample_rate': sample_rate,
+        'date': datetime.now().isoformat(timespec = 'seconds'),
+    }
+    os.makedirs(os.path.dirname(filename), exist_ok = True)
+    with open(filename, 'w') as f:
+        json.dump(store, f, indent = 2)
+
+
+def stored_latency(device_name, blocksize, sample_rate, default = None, filename = store_filename):
+    """Calibrated latency of a device, block size and sample rate in seconds, or default."""
+    store = load(filename)
+    entry = store.get(key(device_name, blocksize, sample_rate))
+    if entry is None:
+        entry = store.get(key(device_name, blocksize))
+        if entry is None or entry.get('sample_rate') != sample_rate:
+            return default
+    return entry['latency']
+
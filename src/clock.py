@@ -0,0 +1,43 @@
+import time
+import heapq
+import itertools
+
+
+class Clock(object):
+    """Wall clock."""
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """
+    Clock that only moves when it is advanced, so that simulated sessions
+    run as fast as the CPU allows. sleep() advances the clock, and functions
+    registered with call_later() run once their time is reached.
+    """
+
+    def __init__(self, start = 0.):
+        self.now = start
+        self.timers = [] # heap of (time, n, function)
+        self.n_timers = itertools.count()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def call_later(self, delay, function):
+        heapq.heappush(self.timers, (self.now+delay, next(self.n_timers), function))
+
+    def advance(self, seconds):
+        target = self.now + seconds
+        while self.timers and self.timers[0][0] <= target:
+            t, n, function = heapq.heappop(self.timers)
+            self.now = max(self.now, t)
+            function()
+        self.now = max(self.now, target)
@@ -0,0 +1,71 @@
+"""
+Audio configuration: sample rate, channels, block size, stream latency,
+devices and duplex, in one object that every component is given.
+
+Settings come from a JSON file (by default ~/.pi-looper/audio.json, if
+it exists), then from the command line:
+
+    {"sample_rate": 48000, "blocksize": 64, "latency": 0.01,
+     "channels": 2, "input_device": "USB", "output_device": "USB"}
+
+    python3 core.py --sample-rate 48000 --blocksize 64
+
+Sounds of another sample rate or channel count (the metronome click,
+takes played in simulations) are converted when they are loaded, see
+assets.read_sound.
+"""
+import os
+import json
+
+default_filename = '~/.pi-looper/audio.json'
+
+
+class AudioConfig(object):
+
+    # Defaults
+    sample_rate = 44100
+    channels = 2 # 1 (mono) or more, pan only applies to stereo
+    blocksize = 0 # frames, 0 lets the audio driver choose
+    latency = 0.05 # seconds, asked to the audio driver
+    duplex = True # one stream for input and output, keeps takes sample-locked to playback
+    input_device = None # numeric ID or substring, None: the default device
+    output_device = None
+
+    settings = ['sample_rate', 'channels', 'blocksize', 'latency', 'duplex',
+                'input_device', 'output_device']
+
+    def __init__(self, **settings):
+        for name, value in settings.items():
+            if name not in self.settings:
+                raise ValueError('Unknown audio setting %r, use one of %s'%(name, self.settings))
+            setattr(self, name, value)
+        if self.sample_rate <= 0 or self.channels < 1 or self.blocksize < 0:
+            raise ValueError('Invalid audio configuration: %s'%self)
+
+    @classmethod
+    def load(cls, filename = default_filename, **settings):
+        """Settings of the file (if it exists), overridden by settings."""
+        filename = os.path.expanduser(filename)
+        stored = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                stored = json.load(f)
+        stored.update(settings)
+        return cls(**stored)
+
+    @classmethod
+    def from_args(cls, args):
+        """From the options of audio.argument_parser(), with their config file."""
+        settings = dict((name, getattr(args, name)) for name in cls.settings
+                        if getattr(args, name, None) is not None)
+        return cls.load(args.config or default_filename, **settings)
+
+    @property
+    def device(self):
+        return (self.input_device, self.output_device)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.settings)
+
+    def __repr__(self):
+        return 'AudioConfig(%s)'%', '.join('%s=%r'%item for item in self.as_dict().items())
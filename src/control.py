@@ -0,0 +1,413 @@
+"""
+Control of the looper over the network, in OSC messages.
+
+ControlServer listens for OSC 1.0 messages (or bundles of them) on a UDP
+port, so the looper can be scripted or driven by other gear, and sends a
+beat clock to the devices that subscribe to it, so they can follow its
+tempo. Messages (arguments in OSC type tags) and replies, which go back
+to the address of the sender:
+
+    /looper/trigger s:name     fire a trigger of the state machine: the
+                               taps of the buttons (release_rec_button,
+                               release_play_button, release_back_button),
+                               undo, clear or stop
+    /looper/undo               remove the last layer
+    /looper/clear              remove every layer
+    /looper/bpm [i:bpm]        set the tempo (in the metronome state only)
+                               -> /looper/bpm i:bpm
+    /looper/track [i:track]    select the track to record on
+                               -> /looper/track i:track
+    /looper/gain i:track f:gain
+    /looper/mute i:track i:mute
+    /looper/pan i:track f:pan  (-1 to 1)
+    /looper/state              -> /looper/state s:state i:track i:bpm
+    /looper/layers             -> /looper/layers i:layers, then the
+                               number of layers of every track
+    /looper/metrics            -> /looper/metrics s:json, see metrics.py
+                               (those of the audio process under 'audio')
+    /looper/ping ...           -> /looper/pong ... once every command
+                               received before is applied
+    /looper/subscribe          receive the beat clock
+    /looper/unsubscribe
+    (anything wrong)           -> /looper/error s:address s:reason
+
+Beat clock, on every beat played (not while paused or before play is
+first pressed):
+
+    /looper/beat i:beat i:beat_in_bar f:bpm f:delay
+
+beat is counted from the start of the loop, and the beat is heard delay
+seconds after the message is sent (the output latency, give or take the
+time to send it).
+
+Nothing here runs on the audio path. Datagrams are read on the 'control'
+thread by an asyncio event loop, as many as are waiting (up to
+batch_size), and handled as one batch: triggers are fired on that thread,
+like button taps by the input thread, while tempo and track settings
+(only the last of each in a batch) and replies that depend on them are
+handed to the dispatcher as one task. The time to handle a batch is
+recorded in metrics.control.
+
+Commands are not authenticated: anyone who can reach the port can clear
+the session. The looper only listens on this machine unless it is given
+another interface (core.control_host, '0.0.0.0' for all of them).
+"""
+import json
+import socket
+import struct
+import asyncio
+import logging
+import threading
+from functools import partial
+from time import perf_counter
+
+max_datagram = 65507
+# Seconds between looks at the beat grid, which tempo changes and new
+# loops move: the beat clock follows them that soon
+beat_check = 0.05
+
+# Triggers of the state machine that may be fired from outside
+triggers = ['release_rec_button', 'release_play_button', 'release_back_button',
+            'undo', 'clear', 'stop']
+
+
+# OSC 1.0 encoding
+
+def pad(data):
+    """data padded with zeros to a multiple of 4 bytes."""
+    return data + b'\0'*(-len(data) % 4)
+
+
+def encode_string(s):
+    return pad(s.encode('utf-8') + b'\0')
+
+
+def encode_message(address, args = ()):
+    """An OSC message: ints, floats, strings, bytes (blobs) and booleans."""
+    tags = ','
+    data = []
+    for arg in args:
+        if isinstance(arg, bool):
+            tags += 'T' if arg else 'F'
+        elif isinstance(arg, int):
+            tags += 'i'
+            data.append(struct.pack('>i', arg))
+        elif isinstance(arg, float):
+            tags += 'f'
+            data.append(struct.pack('>f', arg))
+        elif isinstance(arg, str):
+            tags += 's'
+            data.append(encode_string(arg))
+        elif isinstance(arg, bytes):
+            tags += 'b'
+            data.append(struct.pack('>i', len(arg)) + pad(arg))
+        else:
+            raise ValueError('No OSC type for %r'%(arg,))
+    return encode_string(address) + encode_string(tags) + b''.join(data)
+
+
+def encode_bundle(messages):
+    """An OSC bundle, to be run right away, of (address, args) messages."""
+    data = [b'#bundle\0', struct.pack('>q', 1)]
+    for address, args in messages:
+        message = encode_message(address, args)
+        data.append(struct.pack('>i', len(message)) + message)
+    return b''.join(data)
+
+
+def decode_string(data, offset):
+    end = data.find(b'\0', offset)
+    if end < 0:
+        raise ValueError('Unterminated OSC string')
+    return data[offset:end].decode('utf-8'), end + 4 - (end % 4)
+
+
+def decode(data):
+    """The (address, args) messages of an OSC message or bundle, ValueError if malformed."""
+    try:
+        if data.startswith(b'#bundle\0'):
+            messages = []
+            offset = 16
+            while offset < len(data):
+                size, = struct.unpack_from('>i', data, offset)
+                offset += 4
+                if size < 0 or offset + size > len(data):
+                    raise ValueError('Truncated OSC bundle')
+                messages += decode(data[offset:offset+size])
+                offset += size
+            return messages
+        address, offset = decode_string(data, 0)
+        if not address.startswith('/'):
+            raise ValueError('Not an OSC message')
+        if offset >= len(data):
+            return [(address, [])] # no type tags, as old implementations send
+        tags, offset = decode_string(data, offset)
+        args = []
+        for tag in tags[1:]:
+            if tag == 'i':
+                args.append(struct.unpack_from('>i', data, offset)[0])
+                offset += 4
+            elif tag == 'f':
+                args.append(struct.unpack_from('>f', data, offset)[0])
+                offset += 4
+            elif tag == 'h':
+                args.append(struct.unpack_from('>q', data, offset)[0])
+                offset += 8
+            elif tag == 'd':
+                args.append(struct.unpack_from('>d', data, offset)[0])
+                offset += 8
+            elif tag == 's':
+                arg, offset = decode_string(data, offset)
+                args.append(arg)
+            elif tag == 'b':
+                size, = struct.unpack_from('>i', data, offset)
+                args.append(data[offset+4:offset+4+size])
+                offset += 4 + size + (-size % 4)
+            elif tag in 'TF':
+                args.append(tag == 'T')
+            else:
+                raise ValueError('Unsupported OSC type tag %r'%tag)
+        if offset > len(data):
+            raise ValueError('Truncated OSC message')
+        return [(address, args)]
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError('Malformed OSC data: %s'%e)
+
+
+class ControlServer(object):
+    """
+    OSC control of looper on UDP host:port (port 0: any free one, see
+    self.port once started), see above. Tempos are set within bpm_range.
+    """
+
+    def __init__(self, looper, host = '127.0.0.1', port = 9000, batch_size = 256,
+                 bpm_range = (40, 300)):
+        self.looper = looper
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.bpm_range = bpm_range
+        self.metrics = looper.metrics
+        self.subscribers = set() # addresses the beat clock is sent to
+        self.counters = dict.fromkeys(['datagrams', 'commands', 'batches', 'errors',
+                                       'beats', 'unsent'], 0)
+        self.handlers = {
+            '/looper/trigger': self.trigger,
+            '/looper/undo': partial(self.trigger, name = 'undo'),
+            '/looper/clear': partial(self.trigger, name = 'clear'),
+            '/looper/bpm': self.bpm,
+            '/looper/track': self.track,
+            '/looper/gain': partial(self.track_setting, 'gain', float),
+            '/looper/mute': partial(self.track_setting, 'mute', bool),
+            '/looper/pan': partial(self.track_setting, 'pan', float),
+            '/looper/state': self.state,
+            '/looper/layers': self.layers,
+            '/looper/metrics': self.send_metrics,
+            '/looper/ping': self.ping,
+            '/looper/subscribe': self.subscribe,
+            '/looper/unsubscribe': self.unsubscribe,
+        }
+        # Of the batch being handled, for the dispatcher
+        self.settings = {} # (setting, track): value, the last one given
+        self.replies = [] # (client, address, function giving the args)
+
+        self.sock = None
+        self.loop = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        # Bound here, so that an address in use fails the caller
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((self.host, self.port))
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        self.loop = asyncio.new_event_loop()
+        self.loop.add_reader(self.sock, self.read)
+        self.running = True
+        self.thread = threading.Thread(name = 'control', target = self.run, daemon = True)
+        self.thread.start()
+        engine = self.looper.engine
+        self.schedule_beat(engine.frame)
+        logging.info('Control server on %s:%d'%(self.host, self.port))
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.thread = None
+        self.loop.remove_reader(self.sock)
+        self.loop.close()
+        self.sock.close()
+
+    # Control thread
+
+    def read(self):
+        batch = []
+        for i in range(self.batch_size):
+            try:
+                data, client = self.sock.recvfrom(max_datagram)
+            except (BlockingIOError, InterruptedError):
+                break
+            self.counters['datagrams'] += 1
+            try:
+                batch += [(client, address, args) for address, args in decode(data)]
+            except ValueError as e:
+                self.error(client, '', str(e))
+        if batch:
+            self.handle(batch)
+
+    def handle(self, batch):
+        """Run the commands of a batch, settings and replies that need them on the dispatcher."""
+        start = perf_counter()
+        for client, address, args in batch:
+            handler = self.handlers.get(address)
+            if handler is None:
+                self.error(client, address, 'unknown address')
+                continue
+            try:
+                handler(client, *args)
+            except (TypeError, ValueError, IndexError) as e:
+                self.error(client, address, str(e))
+        self.counters['commands'] += len(batch)
+        self.counters['batches'] += 1
+        if self.settings or self.replies:
+            self.looper.engine.dispatch(partial(self.apply, self.settings, self.replies))
+            self.settings = {}
+            self.replies = []
+        self.metrics.control.add(perf_counter()-start)
+
+    def send(self, client, address, args = ()):
+        try:
+            self.sock.sendto(encode_message(address, args), client)
+        except OSError:
+            self.counters['unsent'] += 1 # the client went away, or the buffer is full
+
+    def error(self, client, address, reason):
+        self.counters['errors'] += 1
+        logging.debug('Control command %r from %s:%d failed: %s'%((address,) + client + (reason,)))
+        self.send(client, '/looper/error', [address, reason])
+
+    def trigger(self, client, name):
+        if name not in triggers:
+            raise ValueError('unknown trigger %r'%name)
+        getattr(self.looper, name)()
+
+    def bpm(self, client, bpm = None):
+        if bpm is not None:
+            bpm = int(round(bpm))
+            if self.looper.state != 'metronome':
+                raise ValueError('the tempo is set in the metronome state')
+            if not self.bpm_range[0] <= bpm <= self.bpm_range[1]:
+                raise ValueError('bpm out of %d to %d'%self.bpm_range)
+            self.settings['bpm', None] = bpm
+        self.replies.append((client, '/looper/bpm', lambda: [self.looper.bpm]))
+
+    def track(self, client, track = None):
+        if track is not None:
+            self.check_track(track)
+            self.settings['track', None] = track
+        self.replies.append((client, '/looper/track', lambda: [self.looper.track]))
+
+    def track_setting(self, setting, kind, client, track, value):
+        self.check_track(track)
+        value = kind(value)
+        if setting == 'pan' and not -1 <= value <= 1:
+            raise ValueError('pan out of -1 to 1')
+        self.settings[setting, track] = value
+
+    def check_track(self, track):
+        if not (isinstance(track, int) and 0 <= track < len(self.looper.tracks)):
+            raise ValueError('no track %r'%(track,))
+
+    def state(self, client):
+        looper = self.looper
+        self.replies.append((client, '/looper/state',
+                             lambda: [looper.state, looper.track, looper.bpm]))
+
+    def layers(self, client):
+        tracks = self.looper.tracks
+        self.replies.append((client, '/looper/layers',
+                             lambda: [tracks.n_layers] + [len(t) for t in tracks]))
+
+    def ping(self, client, *args):
+        self.replies.append((client, '/looper/pong', lambda: list(args)))
+
+    def send_metrics(self, client):
+        # The audio process may take a while to answer, not on this thread
+        self.loop.run_in_executor(None, self.reply_metrics, client)
+
+    def reply_metrics(self, client):
+        looper = self.looper
+        metrics = looper.metrics.as_dict()
+        metrics['control'] = dict(self.counters)
+        if looper.audio_process:
+            audio = looper.engine.audio_metrics()
+            if audio is not None:
+                metrics['audio'] = audio[0]
+        if self.running:
+            self.loop.call_soon_threadsafe(self.send, client, '/looper/metrics',
+                                           [json.dumps(metrics)])
+
+    def subscribe(self, client):
+        self.subscribers.add(client)
+
+    def unsubscribe(self, client):
+        self.subscribers.discard(client)
+
+    def broadcast(self, address, args):
+        for client in list(self.subscribers):
+            self.send(client, address, args)
+
+    # Dispatcher
+
+    def apply(self, settings, replies):
+        looper = self.looper
+        touched = set()
+        for (setting, track), value in settings.items():
+            if setting == 'bpm':
+                if looper.state == 'metronome' and value != looper.bpm:
+                    looper.change_bpm(value - looper.bpm)
+            elif setting == 'track':
+                looper.select_track(value)
+            else:
+                setattr(looper.tracks[track], setting, value)
+                touched.add(track)
+        for track in sorted(touched):
+            looper.update_gains(track)
+        if self.running:
+            for client, address, args in replies:
+                self.loop.call_soon_threadsafe(self.send, client, address, args())
+
+    def schedule_beat(self, frame):
+        """Look again on the next beat from frame on, or beat_check seconds after frame."""
+        engine = self.looper.engine
+        origin = engine.origin
+        beat = origin + self.looper.timeline.next_frame(frame - origin)
+        beat = min(beat, frame + int(beat_check*self.looper.sample_rate))
+        engine.schedule(beat, partial(self.beat, beat))
+
+    def beat(self, frame):
+        # Runs once frame is played (computed, rather), sends the beat
+        # if frame is one on the grid of what plays then
+        if not self.running:
+            return
+        looper = self.looper
+        engine = looper.engine
+        timeline = looper.timeline
+        offset = frame - engine.origin
+        if timeline.next_frame(offset) == offset and looper.state not in ('init', 'pause'):
+            beat = int(round(offset/timeline.samples_per_beat))
+            delay = engine.frame_time(frame) - engine.current_time
+            self.counters['beats'] += 1
+            self.loop.call_soon_threadsafe(self.broadcast, '/looper/beat', [
+                beat, beat % timeline.beats_per_bar, float(timeline.bpm), float(delay)])
+        self.schedule_beat(frame + 1)
@@ -1,19 +1,37 @@
+import time
+started = time.perf_counter() # for the startup time breakdown
 import os
 import sys
-import shutil
-from gpiozero import LED, Button
-import time
+import json
 from datetime import datetime
+import atexit
 import threading
-from transitions import Machine, State
-import soundfile as sf
-import sounddevice as sd
-import numpy as np
+from functools import partial
 import daemons
+import dsp
+from engine import PlaybackEngine
+from audioprocess import EngineProcess
+from control import ControlServer
+from tracks import Tracks
+from timeline import Timeline, Loop
+from layers import LayerStore, wav_memmap, to_float
+from session import SessionWriter
+import session
+from metrics import Metrics, Stopwatch
+from assets import AssetCache
+from metronome import Metronome
+from machine import StateMachine
+from hardware import Hardware
+from inputs import Inputs
+import indicators
+from indicators import LEDs
+from clock import Clock
+from audio import SoundDeviceAudio
+from config import AudioConfig
+import calibration
 import logging
-from tempfile import gettempprefix
-from copy import deepcopy
 from functools import wraps
+imported = time.perf_counter()
 def timing(f):
     @wraps(f)
     def wrap(*args, **kw):
@@ -25,17 +43,29 @@ def timing(f):
         return result
     return wrap
 
-def restart_program(): 
-    led_circle()
+def restart_program(hardware, resume = None): 
+    hardware.led_circle()
     python = sys.executable
-    os.execl(python, python, * sys.argv) 
-
-# Setup logging
+    args = list(sys.argv)
+    if '--resume' in args:
+        i = args.index('--resume')
+        n = 2 if i+1 < len(args) and not args[i+1].startswith('-') else 1
+        del args[i:i+n]
+    args = [a for a in args if not a.startswith('--resume=')]
+    if resume is not None:
+        # Pick the session up where it was
+        args.append('--resume=%s'%resume)
+    os.execl(python, python, *args) 
+
+# Setup logging: records are queued where they are logged and written
+# by the output thread, which also drives the LEDs (see indicators.py)
 logging_level = logging.DEBUG
-logging.basicConfig(
-    level=logging_level,
-    format='(%(threadName)-10s) %(message)s')
-logging.getLogger('transitions').setLevel(logging_level)
+log_format = '(%(threadName)-10s) %(message)s'
+output = indicators.Worker()
+output.start()
+atexit.register(output.stop) # what was logged last is written
+indicators.queue_logging(output, logging_level, log_format,
+                         rate_limit = indicators.RateLimit(logging.DEBUG, burst = 5, interval = 1.))
 
 # Log all uncaught exceptions too
 def my_handler(type, value, tb):
@@ -43,6 +73,37 @@ def my_handler(type, value, tb):
 sys.excepthook = my_handler
         
 
+# Settings
+initial_bpm = 100
+min_bpm = 40
+max_bpm = 300
+bpm_step = 2 # every bpm_repeat_time while a tempo button is held
+bpm_repeat_time = 0.06 # seconds
+debounce_time = 0.02 # seconds
+long_press_time = 0.8 # seconds, hold back that long to undo the last layer
+mute_quantize = 'beat' # or 'bar', or None to mute right away
+metronome_prefetch = 8 # bars rendered ahead of the tempo buttons
+timing_precision = 0.1e-3 # milisecond
+fade_time = 0.01 # seconds
+fade_shape = 'linear' # or 'equal_power'
+default_latency = 50e-3 # seconds, until calibration.py has measured the interface
+max_recording_time = 120 # seconds
+n_tracks = 4
+layer_memory = 256e6 # bytes of RAM for the recorded layers, older ones are compacted
+layer_format = 'int16' # or 'float16', the format of compacted layers
+metrics_interval = 60 # seconds between metrics summaries in the log
+audio_process = True # on a sound card, the engine plays in a process of its own (see audioprocess.py)
+audio_cpu = None # CPU core the audio process is pinned to, None: any
+audio_priority = 70 # SCHED_FIFO priority of the audio process where permitted, None: normal
+control_host = '127.0.0.1' # interface of the OSC control server, '0.0.0.0': anyone on the network
+control_port = 9000 # UDP port of the OSC control server (see control.py), None: off
+asset_cache_directory = '~/.cache/pi-looper/' # decoded sounds and metronome bars, None: no cache
+recording_directory = '/home/pi/Desktop/pi-looper-data/'
+# An all-buttons restart carries on with the session instead of starting a
+# new one. Off by default, so a deliberate restart gives a fresh session as
+# it always did; the restart that follows a crash resumes regardless
+restart_resumes = False
+
 # try:
 #     # Cloud logging setup tutorial: https://cloud.google.com/logging/docs/setup/python
 #     # Cloud log viewer: https://console.cloud.google.com/logs/viewer?project=pi-looper&folder&organizationId&minLogLevel=0&expandAll=false&timestamp=2020-05-03T12:19:47.706000000Z&customFacets=&limitCustomFacetWidth=true&dateRangeStart=2020-05-03T11:19:22.962Z&interval=PT1H&resource=global&scrollTimestamp=2020-05-03T12:17:23.829686000Z&dateRangeUnbound=forwardInTime
@@ -77,405 +138,724 @@ class Looper(object):
         ['end_recording',              'pre_play',     'play'], # added current recording
         ['release_rec_button',          'pre_play',     'pre_rec'],
         ['release_back_button',         'pre_play',     'play'], # didnt add current recording
+        #
+        ['resume',                      'init',         'play'], # loaded a saved session
+        #
+        ['undo',                        'play',         'play',         'undo_last_layer'],
+        ['undo',                        'pre_rec',      'pre_rec',      'undo_last_layer'],
+        ['clear',       ['play', 'pre_rec', 'rec', 'pre_play'], 'metronome', 'clear_layers'],
+        ['stop',        ['metronome', 'play', 'pre_rec', 'rec', 'pre_play'], 'pause'],
+        ['release_play_button',         'pause',        'play'],
     ]
 
-    def __init__(self):
-
-        
-        self.latency = 50e-3 # seconds (half of what is measured in the test_latency script)
-        self.latency_samples = int(float(self.latency)*float(sample_rate))
+    def __init__(self, hardware = None, audio = None, clock = None,
+                 recording_directory = recording_directory, latency = None,
+                 resume = None, config = None, bpm = None):
+        """
+        By default the looper runs on the Pi's GPIO pins, the default sound
+        card and the wall clock; pass other implementations to run it
+        elsewhere (see simulation.py).
+
+        config (an AudioConfig, by default its defaults) sets the sample
+        rate, channels, block size, stream latency and devices.
+
+        latency (seconds) is removed from the start of every take, by default
+        it is the value calibration.py measured for this device, block size
+        and sample rate.
+
+        resume is the directory of a session to carry on with (see
+        load_session), otherwise a new session directory is made.
+
+        bpm is the tempo the metronome starts at, by default initial_bpm
+        (a resumed session carries on at its own).
+
+        How long each part of the startup takes is logged, and kept in
+        self.metrics.startup with the time of the first audio block and
+        of the first metronome beat.
+        """
+        self.startup = Stopwatch(started)
+        self.startup.lap('imports', imported)
+        self.startup.lap('setup')
+
+        self.config = AudioConfig() if config is None else config
+        self.clock = Clock() if clock is None else clock
+        self.hardware = Hardware(clock = self.clock) if hardware is None else hardware
+        self.audio = SoundDeviceAudio(self.config.device) if audio is None else audio
+        self.sample_rate = self.config.sample_rate
+        self.channels = self.config.channels
+        # Simulations keep the engine in this process, deterministic
+        self.audio_process = audio_process and self.audio.realtime
+        # LED commands are queued for the output thread, in simulations
+        # they run right away
+        self.leds = LEDs(self.hardware, output if self.audio.realtime else
+                         indicators.Worker(self.clock, threaded = False))
+        # Goes on while the rest starts up, then shows that play can be
+        # pressed (unless it already was)
+        self.leds.square(then = self.show_ready)
+        self.startup.lap('hardware')
+
+        if latency is None:
+            latency = calibration.stored_latency(
+                self.audio.name, self.config.blocksize, self.sample_rate, default = default_latency)
+            logging.debug('Latency: %.1f ms'%(1e3*latency))
+        self.latency = latency
+        self.latency_samples = int(float(self.latency)*float(self.sample_rate))
         
         self.n_loop = 0
-        self.n_loop_previous = 0
-        self.metronome_start_time = None
-        self.start_time = None
-        self.loops = []
-
-        self.machine = Machine(
-            model = self,
-            states = self.states, 
-            transitions = self.transitions, 
-            initial = 'init')
+        self.n_takes = 0 # stems are never overwritten, even by undone takes
+        self.loops = [] # (filename, take, track, start frame) not mixed into the loop yet
+        self.tracks = Tracks(n_tracks, self.channels,
+            lambda: LayerStore(layer_memory/n_tracks, layer_format))
+        self.track = 0 # the track new layers are recorded on
+
+        # Triggers ignored in a state (e.g. back released while playing)
+        # do nothing, LEDs and logging of transitions are left to a thread
+        self.machine = StateMachine(
+            self,
+            states = self.states,
+            transitions = self.transitions,
+            initial = 'init',
+            threaded = self.audio.realtime)
+        self.metrics = Metrics()
+        self.metrics.startup = self.startup
+        self.restart_requested = threading.Event() # all buttons held
+        self.assets = AssetCache(asset_cache_directory)
+        self.fade_samples = int(fade_time*self.sample_rate)
+        self.fade_curves = (dsp.fade_curve(self.fade_samples, fade_shape, 'in'),
+                            dsp.fade_curve(self.fade_samples, fade_shape, 'out'))
+        self.take_lane = None # the last take, played until it is mixed in
+        self.startup.lap('latency')
+        self.init_files(recording_directory, resume)
+        self.startup.lap('files')
+        self.init_recording()
+        self.startup.lap('recording')
+        self.init_audio()
+        self.startup.lap('audio')
+        # The buttons may be pressed as soon as they are set up
+        self.init_metronome(initial_bpm if bpm is None else bpm)
+        self.startup.lap('metronome')
         self.init_hardware()
-        self.init_files()
-        self.init_metronome()
-        
-        led_square()
-        play_led.on()
+        self.init_control()
 
-        # TODO: move this to a better place
-        self.fade_samples = int(fade_time*sample_rate)
-        self.fadein_mask = np.ones((self.fade_samples,2))
-        self.fadeout_mask = np.ones((self.fade_samples,2))
-        for i in range(self.fade_samples):
-            self.fadein_mask[i]*=i/self.fade_samples
-            self.fadeout_mask[-1-i]*=i/self.fade_samples
+        if resume is not None:
+            self.load_session(resume)
+        self.startup.lap('session')
 
-    def on_enter_metronome(self):
-        self.on_enter()
+        logging.info('Startup:\n%s'%self.startup.summary())
 
-        back_led.on()
-        forw_led.on()
+    def show_ready(self):
+        if self.state == 'init':
+            self.leds.play_led.on()
+
+    # State callbacks (see machine.py): on_enter_/on_exit_ run with the
+    # transition, show_ later on the effects thread
+
+    def on_enter_metronome(self):
         self.start_metronome()
 
-    def on_exit_metronome(self):
+    def show_metronome(self):
+        self.leds.all_leds_off()
+        self.leds.back_led.on()
+        self.leds.forw_led.on()
 
+    def on_exit_metronome(self):
+        self.session.journal('bpm', bpm = self.bpm)
 
-        if len(self.metronome_sound) > self.samples_per_beat():
-            self.metronome_loop = self.metronome_sound[:self.samples_per_beat()]
-        else:
-            self.metronome_loop = np.zeros((self.samples_per_beat(),2), dtype = 'float32')
-            self.metronome_loop[:len(self.metronome_sound)] = self.metronome_sound
+        self.metronome_loop = self.metronome_bar()
+        self.engine.dispatch(partial(self.metronome.save, self.bpm))
 
-        # Make it 4/4
-        self.metronome_loop = np.concatenate((self.metronome_loop,np.tile(self.metronome_loop/2,(3,1))))
+        # will set the loop to be the metronome loop. The metronome bar
+        # keeps playing until the next loop boundary, where loop_boundary()
+        # starts the recording
+        self.engine.dispatch(self.update_loop)
 
-        self.update_loop() # will set the loop to be the metronome loop
+    def metronome_bar(self):
+        # A read-only Loop, from the metronome's cache
+        return self.metronome.bar(self.bpm)
 
-        time_to_1 = self.metronome_start_time + (4-self.beat)*60/self.bpm - time.time()
-        self.player_thread = threading.Timer(time_to_1, self.loop_player) # start playing the loop
-        self.player_thread.daemon = False
-        self.player_thread.start()
+    def prefetch_metronome(self, step = 0):
+        """Have the bars of the next tempos rendered by the dispatcher."""
+        if step == 0:
+            bpms = [self.bpm + bpm_step*i for i in range(-metronome_prefetch//2, metronome_prefetch//2+1)]
+        else:
+            bpms = [self.bpm + step*i for i in range(1, metronome_prefetch+1)]
+        bpms = [bpm for bpm in bpms if min_bpm <= bpm <= max_bpm]
+        self.engine.dispatch(partial(self.metronome.prefetch, bpms))
 
     @timing
     def update_loop(self):
         logging.debug('Updating loop ...')
         if self.n_loop > 0:
-            if self.n_loop != self.n_loop_previous:
-                
-                self.n_loop_previous = self.n_loop
-
-                loop_lengths = [len(l) for l in self.loops[:self.n_loop]]
-                
-                # Round the longest loop to a certain number of beats
-                loop_n_samples = round(max(loop_lengths)/self.samples_per_beat())*self.samples_per_beat()
-
-                loop = np.zeros((loop_n_samples,2), dtype = 'float32')
-                for l in self.loops:
-
-                    # trim
-                    l = self.trim(l)
-                    # fade in/out
-                    l = self.fade(l)
-
-                    # stitch N versions of the sample together and add to master loop
-                    loop += np.tile(l,(round(loop_n_samples/len(l)),1))
-
-                self.loop = loop
-                
-                self.second_half_loop = deepcopy(self.loop[len(self.half_loop):])
+            if self.loops:
+
+                # Only the layers recorded since the last update are
+                # trimmed, faded and added to the master loop, which
+                # keeps them from then on
+                for filename, take, track, start in self.loops:
+                    period = self.timeline.period(self.timeline.beats(len(take)))
+                    layer = self.prepare_layer(take)
+                    ts = time.perf_counter()
+                    self.tracks.add(track, layer, period, start, filename, self.prepare_layer)
+                    self.metrics.mix.add(time.perf_counter()-ts)
+                self.loops = []
+
+                self.loop = self.tracks.loop
         else:
             logging.debug('Loop is just the metronome')
-            self.loop = deepcopy(self.metronome_loop)
+            self.loop = self.metronome_loop
+
+        # Only ever replaced on the dispatcher thread, and never modified
+        # once published: the engine may be playing it
+        self.engine.set_loop(self.loop)
 
-        self.loop_time = float(len(self.loop))/float(sample_rate)
+        self.loop_time = float(len(self.loop))/float(self.sample_rate)
         logging.debug('Loop duration:  %.2f s'%(self.loop_time))
 
+    def prepare_layer(self, take, latency_samples = None):
+        # the take is only used here, fade it in place
+        layer = self.trim(take, latency_samples = latency_samples)
+        return self.fade(layer, out = layer)
+
     @timing
-    def trim(self, loop):
+    def trim(self, loop, out = None, latency_samples = None):
 
         # Number of samples there should be in this loop
-        loop_n_samples = round(len(loop)/self.samples_per_beat())*self.samples_per_beat()
+        loop_n_samples = self.timeline.length(self.timeline.beats(len(loop)))
 
-        # Adjust for latency
-        if loop_n_samples>len(loop)-self.latency_samples:
-            trimmed_loop = np.zeros((loop_n_samples,2))
-            trimmed_loop[:len(loop)-self.latency_samples] += loop[self.latency_samples:len(loop)]
-        else:
-            trimmed_loop = loop[self.latency_samples:loop_n_samples+self.latency_samples]
+        # Adjust for latency (that of the session a take was recorded in,
+        # for reloaded ones)
+        if latency_samples is None:
+            latency_samples = self.latency_samples
+        return dsp.trim(loop, loop_n_samples, offset = latency_samples, out = out)
 
-        return trimmed_loop
+    def fade(self, loop, where = ('in','out'), out = None):
+        return dsp.fade(loop, self.fade_samples, where, shape = fade_shape, out = out)
 
-    def fade(self, loop, where = ['in','out']):
-        
-        # Fade in/out
-        if 'in' in where:
-            loop[:self.fade_samples]*=self.fadein_mask
-        if 'out' in where:
-            loop[-self.fade_samples:]*=self.fadeout_mask
-        return loop
-
-    def loop_player(self):
-        
-        if self.start_time is None:
-            self.start_time = time.time()
-            logging.debug('Starting time set')
-        else:
-            self.start_time += self.loop_time
+    def loop_boundary(self, frame):
+        # Called from the audio callback at the first frame of every loop
+        # (just after it, from the receiver thread, with an audio
+        # process), so it only flips flags and hands the real work to the
+        # dispatcher
 
         # At beginning of loop, exit pre- states
         if self.state == 'pre_rec':
-            self.start_recording()
-            t = threading.Timer(self.loop_time/2+timing_precision,self.half_end_recording)
-            t.daemon = False
-            t.start()
-            audio_out.write(self.loop)
+            if self.take_lane is not None:
+                # The last take is still played from the record buffer if
+                # it isn't mixed in yet, not the one about to overwrite it
+                self.take_lane.silence()
+                self.take_lane = None
+            self.take_start = frame
+            self.recorder.arm(self.engine.frame_time(frame))
+            self.engine.dispatch(self.start_recording)
 
         elif self.state == 'pre_play':
-            t = threading.Timer(0,self.end_recording)
-            t.daemon = False
-            t.start()
-            audio_out.write(self.half_loop)
-            audio_out.write(self.second_half_loop)
+            self.recorder.disarm(self.engine.frame_time(frame))
+            self.monitor_take(frame)
+            self.engine.dispatch(self.end_recording)
+
+    def monitor_take(self, frame):
+        """
+        Play the take that ends at frame from this pass on, on top of the
+        loop: straight from the record buffer, as update_loop will mix it
+        in (which replaces this loop from the next boundary on).
+        """
+        beats = self.timeline.beats(frame - self.take_start)
+        loop = self.engine.loop
+        if loop is None or loop.tracks is None:
+            # The metronome, which the first layer replaces
+            lanes, origin = [], self.take_start
         else:
-            audio_out.write(self.loop)
-
-        # Schedule this function to play in a loop-durations time
-        self.player_thread = threading.Timer(self.time_to_next_loop_start(),self.loop_player)
-        self.player_thread.daemon = False
-        self.player_thread.start()
-
-
-
-    def init_files(self):
+            lanes, origin = loop.lanes, loop.origin
+        self.take_lane = daemons.TakeLane(
+            self.recording_buffer, self.timeline.length(beats), self.timeline.period(beats),
+            start = self.take_start - origin, latency = self.latency_samples,
+            fades = self.fade_curves, track = self.track)
+        # In phase, its passes counted from origin: not a boundary, which
+        # would end the take again
+        self.engine.start_loop(Loop(lanes + [self.take_lane], origin = origin), keep_phase = True)
+
+    def init_audio(self):
+        if self.audio_process:
+            self.engine = EngineProcess(
+                self.sample_rate,
+                channels = self.channels,
+                blocksize = self.config.blocksize,
+                latency = self.config.latency,
+                audio = self.audio,
+                duplex = self.config.duplex,
+                metrics = self.metrics,
+                cpu = audio_cpu,
+                priority = audio_priority,
+                log_format = log_format)
+        else:
+            self.engine = PlaybackEngine(
+                self.sample_rate,
+                channels = self.channels,
+                blocksize = self.config.blocksize,
+                latency = self.config.latency,
+                audio = self.audio,
+                duplex = self.config.duplex,
+                metrics = self.metrics)
+        self.engine.boundary_callback = self.loop_boundary
+        self.engine.output_callback = self.session.master_block
+        self.engine.set_gains(self.tracks.gains())
+        if not self.config.duplex:
+            self.recorder.start()
+        elif self.audio_process:
+            # Recorded in the audio process, straight into the shared buffer
+            self.recorder = self.engine.record(self.recorder)
+        else:
+            self.engine.input_callback = self.recorder.process
+        self.engine.schedule(0, partial(self.startup.mark, 'first block'))
+        self.engine.start()
+        self.schedule_metrics_report()
+
+    def schedule_metrics_report(self):
+        self.engine.schedule(
+            self.engine.frame + int(metrics_interval*self.sample_rate),
+            self.report_metrics)
+
+    def report_metrics(self):
+        # Runs on the dispatcher, every metrics_interval seconds of audio
+        self.log_metrics()
+        self.schedule_metrics_report()
+
+    def log_metrics(self):
+        logging.info('Metrics:\n%s'%self.metrics.summary())
+        self.metrics.dump(self.recording_directory + 'metrics.json')
+        if self.audio_process:
+            # Those of the audio thread are kept by the audio process
+            metrics = self.engine.audio_metrics()
+            if metrics is not None:
+                logging.info('Audio process metrics:\n%s'%metrics[1])
+                with open(self.recording_directory + 'audio_metrics.json', 'w') as f:
+                    json.dump(metrics[0], f, indent = 2)
+
+    def init_recording(self):
+        # In shared memory for the audio process to play takes from
+        self.recording_buffer = daemons.RecordBuffer(
+            int(max_recording_time*self.sample_rate), self.channels, shared = self.audio_process)
+
+        # Stems, master and journal are written in the background
+        # (right away in simulations, see session.py)
+        self.session = SessionWriter(
+            self.recording_directory, self.sample_rate, self.channels, threaded = self.audio.realtime)
+        self.session.start()
+        self.session.journal('session', version = session.journal_version,
+                             sample_rate = self.sample_rate, channels = self.channels,
+                             n_tracks = n_tracks, time = self.clock.time())
+
+        self.recorder = daemons.Recorder(
+            self.recording_buffer,
+            self.sample_rate,
+            blocksize = self.config.blocksize,
+            latency = self.config.latency,
+            audio = self.audio,
+            metrics = self.metrics)
+
+    def init_files(self, recording_directory, resume = None):
         
-        self.repo_directory = '/home/pi/Desktop/pi-looper/'
-        self.src_directory = '/home/pi/Desktop/pi-looper/src/'
-        self.recording_directory = recording_directory + datetime.fromtimestamp(
-            time.time()).strftime('%Y-%m-%d__%H-%M-%S/')
-        os.mkdir(self.recording_directory)
-        time.sleep(timing_precision)
+        self.src_directory = os.path.dirname(os.path.abspath(__file__))+'/'
+        self.repo_directory = os.path.dirname(os.path.dirname(self.src_directory))+'/'
+        if resume is not None:
+            # Carry on writing in the session that is resumed
+            self.recording_directory = os.path.join(resume, '')
+        else:
+            self.recording_directory = os.path.join(recording_directory, datetime.fromtimestamp(
+                self.clock.time()).strftime('%Y-%m-%d__%H-%M-%S/'))
+            os.mkdir(self.recording_directory)
+            self.clock.sleep(timing_precision)
         self.loop_filename = self.recording_directory+'loop_{:03d}.wav'
+        self.n_takes = len([f for f in os.listdir(self.recording_directory)
+                            if f.startswith('loop_') and f.endswith('.wav')])
 
-    def init_metronome(self):
-        self.bpm = initial_bpm
-        self.beat = -1
+    def init_metronome(self, bpm):
+        self.bpm = bpm
+        self.timeline = Timeline(self.sample_rate, self.bpm)
         metronome_file = self.src_directory+'data/high_hat_001.wav'
-        # Extract data and sampling rate from file
-        self.metronome_sound, metronome_sr = sf.read(metronome_file, dtype='float32')
-        if metronome_sr != sample_rate:
-            raise RuntimeError('Wrong metronome sample rate: %d instead of %d'%(metronome_sr,sample_rate))
+        # Decoded once, then read from the asset cache
+        self.metronome = Metronome(
+            self.sample_rate, self.assets.sound(metronome_file, self.sample_rate, self.channels),
+            channels = self.channels, beats_per_bar = self.timeline.beats_per_bar, assets = self.assets)
+        self.metronome_bar() # ready for the first press of play
+        self.engine.dispatch(partial(self.metronome.save, self.bpm))
+        self.prefetch_metronome()
     
     def start_metronome(self):
-        if self.state == 'metronome' or (self.state=='pre_rec' and self.beat in [0,1,2]):
-
-            self.beat = (self.beat +1) %4
-
-            if self.metronome_start_time is None:
-                self.metronome_start_time = time.time()
-                logging.debug('Starting time set')
-            else:
-                self.metronome_start_time += 60/self.bpm
-
-            if self.beat == 0:
-                sound = self.metronome_sound
-            else:
-                sound = self.metronome_sound/2
-
-            audio_out.write(sound[:min(self.samples_per_beat(),len(self.metronome_sound))-timing_precision_samples])
-
-            time_to_next_beat = self.metronome_start_time + 60/self.bpm - time.time()
-            t = threading.Timer(time_to_next_beat,self.start_metronome)
-            t.daemon = False
-            t.start()
+        self.engine.start_loop(self.metronome_bar())
+        if not self.startup.has('first beat'):
+            self.engine.schedule(self.engine.frame, self.log_first_beat)
+
+    def log_first_beat(self):
+        self.startup.mark('first beat')
+        logging.info('First beat %.0f ms after start'%(1e3*self.startup.marks[-1][1]))
+
+    def change_bpm(self, step):
+        self.bpm += step
+        self.timeline = Timeline(self.sample_rate, self.bpm)
+        logging.debug("bpm = %d"%self.bpm)
+        # Keep the current position in the bar so the tempo change is smooth
+        self.engine.start_loop(self.metronome_bar(), keep_phase = True)
+        self.prefetch_metronome(step)
 
     def seconds_per_beat(self):
         return 60./float(self.bpm)
     
     def samples_per_beat(self):
-        return int(sample_rate*self.seconds_per_beat())
+        # exact, a Fraction
+        return self.timeline.samples_per_beat
+
+    def step_bpm(self, step):
+        if min_bpm <= self.bpm + step <= max_bpm:
+            self.change_bpm(step)
+
+    # Held tempo buttons repeat their step (see inputs.py)
 
     def press_forw_button(self):
         if self.state == 'metronome':
-            while forw_button.is_active and self.bpm < 300:
-                back_led.off()
-                self.bpm += 2
-                logging.debug("bpm = %d"%self.bpm)
-                time.sleep(0.06)
-            back_led.on()
+            self.leds.back_led.off()
+            self.step_bpm(+bpm_step)
+        elif self.state == 'play':
+            self.select_track((self.track+1) % len(self.tracks))
+
+    def repeat_forw_button(self):
+        if self.state == 'metronome':
+            self.step_bpm(+bpm_step)
+
+    def tempo_button_released(self):
+        if self.state == 'metronome':
+            self.leds.back_led.on()
+            self.leds.forw_led.on()
 
     def press_back_button(self):
         if self.state == 'metronome':
-            while back_button.is_active and self.bpm > 40:
-                forw_led.off()
-                self.bpm -= 2
-                logging.debug("bpm = %d"%self.bpm)
-                time.sleep(0.06)
-            forw_led.on()
+            self.leds.forw_led.off()
+            self.step_bpm(-bpm_step)
+
+    def repeat_back_button(self):
+        if self.state == 'metronome':
+            self.step_bpm(-bpm_step)
+
+    def tap_back_button(self):
+        # Only taps in play mute, not those that cancel a take (which
+        # release_back_button turns into play): the state is tested when
+        # the tap happens, the mute may come on the next beat or bar
+        if self.state != 'play':
+            return
+        if mute_quantize is None:
+            self.toggle_mute(self.track)
+        else:
+            self.quantize(mute_quantize, partial(self.toggle_mute, self.track))
+
+    # Tracks. Gain, mute and pan changes are heard from the next audio block
+
+    def select_track(self, track):
+        """Record the next layers on track (the forw LED blinks its number)."""
+        self.track = track
+        logging.debug('Track %d selected'%track)
+        self.leds.forw_led.blink(on_time = 0.1, off_time = 0.15, n = track+1)
+
+    def set_gain(self, track, gain):
+        self.tracks[track].gain = gain
+        self.update_gains(track)
+
+    def set_mute(self, track, mute = True):
+        self.tracks[track].mute = mute
+        self.update_gains(track)
+
+    def toggle_mute(self, track):
+        self.set_mute(track, not self.tracks[track].mute)
+        logging.debug('Track %d %s'%(track, 'muted' if self.tracks[track].mute else 'unmuted'))
+
+    def set_pan(self, track, pan):
+        self.tracks[track].pan = pan
+        self.update_gains(track)
+
+    def update_gains(self, track = None):
+        self.engine.set_gains(self.tracks.gains())
+        if track is not None:
+            t = self.tracks[track]
+            self.session.journal('track', track = track, gain = t.gain,
+                                 mute = t.mute, pan = t.pan)
 
     def init_hardware(self):
 
-        # Button events
-        rec_button.when_deactivated = self.release_rec_button
-        play_button.when_deactivated = self.release_play_button
-        back_button.when_deactivated = self.release_back_button
-        forw_button.when_activated = self.press_forw_button
-        back_button.when_activated = self.press_back_button
+        # Button edges are timestamped and debounced as they come, and
+        # handled in order on a single input thread
+        self.inputs = Inputs(
+            self.hardware, self.clock,
+            threaded = self.audio.realtime,
+            debounce_time = debounce_time,
+            long_press_time = long_press_time,
+            repeat_interval = bpm_repeat_time,
+            metrics = self.metrics,
+            quantizer = self.quantize)
+        on = self.inputs.on
+        # Held, rec clears every layer, play stops and back undoes the last
+        # layer: their transitions are on taps, not on every release
+        on('tap', 'rec', self.release_rec_button)
+        on('tap', 'play', self.release_play_button)
+        on('tap', 'back', self.tap_back_button) # before the transition it may cause
+        on('tap', 'back', self.release_back_button)
+        on('long_press', 'rec', self.clear)
+        on('long_press', 'play', self.stop)
+        on('long_press', 'back', self.undo)
+        on('press', 'forw', self.press_forw_button)
+        on('repeat', 'forw', self.repeat_forw_button)
+        on('release', 'forw', self.tempo_button_released)
+        on('release', 'back', self.tempo_button_released)
+        on('press', 'back', self.press_back_button)
+        on('repeat', 'back', self.repeat_back_button)
+        on('all', None, self.restart_requested.set)
+        self.inputs.start()
 
         self.blink_on_time = 60./240. #seconds
 
+    def init_control(self):
+        # On the network, not in simulations
+        self.control = None
+        if control_port is None or not self.audio.realtime:
+            return
+        self.control = ControlServer(self, control_host, control_port,
+                                     bpm_range = (min_bpm, max_bpm))
+        try:
+            self.control.start()
+        except OSError as e:
+            logging.warning('No control server on port %d: %s'%(control_port, e))
+            self.control = None
+
+    def quantize(self, to, function):
+        """Run function on the dispatcher on the next 'beat' or 'bar' of what is playing."""
+        n_beats = 1 if to == 'beat' else self.timeline.beats_per_bar
+        origin = self.engine.origin
+        frame = origin + self.timeline.next_frame(self.engine.frame - origin, n_beats)
+        self.engine.schedule(frame, function)
+
     def start_recording(self):
-        record_flag.set()
-        self.trigger('start_recording')
+        self.machine.trigger('start_recording')
 
     def end_recording(self):
-        record_flag.clear()
+        # The input stream lags behind the boundary, wait for the last block
+        self.recorder.wait(timeout = 1.)
         self.add_recording_to_loops()
         self.update_loop()
-        self.trigger('end_recording')
-
-    def half_end_recording(self):
-        sound, sr = sf.read(temp_recording_filename, dtype='float32')
-        n_samples_half_loop = int(len(self.loop)/2)
-        self.half_loop = deepcopy(self.loop[:n_samples_half_loop])
+        self.machine.trigger('end_recording')
 
-        # If this is the first recording, 
-        # we want to remove the metronome
-        if self.n_loop == 0:
-            self.half_loop *= 0
+    @timing
+    def add_recording_to_loops(self):
+        # Extract audio, the buffer is reused by the next take
+        sound = self.recording_buffer.view().copy()
+
+        # Saving to disk happens in the background, the journal entry
+        # is written once the stem is on disk
+        loop_filename = self.loop_filename.format(self.n_takes)
+        self.n_takes += 1
+        self.session.write_stem(loop_filename, sound)
+        self.session.journal('layer', file = os.path.basename(loop_filename),
+                             track = self.track, beats = self.timeline.beats(len(sound)),
+                             start = self.take_start, latency = self.latency_samples)
+        
+        self.loops.append((loop_filename, sound, self.track, self.take_start))
+        self.n_loop += 1
 
-        sound = self.trim(sound[:n_samples_half_loop+self.latency_samples])
-        sound = self.fade(sound, where = 'in')
-        self.half_loop += sound
+    def undo_last_layer(self):
+        self.engine.dispatch(self.remove_last_layer)
 
+    def clear_layers(self):
+        self.recorder.disarm()
+        self.engine.dispatch(self.remove_all_layers)
 
-    def add_recording_to_loops(self):
-        # Extract audio
-        loop_filename = self.loop_filename.format(self.n_loop)
-        ts = time.time()
-        shutil.copyfile(temp_recording_filename, loop_filename)
-        te = time.time()
-        logging.debug('Copying file took:  %.0f ms'%((te-ts)*1e3))
+    @timing
+    def remove_all_layers(self):
+        # Back to the metronome, the tracks keep their settings
+        self.loops = []
+        self.tracks.clear()
+        self.n_loop = 0
+        self.session.journal('clear')
+        logging.debug('Removed every layer')
+        # The metronome started on entering its state, start it again after
+        # the tasks dispatched before (e.g. a recording ending) set a loop
+        self.loop = self.metronome_bar()
+        self.loop_time = float(len(self.loop))/float(self.sample_rate)
+        self.engine.start_loop(self.loop)
 
-        ts = time.time()
-        sound, sr = sf.read(loop_filename, dtype='float32')
-        te = time.time()
-        logging.debug('Reading file took: %.0f ms'%((te-ts)*1e3))
-        
-        self.loops.append(sound)
-        self.n_loop += 1
+    @timing
+    def remove_last_layer(self):
+        if self.n_loop == 0:
+            return
+        if self.loops:
+            self.loops.pop()
+        else:
+            self.tracks.pop() # subtracts the layer from its track
+        self.n_loop -= 1
+        self.session.journal('undo')
+        logging.debug('Removed layer %d'%self.n_loop)
 
-    def on_enter(self):
-        all_leds_off()
+        if self.n_loop > 0:
+            self.loop = self.tracks.loop
+            self.loop_time = float(len(self.loop))/float(self.sample_rate)
+            self.engine.set_loop(self.loop)
+        else:
+            self.update_loop()
+
+    def load_session(self, directory):
+        """
+        Play the layers of the session saved in directory (e.g. before a
+        restart or a crash), from the tempo and track settings it had.
+
+        Stems are memory mapped and prepared one per dispatcher task,
+        playback starting with the first one: nothing is decoded up front.
+        """
+        state = session.load(directory)
+        if not state.layers:
+            logging.info('No layers to resume in %s'%directory)
+            return False
+        if state.sample_rate != self.sample_rate or state.channels != self.channels:
+            raise RuntimeError('Session recorded at %d Hz on %s channels, not %d Hz on %d'%(
+                state.sample_rate, state.channels, self.sample_rate, self.channels))
+        self.bpm = state.bpm
+        self.timeline = Timeline(self.sample_rate, self.bpm)
+        self.metronome_loop = self.metronome_bar() # once every layer is undone
+        self.session.journal('bpm', bpm = self.bpm)
+        for track, settings in state.tracks.items():
+            for name, value in settings.items():
+                setattr(self.tracks[int(track)], name, value)
+            self.update_gains(int(track))
+
+        # Start frames of the old session, moved to the current one
+        first_start = state.layers[0]['start']
+        origin = self.engine.frame
+        self.session.journal('resume', origin = origin, first_start = first_start)
+        logging.info('Resuming %d layers of %s'%(len(state.layers), directory))
+        for event in state.layers:
+            self.n_loop += 1
+            self.engine.dispatch(partial(self.load_layer, directory, event,
+                                         origin + event['start'] - first_start))
+        self.machine.trigger('resume')
+        return True
+
+    def load_layer(self, directory, event, start):
+        filename = os.path.join(directory, event['file'])
+        session.repair_wav(filename) # the writer may not have closed it
+        take = wav_memmap(filename)
+        if take is None:
+            logging.warning('Could not read %s, skipping it'%filename)
+            self.n_loop -= 1
+            return
+        prepare = partial(self.prepare_layer, latency_samples = event['latency'])
+        self.tracks.add(event['track'], prepare(to_float(take)),
+                        self.timeline.period(event['beats']), start, filename, prepare)
+        self.loop = self.tracks.loop
+        self.loop_time = float(len(self.loop))/float(self.sample_rate)
+        self.engine.set_loop(self.loop)
 
     def on_enter_play(self):
-        self.on_enter()
+        self.recorder.disarm()
 
-        play_led.on()
-        record_flag.clear()
+    def show_play(self):
+        self.leds.all_leds_off()
+        self.leds.play_led.on()
 
-    def on_enter_rec(self):
-        self.on_enter()
-        rec_led.on()
-    
-    def time_to_next_loop_start(self):
-        t = self.start_time + self.loop_time - time.time()
-        # logging.debug('Time to next loop start = %.1f ms'%(t*1e3))
-        return t
-    
+    def show_rec(self):
+        self.leds.all_leds_off()
+        self.leds.rec_led.on()
 
-    def on_enter_pre_play(self):
-        self.on_enter()
-        self.blink(play_led)
-    
-        
+    def show_pre_play(self):
+        self.leds.all_leds_off()
+        self.blink(self.leds.play_led)
+
+    def show_pre_rec(self):
+        self.leds.all_leds_off()
+        self.blink(self.leds.rec_led)
 
     def blink(self, led):
         led.blink(on_time = self.blink_on_time, off_time= self.seconds_per_beat()-self.blink_on_time)
-        
 
-    def on_enter_pre_rec(self):
-        self.on_enter()        
-        self.blink(rec_led)
+    def on_enter_pause(self):
+        self.recorder.disarm()
+        self.engine.start_loop(None)
+        # Again once the tasks already dispatched (which may set a loop) ran
+        self.engine.dispatch(partial(self.engine.start_loop, None))
 
+    def on_exit_pause(self):
+        self.engine.dispatch(self.restart_loop)
+
+    def show_pause(self):
+        self.leds.all_leds_off()
+
+    def restart_loop(self):
+        # From its start, in time with the passes of the layers
+        self.loop = self.tracks.loop if self.tracks.loop is not None else self.metronome_bar()
+        self.loop_time = float(len(self.loop))/float(self.sample_rate)
+        self.engine.start_loop(self.loop)
 
     def kill(self):
         logging.debug('Stopping looper...')
-        audio_out.stop()
-        record_flag.clear()
-        time.sleep(0.1)
-
-def all_leds_off():
-    for l in [rec_led,play_led,back_led,forw_led]:
-        l.off()
-def led_square():
-    all_leds_off()
-    for l in [rec_led,forw_led,play_led,back_led]:
-        l.on()
-        time.sleep(0.1)
-        l.off()
-def led_circle():
-    all_leds_off()
-    for l in [rec_led,play_led,forw_led,back_led]:
-        l.on()
-        time.sleep(0.1)
-        l.off()
+        if self.control is not None:
+            self.control.stop()
+        self.inputs.stop()
+        self.machine.stop()
+        if self.audio_process:
+            self.log_metrics() # while the audio process runs
+        self.engine.stop()
+        self.recorder.stop()
+        self.recording_buffer.close()
+        self.session.stop()
+        if not self.audio_process:
+            self.log_metrics()
+        self.clock.sleep(0.1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.kill()
 
 if __name__ == "__main__":
+    import sounddevice as sd
+    from audio import argument_parser
+    parser = argument_parser('Raspberry Pi looper')
+    parser.add_argument(
+        '--separate-streams', dest='duplex', action='store_false', default=None,
+        help='record and play on two streams instead of a single duplex one')
+    parser.add_argument(
+        '--resume', nargs='?', const='last', metavar='DIRECTORY',
+        help='carry on with a saved session (default: the last one)')
+    args = parser.parse_args()
+    config = AudioConfig.from_args(args)
+    logging.info('Audio: %s'%config)
+
+    hardware = Hardware()
+    looper = None
     try:
-        # Settings
-        initial_bpm = 100
-        sample_rate = 44100
-        timing_precision = 0.1e-3 # milisecond
-        fade_time = 0.01 # seconds
-        timing_precision_samples = int(timing_precision*sample_rate)
-        recording_directory = '/home/pi/Desktop/pi-looper-data/'
-
-        # LEDs
-        rec_led = LED(18)
-        play_led = LED(8)
-        back_led = LED(14)
-        forw_led = LED(24)
-        
-        # Buttons
-        rec_button = Button(23)
-        play_button = Button(7)
-        back_button = Button(15)
-        forw_button = Button(25)
-        
-        def is_all_buttons_active():
-            for b in [rec_button,play_button,back_button,forw_button]:
-                if not b.is_active:
-                    return False
-            return True
-
-
-        # Initialize recording
-        temp_recording_filename = os.path.join(
-            recording_directory,
-            'temp_recording_file.wav')
-
-        record_flag = threading.Event()
-        recording_thread = threading.Thread(name='recorder',
-                        target=daemons.recorder,
-                        args=(record_flag,
-                        timing_precision,
-                        temp_recording_filename),
-                        daemon = False)
-        recording_thread.start()
-
-        # setup audio
-        audio_out = sd.OutputStream(
-            samplerate=sample_rate,
-            channels = 2,
-            latency = 0.05,
-            dtype='float32')
-        audio_out.start()
-        time.sleep(0.5)
-
-        looper = Looper()
-        while not is_all_buttons_active():
-            time.sleep(1)
+        resume = args.resume
+        if resume == 'last':
+            resume = session.find_last(recording_directory)
+        audio = SoundDeviceAudio(config.device)
+        looper = Looper(hardware, audio, resume = resume, config = config)
+        looper.restart_requested.wait()
 
         looper.kill()
         logging.info('User restarted the looper')
-        restart_program()
+        restart_program(hardware, resume = looper.recording_directory if restart_resumes else None)
 
     except sd.PortAudioError as e:
         logging.critical('Audio interface issue:\n%s'%str(e))
         # Indicate the error with LEDs
-        all_leds_off()
-        rec_led.blink(1,1)
-        forw_led.blink(1,1)
+        hardware.all_leds_off()
+        hardware.rec_led.blink(1,1)
+        hardware.forw_led.blink(1,1)
     
     except Exception as e:
         logging.critical(e)
         # Indicate the error with LEDs
-        all_leds_off()
-        rec_led.blink(1,1)
-        forw_led.blink(1,1)
-        back_led.blink(1,1)
-
-    while not is_all_buttons_active():
+        hardware.all_leds_off()
+        hardware.rec_led.blink(1,1)
+        hardware.forw_led.blink(1,1)
+        hardware.back_led.blink(1,1)
+
+    # After a crash, carry on with the session that was started: its
+    # journal and stems are on disk
+    while not hardware.is_all_buttons_active():
         time.sleep(1)
-    restart_program()
+    restart_program(hardware, resume = None if looper is None else looper.recording_directory)
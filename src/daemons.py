@@ -6,42 +6,328 @@ import queue
 import sys
 import os
 import time
-import sounddevice as sd
-import soundfile as sf
+import threading
+from fractions import Fraction
 import numpy as np # Make sure NumPy is loaded before it is used in the callback
 assert np  # avoid "imported but unused" message (W0611)
-sample_rate = 44100
+from config import AudioConfig
+from timeline import Lane
 
-def recorder(recording_flag, timing_precision, filename):
+class RecordBuffer(object):
     """
+    Preallocated ring buffer holding the take being recorded.
+
+    The looper reads the take straight from memory with view(), so no
+    file has to be written and read back at the loop boundary. If a take
+    is longer than the buffer, only its last samples are kept.
+
+    With shared, the buffer is in shared memory, where another process
+    (the audio process, see audioprocess.py) can attach() it to play the
+    take as it is recorded. The number of samples written and of takes
+    started are kept there too, the samples being written before their
+    count.
+    """
+
+    header_size = 16 # bytes: n_written and takes, as int64
+
+    def __init__(self, n_samples, channels = AudioConfig.channels, shared = False, name = None):
+        size = self.header_size + n_samples*channels*4
+        self.shm = None
+        self.owner = name is None
+        if shared or name is not None:
+            from multiprocessing import shared_memory
+            self.shm = shared_memory.SharedMemory(name = name, create = name is None, size = size)
+            buffer = self.shm.buf
+        else:
+            buffer = bytearray(size)
+        self.header = np.ndarray(2, dtype = 'int64', buffer = buffer)
+        self.data = np.ndarray((n_samples, channels), dtype = 'float32', buffer = buffer,
+                               offset = self.header_size)
+
+    @classmethod
+    def attach(cls, name, n_samples, channels):
+        """The shared buffer of that name, made by another process."""
+        return cls(n_samples, channels, name = name)
+
+    @property
+    def name(self):
+        return None if self.shm is None else self.shm.name
+
+    @property
+    def n_written(self):
+        return int(self.header[0])
+
+    @n_written.setter
+    def n_written(self, n):
+        self.header[0] = n
+
+    @property
+    def takes(self):
+        """Number of takes started (resets) so far."""
+        return int(self.header[1])
+
+    def __len__(self):
+        return min(self.n_written, len(self.data))
+
+    def reset(self):
+        self.n_written = 0
+        self.header[1] += 1
+
+    def close(self):
+        """Release the shared memory (removed if this process made it)."""
+        if self.shm is not None:
+            del self.header, self.data
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+            self.shm = None
+
+    def write(self, block):
+        n = len(block)
+        if n > len(self.data):
+            block = block[-len(self.data):]
+            self.n_written += n - len(self.data)
+            n = len(self.data)
+        start = self.n_written % len(self.data)
+        end = start + n
+        if end <= len(self.data):
+            self.data[start:end] = block
+        else:
+            split = len(self.data) - start
+            self.data[start:] = block[:split]
+            self.data[:end-len(self.data)] = block[split:]
+        self.n_written += n
+
+    def read(self, start, end):
+        """
+        A copy of samples start to end of those written since the last
+        reset, which must still be in the buffer: for a reader following
+        the writer, in another process.
+        """
+        size = len(self.data)
+        i = start % size
+        if i + end - start <= size:
+            return self.data[i:i+end-start].copy()
+        return np.concatenate((self.data[i:], self.data[:i+end-start-size]))
+
+    def view(self):
+        """
+        The recorded take, as a view into the buffer
+        (a copy is only made once the buffer has wrapped around).
+        """
+        if self.n_written <= len(self.data):
+            return self.data[:self.n_written]
+        start = self.n_written % len(self.data)
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+
+class TakeLane(Lane):
+    """
+    The layer a take will make, played straight from its RecordBuffer:
+    sample j of the layer is sample j+latency of the take, faded in and out
+    by fades (the curves of dsp.fade_curve) like Looper.prepare_layer does,
+    and played start frames after the origin of its loop, every period.
+
+    Samples not captured yet (the input lags the output) are silent, so
+    the lane can play from the boundary that ends the take, while the
+    recorder writes its last blocks and before the take is mixed in. So
+    are those of a take the buffer no longer holds (the next one started).
+    """
+
+    def __init__(self, buffer, length, period, start = 0, latency = 0, fades = None,
+                 track = None, take = None):
+        self.record = buffer
+        self.length = length
+        self.period = Fraction(period)
+        self.num = self.period.numerator
+        self.den = self.period.denominator
+        self.track = track
+        self.start = start
+        self.latency = latency
+        self.fades = fades
+        self.fade_in, self.fade_out = (None, None) if fades is None else fades
+        # Pass position of the first sample, as Tracks.add rolls layers
+        self.shift = start - self.bounds(start)[0]
+        self.take = buffer.takes if take is None else take
+        self.silent = False
+
+    def silence(self):
+        """From now on, e.g. before the buffer is reused for another take."""
+        self.silent = True
+
+    def read(self, offset, out):
+        n = len(out)
+        written = 0
+        while written < n:
+            start, end = self.bounds(offset + written)
+            position = offset + written - start
+            m = min(n - written, end - start - position)
+            # Layer samples, from position - shift on and around the layer
+            j = (position - self.shift) % self.length
+            while m > 0:
+                k = min(m, self.length - j)
+                self.copy(j, out[written:written+k])
+                j = 0
+                written += k
+                m -= k
+        return out
+
+    def copy(self, j, out):
+        # Layer samples j to j+len(out)
+        n = len(out)
+        data = self.record.data
+        captured = self.record.n_written
+        if self.silent or captured > len(data) or self.record.takes != self.take:
+            # The take went round the buffer: only heard once it is mixed in
+            out[:] = 0
+            return
+        available = max(0, min(captured - j - self.latency, n))
+        out[:available] = data[j+self.latency:j+self.latency+available]
+        out[available:] = 0
+        if self.fade_in is not None:
+            fade = len(self.fade_in)
+            if j < fade:
+                k = min(n, fade - j)
+                np.multiply(out[:k], self.fade_in[j:j+k], out = out[:k])
+            if j + n > self.length - fade:
+                a = max(j, self.length - fade)
+                start = a - (self.length - fade)
+                np.multiply(out[a-j:], self.fade_out[start:start+n-(a-j)], out = out[a-j:])
+
+
+class Recorder(object):
+    """
+    Captures the input stream into a RecordBuffer.
+
+    Takes start and stop at exact frames: arm() and disarm() are given
+    times on the stream clock (the clock of inputBufferAdcTime), which the
+    input callback converts into frame offsets within its block. Between
+    takes nothing runs but the callback.
+
+    The callback may be that of the engine's duplex stream, so it never
+    takes a lock: arm() and disarm() replace the (number, start time,
+    stop time) tuple of the take as a whole, the callback only counts the
+    takes it has started and finished, and threads waiting for a take to
+    complete are woken through a queue.
+
     adapted from
     https://github.com/spatialaudio/python-sounddevice/blob/master/examples/rec_unlimited.py
     """
 
-    try:
-        os.remove(filename)
-    except FileNotFoundError:
-        pass
+    def __init__(self, buffer, sample_rate = AudioConfig.sample_rate, blocksize = 0, latency = 0.05,
+                 audio = None, metrics = None):
+        self.buffer = buffer
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize
+        self.latency = latency
+        if audio is None:
+            from audio import SoundDeviceAudio
+            audio = SoundDeviceAudio()
+        self.audio = audio
+        self.metrics = metrics # xruns are counted there instead of printed
+        self.take = (0, None, None) # number, start time, stop time
+        self.started = 0 # numbers of the last takes started and finished,
+        self.finished = 0 # only written by the callback
+        self.finishes = queue.SimpleQueue() # numbers of the takes finished
+        self.lock = threading.Lock() # between arm() and disarm()
+        self.stream = None
+
+    def start(self):
+        self.stream = self.audio.open_input(
+            self.sample_rate,
+            self.buffer.data.shape[1],
+            self.blocksize,
+            self.latency,
+            self.callback)
+        self.stream.start()
+
+    def stop(self):
+        self.disarm()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    @property
+    def state(self):
+        """'idle', 'armed' or 'recording'"""
+        n = self.take[0]
+        if self.finished == n:
+            return 'idle'
+        return 'recording' if self.started == n else 'armed'
 
-    q = queue.Queue()
+    @property
+    def is_recording(self):
+        return self.state != 'idle'
 
-    def callback(indata, frames, time, status):
+    def arm(self, start_time):
+        """Start a new take with the sample captured at start_time."""
+        with self.lock:
+            n, _, stop_time = self.take
+            if self.state == 'recording' and stop_time is None:
+                return # the current take continues
+            self.buffer.reset()
+            self.take = (n + 1, start_time, None)
+
+    def disarm(self, stop_time = float('-inf')):
+        """End the take just before the sample captured at stop_time (default: now)."""
+        with self.lock:
+            n, start_time, _ = self.take
+            if self.finished != n:
+                self.take = (n, start_time, stop_time)
+
+    def wait(self, timeout = None):
+        """Block until the current take is complete."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.finished != self.take[0]:
+            try:
+                self.finishes.get(timeout = None if deadline is None
+                                  else max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return self.finished == self.take[0]
+        return True
+
+    def callback(self, indata, frames, time, status):
         """This is called (from a separate thread) for each audio block."""
         if status:
-            print(status, file=sys.stderr)
-        q.put(indata.copy())
-
-    with sf.SoundFile(filename, mode='x',channels = 2, samplerate=sample_rate) as file:
-        with sd.InputStream(samplerate=sample_rate,channels = 2,callback=callback, latency = 0.05, dtype='float32'):
-            logging.debug('temporary file name: '+file.name)
-            while True:
-                file.truncate(1) # Deletes contents of the file
-                with q.mutex:
-                    q.queue.clear() # Deletes content of the q object
-                while recording_flag.isSet():
-                    file.write(q.get()) # Adds audio to the file
-                file.flush() # Add any unwritten audio to the file
-                # logging.debug('not recording')
-                while not recording_flag.isSet():
-                    time.sleep(timing_precision)
-                # logging.debug('recording')
\ No newline at end of file
+            if self.metrics is None:
+                print(status, file=sys.stderr)
+            else:
+                self.metrics.xrun(status)
+        self.process(indata, frames, time.inputBufferAdcTime)
+
+    def process(self, indata, frames, adc_time):
+        n, start_time, stop_time = self.take
+        if self.finished == n:
+            return
+
+        start = 0
+        if self.started != n:
+            if stop_time is not None and stop_time <= start_time:
+                self.finish(n) # the take never started
+                return
+            start = max(0, self.frame_offset(start_time, adc_time))
+            if start >= frames:
+                return
+            self.started = n
+
+        stop = frames
+        if stop_time is not None:
+            stop = self.frame_offset(stop_time, adc_time)
+
+        if min(stop, frames) > start:
+            self.buffer.write(indata[start:min(stop, frames)])
+
+        if stop_time is not None and stop <= frames:
+            self.finish(n)
+
+    def finish(self, n):
+        self.finished = n
+        self.finishes.put(n) # never blocks
+
+    def frame_offset(self, t, adc_time):
+        # Index, in the current block, of the sample captured at time t
+        if t == float('-inf'):
+            return 0
+        return int(round((t-adc_time)*self.sample_rate))
+
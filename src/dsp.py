@@ -0,0 +1,129 @@
+"""
+Vectorized trim, fade, tile, resampling and channel operations on
+(n_samples, channels) arrays.
+
+None of these functions modify their input unless it is passed as out.
+The dtype of the audio is preserved, and results are views of the input
+whenever no data needs to change.
+"""
+import math
+from functools import lru_cache
+import numpy as np
+
+fade_shapes = ['linear', 'equal_power']
+
+
+@lru_cache(maxsize=32)
+def fade_curve(n_samples, shape = 'linear', direction = 'in'):
+    """Read-only (n_samples, 1) column of fade gains."""
+    x = np.arange(n_samples, dtype = 'float32')/np.float32(n_samples)
+    if shape == 'linear':
+        curve = x
+    elif shape == 'equal_power':
+        curve = np.sin(x*np.float32(np.pi/2))
+    else:
+        raise ValueError('Unknown fade shape %r, use one of %s'%(shape, fade_shapes))
+    if direction == 'out':
+        curve = curve[::-1]
+    curve = np.ascontiguousarray(curve[:,np.newaxis])
+    curve.flags.writeable = False
+    return curve
+
+
+def trim(loop, n_samples, offset = 0, out = None):
+    """
+    The n_samples samples of loop starting at offset, padded with zeros
+    if loop is too short. Without out, a view of loop is returned when
+    no padding is needed.
+    """
+    available = max(0, min(len(loop)-offset, n_samples))
+    if out is None:
+        if available == n_samples:
+            return loop[offset:offset+n_samples]
+        out = np.zeros((n_samples,)+loop.shape[1:], dtype = loop.dtype)
+    else:
+        out[available:] = 0
+    out[:available] = loop[offset:offset+available]
+    return out
+
+
+def fade(loop, n_samples, where = ('in', 'out'), shape = 'linear', out = None):
+    """
+    Fade the first and/or last n_samples of loop in/out.
+    Pass out = loop to fade in place.
+    """
+    if out is None:
+        out = loop.copy()
+    elif out is not loop:
+        out[...] = loop
+    n_samples = min(n_samples, len(loop))
+    if n_samples == 0:
+        return out
+    if 'in' in where:
+        head = out[:n_samples]
+        np.multiply(head, fade_curve(n_samples, shape, 'in'), out = head)
+    if 'out' in where:
+        tail = out[len(out)-n_samples:]
+        np.multiply(tail, fade_curve(n_samples, shape, 'out'), out = tail)
+    return out
+
+
+def tile(loop, n_samples, out = None):
+    """Repeat loop to exactly n_samples samples."""
+    if out is None:
+        out = np.empty((n_samples,)+loop.shape[1:], dtype = loop.dtype)
+    n = min(len(loop), n_samples)
+    out[:n] = loop[:n]
+    # Double the filled part until it covers the output
+    while n < n_samples:
+        m = min(n, n_samples-n)
+        out[n:n+m] = out[:m]
+        n += m
+    return out
+
+
+def add_tiled(out, loop, subtract = False):
+    """Add (or subtract) loop, repeated as many times as needed, to out in place."""
+    operation = np.subtract if subtract else np.add
+    for start in range(0, len(out), len(loop)):
+        segment = out[start:start+len(loop)]
+        operation(segment, loop[:len(segment)], out = segment)
+    return out
+
+
+def resample(sound, from_rate, to_rate):
+    """
+    sound (n_samples, channels) at from_rate, at to_rate (Hz): its spectrum
+    is cut or padded with zeros, so nothing above either Nyquist frequency
+    is kept or made up. Zeros are added at the end first, so that it does
+    not wrap around onto the start.
+    """
+    if from_rate == to_rate:
+        return sound
+    n = len(sound)
+    g = math.gcd(from_rate, to_rate)
+    # Whole periods of the ratio, so that the two lengths are exact
+    step = from_rate//g
+    n_in = -(-(n + min(n, from_rate//10) + 1)//step)*step
+    n_out = n_in*to_rate//from_rate
+    spectrum = np.fft.rfft(sound, n_in, axis = 0)
+    if n_out > n_in and n_in % 2 == 0:
+        spectrum[n_in//2] *= 0.5 # the Nyquist bin is shared by both halves
+    out = np.fft.irfft(spectrum[:n_out//2+1], n_out, axis = 0)
+    out *= n_out/n_in
+    return out[:-(-n*to_rate//from_rate)].astype(sound.dtype)
+
+
+def match_channels(sound, channels):
+    """
+    sound (n_samples, channels of its own) on channels channels: a mono
+    sound is copied to every channel, others are mixed down to mono or
+    have their channels repeated or dropped.
+    """
+    if sound.shape[1] == channels:
+        return sound
+    if sound.shape[1] == 1:
+        return np.tile(sound, (1, channels))
+    if channels == 1:
+        return sound.mean(axis = 1, keepdims = True).astype(sound.dtype)
+    return sound[:, np.arange(channels) % sound.shape[1]]
@@ -0,0 +1,346 @@
+import sys
+import queue
+import heapq
+import itertools
+import threading
+import logging
+from time import perf_counter
+import numpy as np
+from metrics import Metrics
+from timeline import Loop
+
+
+class PlaybackEngine(object):
+    """
+    Plays the master loop from an output stream callback.
+
+    Playback is tracked by frame index: the engine counts every frame it
+    writes, so loop restarts and scheduled events happen on exact sample
+    positions instead of depending on timer threads and wall-clock time.
+
+    New loops are published read-copy-update style: other threads build a
+    complete buffer, then replace the single (version, loop, mode) tuple in
+    self.published. The audio thread only ever reads that reference, so it
+    never takes a lock and never sees a buffer that is still being mixed.
+    Published buffers must not be modified afterwards.
+
+    Loops are timeline.Loop objects (plain buffers are wrapped in one):
+    lanes that wrap on their own, exact, periods, while loop boundaries
+    come every period of the loop. Lanes belonging to tracks are mixed
+    block by block with the (tracks, channels) gains matrix published
+    with set_gains(), so gain and mute changes are heard from the next
+    block on.
+
+    Work that should not run on the audio thread (state transitions,
+    mixing, file I/O) is handed to a single long-lived dispatcher thread.
+    On audio backends that do not run in real time (e.g. MemoryAudio),
+    and in headless mode, there is no such thread: that work runs at the
+    start of the next block, which keeps simulations deterministic.
+
+    In headless mode no audio device is opened and blocks are produced by
+    calling render(), which makes the engine usable without a sound card.
+
+    In duplex mode the engine opens a single full-duplex stream and hands
+    every input block to input_callback(indata, frames, time), after the
+    output of the same block, with time being the stream time at which
+    its first sample was captured (inputBufferAdcTime). Input and output
+    then share one clock and one block schedule, so a take armed at the
+    stream time of a frame starts on the sample captured then, however
+    long the session runs. Only the round trip of the interface itself is
+    left, which calibration.py measures against the same times.
+
+    Callback durations, xruns, boundary jitter, dispatcher queue depth and
+    task durations are recorded in self.metrics (see metrics.py), or not
+    at all if it is set to None.
+    """
+
+    def __init__(self, sample_rate, channels=2, blocksize=0, latency=0.05,
+                 headless=False, audio=None, duplex=False, metrics=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.latency = latency
+        self.headless = headless
+        self.duplex = duplex
+        if audio is None and not headless:
+            from audio import SoundDeviceAudio
+            audio = SoundDeviceAudio()
+        self.audio = audio
+
+        self.frame = 0 # absolute index of the next frame to be played
+        self.loop = None
+        self.origin = 0 # absolute frame from which the passes of the loop are counted
+        self.loop_start = 0 # absolute frame at which the current pass started
+        self.pass_end = 0 # absolute frame at which the next pass starts
+        self.lane_blocks = np.zeros((0, 0, channels), dtype='float32')
+
+        # Latest published loop, mode is one of
+        #   'boundary': played from the next loop boundary on
+        #   'restart':  played from its start, from the next block on
+        #   'phase':    played from the next block on, at the same relative
+        #               position as the current loop
+        self.versions = itertools.count(1)
+        self.published = (0, None, 'boundary')
+        self.version = 0 # version of self.loop
+        self.gains = None # gains of the tracks of the lanes, None: unity
+
+        # Stream time at which the first frame of the current block is played
+        self.block_frame = 0
+        self.block_time = 0.
+        # Stream time at which the current block is being computed
+        self.current_time = 0.
+
+        # Called from the audio thread with the absolute frame index
+        # at the first frame of every loop pass
+        self.boundary_callback = None
+
+        # Called from the audio thread with every input block in duplex mode
+        self.input_callback = None
+
+        # Called from the audio thread with every block of output, once
+        # computed (e.g. to record it, see session.py)
+        self.output_callback = None
+
+        self.new_events = queue.SimpleQueue()
+        self.events = [] # heap of (frame, n, function), owned by the audio thread
+        self.n_events = itertools.count()
+        self.tasks = queue.SimpleQueue()
+
+        self.stream = None
+        self.dispatcher = None
+        self.metrics = Metrics() if metrics is None else metrics
+
+    def start(self):
+        if self.headless:
+            return
+
+        if self.audio.realtime:
+            self.dispatcher = threading.Thread(
+                name='dispatcher',
+                target=self.run_dispatcher,
+                daemon=True)
+            self.dispatcher.start()
+
+        if self.duplex:
+            open_stream, callback = self.audio.open_duplex, self.duplex_callback
+        else:
+            open_stream, callback = self.audio.open_output, self.callback
+        self.stream = open_stream(
+            self.sample_rate,
+            self.channels,
+            self.blocksize,
+            self.latency,
+            callback)
+        self.stream.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        if self.dispatcher is not None:
+            self.tasks.put(None)
+            self.dispatcher.join()
+            self.dispatcher = None
+
+    def run_dispatcher(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            self.run_task(task)
+
+    def dispatch(self, function):
+        """
+        Run function on the dispatcher thread, in order of submission
+        (without dispatcher thread: at the start of the next block).
+        """
+        self.tasks.put(function)
+
+    def run_tasks(self):
+        while not self.tasks.empty():
+            self.run_task(self.tasks.get_nowait())
+
+    def run_task(self, task):
+        start = perf_counter()
+        try:
+            task()
+        except Exception:
+            logging.exception('Dispatched task %r failed' % task)
+        if self.metrics is not None:
+            self.metrics.task.add(perf_counter()-start)
+
+    def schedule(self, frame, function):
+        """Dispatch function once playback reaches the absolute frame."""
+        self.new_events.put((frame, function))
+
+    def publish(self, loop, mode):
+        if isinstance(loop, np.ndarray):
+            loop = Loop.from_array(loop)
+        self.published = (next(self.versions), loop, mode)
+
+    def set_loop(self, loop):
+        """Play loop from the next loop boundary on."""
+        self.publish(loop, 'boundary')
+
+    def set_gains(self, gains):
+        """Mix the lanes of tracks with this (tracks, channels) matrix from the next block on."""
+        self.gains = gains
+
+    def start_loop(self, loop, keep_phase=False):
+        """
+        Play loop from the next block on.
+
+        With keep_phase, playback continues at the same relative position
+        in the new loop (e.g. when the metronome tempo changes), otherwise
+        the new loop starts from its first frame.
+        """
+        self.publish(loop, 'phase' if keep_phase else 'restart')
+
+    def frame_time(self, frame):
+        """Stream time at which the absolute frame is played."""
+        return self.block_time + (frame-self.block_frame)/self.sample_rate
+
+    def callback(self, outdata, frames, time, status):
+        start = perf_counter()
+        if status:
+            self.xrun(status)
+        self.block_frame = self.frame
+        self.block_time = time.outputBufferDacTime
+        self.current_time = time.currentTime
+        self.process(outdata, frames)
+        if self.output_callback is not None:
+            self.output_callback(outdata)
+        self.measure(start, frames)
+
+    def duplex_callback(self, indata, outdata, frames, time, status):
+        start = perf_counter()
+        if status:
+            self.xrun(status)
+        self.block_frame = self.frame
+        self.block_time = time.outputBufferDacTime
+        self.current_time = time.currentTime
+        self.process(outdata, frames)
+        if self.output_callback is not None:
+            self.output_callback(outdata)
+        if self.input_callback is not None:
+            self.input_callback(indata, frames, time.inputBufferAdcTime)
+        self.measure(start, frames)
+
+    def xrun(self, status):
+        if self.metrics is None:
+            print(status, file=sys.stderr)
+        else:
+            self.metrics.xrun(status)
+
+    def measure(self, start, frames):
+        if self.metrics is not None:
+            self.metrics.block(start, perf_counter(), frames,
+                               frames/self.sample_rate, self.tasks.qsize())
+
+    def render(self, frames):
+        """Produce the next frames of output without an audio device."""
+        outdata = np.zeros((frames, self.channels), dtype='float32')
+        self.block_frame = self.frame
+        self.block_time = self.frame/self.sample_rate
+        self.current_time = self.block_time
+        self.process(outdata, frames)
+        if self.output_callback is not None:
+            self.output_callback(outdata)
+        return outdata
+
+    def process(self, outdata, frames):
+        if self.dispatcher is None:
+            self.run_tasks()
+
+        version, loop, mode = self.published
+        if version != self.version and (mode != 'boundary' or self.loop is None):
+            self.version = version
+            if mode == 'phase' and self.loop is not None and loop is not None:
+                position = self.frame - self.loop_start
+                position = int(position*loop.period/self.loop.period)
+                self.set_current(loop, self.frame - position)
+            else:
+                self.set_current(loop, self.frame)
+                self.boundary(swap = False)
+
+        gains = self.gains
+        written = 0
+        while written < frames:
+            self.receive_events()
+            self.run_events()
+
+            n = frames - written
+            if self.events:
+                n = min(n, self.events[0][0] - self.frame)
+
+            loop = self.loop
+            if loop is None:
+                outdata[written:written+n] = 0
+            else:
+                if self.frame >= self.pass_end:
+                    self.boundary()
+                    continue
+                n = min(n, self.pass_end - self.frame)
+                self.mix(loop, self.frame - self.origin, outdata[written:written+n], gains)
+
+            written += n
+            self.frame += n
+
+    def mix(self, loop, offset, out, gains):
+        """Write the frames of loop from offset (since its origin) on into out."""
+        lanes = loop.lanes
+        if loop.tracks is None and len(lanes) == 1:
+            lanes[0].read(offset, out)
+            return
+        n = len(out)
+        if self.lane_blocks.shape[0] < n or self.lane_blocks.shape[1] < len(lanes):
+            self.lane_blocks = np.zeros((max(n, self.lane_blocks.shape[0]),
+                                         max(len(lanes), self.lane_blocks.shape[1]),
+                                         self.channels), dtype='float32')
+        blocks = self.lane_blocks[:n, :len(lanes)]
+        for i, lane in enumerate(lanes):
+            lane.read(offset, blocks[:, i])
+        if gains is None or loop.tracks is None:
+            blocks.sum(axis=1, out=out)
+        else:
+            np.einsum('nlc,lc->nc', blocks, gains[loop.tracks], out=out)
+
+    def set_current(self, loop, origin):
+        """
+        Play loop, counting its passes from origin unless it has its own,
+        from the pass holding the current frame on.
+        """
+        self.loop = loop
+        if loop is None:
+            return
+        self.origin = origin if loop.origin is None else loop.origin
+        start, end = loop.bounds(self.frame - self.origin)
+        self.loop_start, self.pass_end = self.origin + start, self.origin + end
+
+    def boundary(self, swap = True):
+        if self.metrics is not None:
+            self.metrics.boundary(self.frame_time(self.frame)-self.current_time)
+        version, loop, mode = self.published
+        if swap and version != self.version:
+            self.version = version
+            self.set_current(loop, self.frame)
+        elif swap:
+            self.set_current(self.loop, self.origin)
+        if self.boundary_callback is not None:
+            self.boundary_callback(self.frame)
+            # The callback may start another loop right away
+            version, loop, mode = self.published
+            if version != self.version and mode != 'boundary':
+                self.version = version
+                self.set_current(loop, self.frame)
+
+    def receive_events(self):
+        while not self.new_events.empty():
+            frame, function = self.new_events.get_nowait()
+            heapq.heappush(self.events, (frame, next(self.n_events), function))
+
+    def run_events(self):
+        while self.events and self.events[0][0] <= self.frame:
+            frame, n, function = heapq.heappop(self.events)
+            self.dispatch(function)
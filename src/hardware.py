@@ -0,0 +1,89 @@
+import threading
+from gpiozero import LED, Button
+from clock import Clock
+
+
+class Hardware(object):
+    """
+    LEDs and buttons of the looper.
+
+    Pass a gpiozero pin factory to run on something else than the Pi's
+    GPIO header, e.g. Hardware.mock() for simulations.
+    """
+
+    # BCM pin numbers
+    led_pins = {'rec': 18, 'play': 8, 'back': 14, 'forw': 24}
+    button_pins = {'rec': 23, 'play': 7, 'back': 15, 'forw': 25}
+
+    def __init__(self, pin_factory = None, clock = None):
+        self.clock = Clock() if clock is None else clock
+
+        self.rec_led = LED(self.led_pins['rec'], pin_factory = pin_factory)
+        self.play_led = LED(self.led_pins['play'], pin_factory = pin_factory)
+        self.back_led = LED(self.led_pins['back'], pin_factory = pin_factory)
+        self.forw_led = LED(self.led_pins['forw'], pin_factory = pin_factory)
+
+        self.rec_button = Button(self.button_pins['rec'], pin_factory = pin_factory)
+        self.play_button = Button(self.button_pins['play'], pin_factory = pin_factory)
+        self.back_button = Button(self.button_pins['back'], pin_factory = pin_factory)
+        self.forw_button = Button(self.button_pins['forw'], pin_factory = pin_factory)
+
+    @classmethod
+    def mock(cls, clock = None):
+        """Hardware on gpiozero's mock pins, press buttons with press()/release()."""
+        from gpiozero.pins.mock import MockFactory
+        return cls(MockFactory(), clock)
+
+    @property
+    def leds(self):
+        return [self.rec_led, self.play_led, self.back_led, self.forw_led]
+
+    @property
+    def buttons(self):
+        return [self.rec_button, self.play_button, self.back_button, self.forw_button]
+
+    def button(self, name):
+        return getattr(self, name+'_button')
+
+    def press(self, name):
+        # Buttons pull up, pressing one connects the pin to ground
+        self.button(name).pin.drive_low()
+
+    def release(self, name):
+        self.button(name).pin.drive_high()
+
+    def is_all_buttons_active(self):
+        for b in self.buttons:
+            if not b.is_active:
+                return False
+        return True
+
+    def all_leds_off(self):
+        for l in self.leds:
+            l.off()
+
+    def led_square(self, background = False):
+        """
+        With background, the animation runs on its own thread, which is
+        returned (join it before using the LEDs).
+        """
+        if background:
+            thread = threading.Thread(name = 'leds', target = self.led_square, daemon = True)
+            thread.start()
+            return thread
+        self.all_leds_off()
+        for l in [self.rec_led,self.forw_led,self.play_led,self.back_led]:
+            l.on()
+            self.clock.sleep(0.1)
+            l.off()
+
+    def led_circle(self):
+        self.all_leds_off()
+        for l in [self.rec_led,self.play_led,self.forw_led,self.back_led]:
+            l.on()
+            self.clock.sleep(0.1)
+            l.off()
+
+    def close(self):
+        for device in self.leds + self.buttons:
+            device.close()
@@ -0,0 +1,244 @@
+"""
+What the looper shows: its LEDs and its log, off the threads that keep
+time.
+
+A console or an SD card backed journal can take milliseconds to write a
+line, and a handler holds its lock while it writes: every other thread
+logging meanwhile waits for it. LED animations sleep between their
+steps. Here, log records are formatted where they are logged and queued,
+LED commands are queued as they are given, and a single 'output' thread
+(a Worker) writes the records and drives the LEDs, in order. LED
+animations are timers of that thread, which never sleeps in between.
+
+    worker = Worker()
+    queue_logging(worker, logging.DEBUG, '(%(threadName)-10s) %(message)s',
+                  rate_limit = RateLimit())
+    leds = LEDs(hardware, worker)
+    leds.play_led.on()
+
+Without a thread (threaded = False, for simulations), commands run right
+away and timers on the clock's call_later() (see clock.VirtualClock).
+
+RateLimit keeps the chattiest debug messages (a tempo button held, a
+message per beat) from flooding the output: past a few records a second
+from one line of code, they are dropped and counted.
+"""
+import heapq
+import logging
+import itertools
+import threading
+import queue
+import logging.handlers
+from functools import partial
+from clock import Clock
+
+
+class Worker(object):
+
+    def __init__(self, clock = None, threaded = True, name = 'output'):
+        self.clock = Clock() if clock is None else clock
+        self.threaded = threaded
+        self.name = name
+        self.jobs = queue.SimpleQueue()
+        self.timers = [] # heap of (clock time, n, function), worker thread only
+        self.n_timers = itertools.count()
+        self.thread = None
+
+    def start(self):
+        if self.threaded and self.thread is None:
+            self.thread = threading.Thread(name = self.name, target = self.run, daemon = True)
+            self.thread.start()
+
+    def stop(self):
+        """Once everything put so far has run (timers still due are dropped)."""
+        if self.thread is not None:
+            self.jobs.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def put(self, function):
+        """Run function() on the worker, after everything put before."""
+        if self.threaded:
+            self.jobs.put(function)
+        else:
+            function()
+
+    def later(self, delay, function):
+        """Run function() on the worker in delay seconds."""
+        if self.threaded:
+            self.jobs.put(partial(self.add_timer, self.clock.time()+delay, function))
+        else:
+            self.clock.call_later(delay, function)
+
+    def add_timer(self, t, function):
+        heapq.heappush(self.timers, (t, next(self.n_timers), function))
+
+    def run(self):
+        while True:
+            timeout = None
+            if self.timers:
+                timeout = max(0., self.timers[0][0] - self.clock.time())
+            try:
+                function = self.jobs.get(timeout = timeout)
+            except queue.Empty:
+                function = self.run_timers
+            if function is None:
+                return
+            self.call(function)
+            self.run_timers()
+
+    def run_timers(self):
+        now = self.clock.time()
+        while self.timers and self.timers[0][0] <= now:
+            t, n, function = heapq.heappop(self.timers)
+            self.call(function)
+
+    def call(self, function):
+        try:
+            function()
+        except Exception:
+            logging.exception('Output job %r failed'%function)
+
+
+class QueuedLED(object):
+    """A gpiozero LED whose commands run on a Worker."""
+
+    def __init__(self, led, worker):
+        self.led = led
+        self.worker = worker
+
+    def on(self):
+        self.worker.put(self.led.on)
+
+    def off(self):
+        self.worker.put(self.led.off)
+
+    def toggle(self):
+        self.worker.put(self.led.toggle)
+
+    def blink(self, *args, **kwargs):
+        self.worker.put(partial(self.led.blink, *args, **kwargs))
+
+    @property
+    def is_lit(self):
+        # as of the last command run
+        return self.led.is_lit
+
+
+class LEDs(object):
+    """
+    The LEDs of hardware (see hardware.py), driven by worker. Any command
+    but those of an animation stops the animation running.
+    """
+
+    step_time = 0.1 # seconds per LED of an animation
+
+    def __init__(self, hardware, worker):
+        self.worker = worker
+        self.rec_led = QueuedLED(hardware.rec_led, worker)
+        self.play_led = QueuedLED(hardware.play_led, worker)
+        self.back_led = QueuedLED(hardware.back_led, worker)
+        self.forw_led = QueuedLED(hardware.forw_led, worker)
+        self.animation = 0 # the animation running, older ones stop
+
+    @property
+    def leds(self):
+        return [self.rec_led, self.play_led, self.back_led, self.forw_led]
+
+    def all_leds_off(self):
+        self.animation += 1
+        for l in self.leds:
+            l.off()
+
+    def square(self, then = None):
+        """Light the LEDs one after the other around the square, then call then()."""
+        self.animate([self.rec_led, self.forw_led, self.play_led, self.back_led], then)
+
+    def circle(self, then = None):
+        self.animate([self.rec_led, self.play_led, self.forw_led, self.back_led], then)
+
+    def animate(self, leds, then):
+        self.all_leds_off()
+        animation = self.animation
+        for i, l in enumerate(leds):
+            self.worker.later(i*self.step_time, partial(self.step, animation, l.led.on))
+            self.worker.later((i+1)*self.step_time, partial(self.step, animation, l.led.off))
+        if then is not None:
+            self.worker.later(len(leds)*self.step_time, partial(self.step, animation, then))
+
+    def step(self, animation, function):
+        if animation == self.animation:
+            function()
+
+
+class RateLimit(logging.Filter):
+    """
+    Lets at most burst records of level or below through per interval
+    seconds and line of code. The first one let through after some were
+    dropped tells how many.
+    """
+
+    def __init__(self, level = logging.DEBUG, burst = 5, interval = 1.):
+        logging.Filter.__init__(self)
+        self.level = level
+        self.burst = burst
+        self.interval = interval
+        self.windows = {} # (file, line): [start time, records let through, dropped]
+        self.dropped = 0 # in all
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or record.created - window[0] >= self.interval:
+                dropped = 0 if window is None else window[2]
+                window = self.windows[key] = [record.created, 0, 0]
+                if dropped:
+                    record.msg = '%s (%d more dropped)'%(record.msg, dropped)
+            if window[1] >= self.burst:
+                window[2] += 1
+                self.dropped += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Formats the message of records where they are logged, handlers write
+    them on the worker.
+    """
+
+    def __init__(self, worker, handlers):
+        logging.handlers.QueueHandler.__init__(self, worker)
+        self.handlers = handlers
+
+    def enqueue(self, record):
+        self.queue.put(partial(self.write, record))
+
+    def write(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def queue_logging(worker, level = logging.DEBUG, format = None, stream = None,
+                  rate_limit = None):
+    """
+    Log to stream (stderr by default) through worker, in place of the
+    handlers of the root logger. Returns the QueueHandler.
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(format))
+    queued = QueueHandler(worker, [handler])
+    if rate_limit is not None:
+        queued.addFilter(rate_limit)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(queued)
+    root.setLevel(level)
+    return queued
@@ -0,0 +1,219 @@
+"""
+Button input: timestamped, debounced edges turned into events.
+
+gpiozero calls back from its own threads; here those callbacks only
+timestamp the edge and queue it. A single input thread then debounces
+the edges and raises events, in order:
+
+    press       the button went down
+    release     it went up
+    tap         it went up before long_press_time
+    long_press  it has been held for long_press_time
+    repeat      it is still held, every repeat_interval after repeat_delay
+    all         every button is held (nothing else is raised until they
+                are all released again)
+
+Timers (long presses, auto-repeat, debounce settling) are kept by the
+input thread itself, so holding a button never blocks a thread. Without
+a thread (threaded = False, for simulations), edges are handled right
+away and timers run on the clock's call_later() (see clock.VirtualClock).
+
+Handlers registered with a quantize value ('beat' or 'bar') are handed
+to quantizer(quantize, function), which runs them later on (e.g. on the
+next beat, see Looper.quantize). The time from an edge to its handler
+returning, which for a transition includes applying it, is recorded in
+metrics.input_latency.
+"""
+import heapq
+import logging
+import itertools
+import threading
+import queue
+from time import perf_counter
+
+events = ['press', 'release', 'tap', 'long_press', 'repeat', 'all']
+
+
+class Button(object):
+    """State of one button, as seen by the input thread."""
+
+    def __init__(self, name):
+        self.name = name
+        self.pressed = False
+        self.last_edge = float('-inf') # clock time of the last accepted edge
+        self.press_time = None
+        self.presses = 0 # presses so far, timers of older ones are stale
+        self.long = False
+        self.settling = False
+
+
+class Inputs(object):
+
+    def __init__(self, hardware, clock, threaded = True, debounce_time = 0.02,
+                 long_press_time = 0.8, repeat_delay = 0.3, repeat_interval = 0.06,
+                 metrics = None, quantizer = None):
+        self.hardware = hardware
+        self.clock = clock
+        self.threaded = threaded
+        self.debounce_time = debounce_time
+        self.long_press_time = long_press_time
+        self.repeat_delay = repeat_delay
+        self.repeat_interval = repeat_interval
+        self.metrics = metrics
+        self.quantizer = quantizer
+
+        self.names = ['rec', 'play', 'back', 'forw']
+        self.buttons = dict((name, Button(name)) for name in self.names)
+        self.handlers = {} # (event, button name or None): [(function, quantize)]
+        self.all_held = False
+
+        self.edges = queue.SimpleQueue()
+        self.timers = [] # heap of (clock time, n, function), input thread only
+        self.n_timers = itertools.count()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        for name in self.names:
+            button = self.hardware.button(name)
+            button.when_activated = self.edge_callback(name, True)
+            button.when_deactivated = self.edge_callback(name, False)
+        if self.threaded:
+            self.running = True
+            self.thread = threading.Thread(name = 'inputs', target = self.run, daemon = True)
+            self.thread.start()
+
+    def stop(self):
+        for name in self.names:
+            button = self.hardware.button(name)
+            button.when_activated = None
+            button.when_deactivated = None
+        if self.thread is not None:
+            self.running = False
+            self.edges.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def on(self, event, button, function, quantize = None):
+        """
+        Call function() on event of button (None: any button, with the
+        button name as argument), on the next beat or bar with quantize.
+        """
+        if event not in events:
+            raise ValueError('Unknown input event %r, use one of %s'%(event, events))
+        self.handlers.setdefault((event, button), []).append((function, quantize))
+
+    def edge_callback(self, name, pressed):
+        def callback():
+            # gpiozero thread: only timestamp and queue
+            edge = (name, pressed, self.clock.time(), perf_counter())
+            if self.threaded:
+                self.edges.put(edge)
+            else:
+                self.edge(*edge)
+        return callback
+
+    def run(self):
+        while self.running:
+            timeout = None
+            if self.timers:
+                timeout = max(0., self.timers[0][0] - self.clock.time())
+            try:
+                edge = self.edges.get(timeout = timeout)
+            except queue.Empty:
+                edge = ()
+            if edge is None:
+                return
+            if edge:
+                self.edge(*edge)
+            self.run_timers()
+
+    def run_timers(self):
+        now = self.clock.time()
+        while self.timers and self.timers[0][0] <= now:
+            t, n, function = heapq.heappop(self.timers)
+            function()
+
+    def later(self, delay, function):
+        if self.threaded:
+            heapq.heappush(self.timers, (self.clock.time()+delay, next(self.n_timers), function))
+        else:
+            self.clock.call_later(delay, function)
+
+    def edge(self, name, pressed, t, arrival):
+        button = self.buttons[name]
+        if pressed == button.pressed:
+            return
+        if t - button.last_edge < self.debounce_time:
+            # Bouncing: look at the button again once it has settled
+            if not button.settling:
+                button.settling = True
+                self.later(self.debounce_time, lambda: self.settle(button))
+            return
+        self.change(button, pressed, t, arrival)
+
+    def settle(self, button):
+        button.settling = False
+        pressed = self.hardware.button(button.name).is_active
+        if pressed != button.pressed:
+            self.change(button, pressed, self.clock.time(), perf_counter())
+
+    def change(self, button, pressed, t, arrival):
+        button.pressed = pressed
+        button.last_edge = t
+        if pressed:
+            button.press_time = t
+            button.presses += 1
+            button.long = False
+            presses = button.presses
+            self.later(self.long_press_time, lambda: self.long_press(button, presses))
+            self.later(self.repeat_delay, lambda: self.repeat(button, presses))
+            if all(b.pressed for b in self.buttons.values()):
+                self.all_held = True
+                self.fire('all', None, arrival)
+                return
+        elif self.all_held:
+            if not any(b.pressed for b in self.buttons.values()):
+                self.all_held = False
+            return
+        if self.all_held:
+            return
+        if pressed:
+            self.fire('press', button.name, arrival)
+        else:
+            self.fire('release', button.name, arrival)
+            if not button.long:
+                self.fire('tap', button.name, arrival)
+
+    def long_press(self, button, presses):
+        if button.pressed and button.presses == presses and not self.all_held:
+            button.long = True
+            self.fire('long_press', button.name, perf_counter())
+
+    def repeat(self, button, presses):
+        if button.pressed and button.presses == presses:
+            if not self.all_held:
+                self.fire('repeat', button.name, perf_counter())
+            self.later(self.repeat_interval, lambda: self.repeat(button, presses))
+
+    def fire(self, event, name, arrival):
+        keys = [(event, name)] if name is None else [(event, name), (event, None)]
+        for key in keys:
+            for function, quantize in self.handlers.get(key, []):
+                if key[1] is None and name is not None:
+                    function = bound(function, name)
+                try:
+                    if quantize is None:
+                        function()
+                    else:
+                        self.quantizer(quantize, function)
+                except Exception:
+                    logging.exception('Handler of %s %s failed'%(name, event))
+                if self.metrics is not None:
+                    self.metrics.input_latency.add(perf_counter()-arrival)
+
+
+def bound(function, name):
+    def call():
+        return function(name)
+    return call
@@ -0,0 +1,209 @@
+"""
+Recorded layers, kept within a RAM budget.
+
+Layers are stored in one of three tiers:
+
+    'hot'      float32, as they are mixed
+    'compact'  int16 or float16, half the size
+    'mapped'   np.memmap over the take's wav file, no RAM but the page cache
+
+New layers start hot. Once the store is over budget, the oldest layers are
+compacted, then mapped onto the wav files the writer thread saved. The most
+recent layer always stays hot, so undoing it subtracts exactly what was
+added. Only the master loop built by the Mixer needs to be float32 at all
+times, colder layers are converted back one at a time when the mix is
+rebuilt.
+"""
+import os
+import struct
+import logging
+import numpy as np
+
+compact_formats = ['int16', 'float16']
+
+# Same scale as soundfile reading 16 bit files
+int16_scale = 32768.
+
+
+def wav_memmap(filename):
+    """
+    Read-only memmap of the samples of a 16 bit PCM or 32 bit float wav file,
+    as (frames, channels), or None if the file is not (yet) complete.
+    """
+    try:
+        size = os.path.getsize(filename)
+        f = open(filename, 'rb')
+    except OSError:
+        return None
+    with f:
+        header = f.read(12)
+        if len(header) < 12:
+            return None
+        riff, riff_size, wave = struct.unpack('<4sI4s', header)
+        if riff != b'RIFF' or wave != b'WAVE':
+            return None
+        dtype = channels = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            chunk, chunk_size = struct.unpack('<4sI', header)
+            if chunk == b'fmt ':
+                fmt = f.read(chunk_size)
+                tag, channels, _, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                if tag == 0xFFFE: # WAVE_FORMAT_EXTENSIBLE, the format is in the sub-format
+                    tag = struct.unpack('<H', fmt[24:26])[0]
+                dtype = {(1, 16): '<i2', (3, 32): '<f4'}.get((tag, bits))
+                if dtype is None:
+                    return None
+            elif chunk == b'data':
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
+    # The writer fills in the data size when it closes the file
+    if dtype is None or chunk_size == 0 or offset + chunk_size > size:
+        return None
+    frames = chunk_size // (channels*np.dtype(dtype).itemsize)
+    return np.memmap(filename, dtype = dtype, mode = 'r', offset = offset,
+                     shape = (frames, channels))
+
+
+def to_float(take):
+    """float32 copy of a take read with wav_memmap()."""
+    if take.dtype == np.int16:
+        return np.multiply(take, 1./int16_scale, dtype = 'float32')
+    return np.array(take, dtype = 'float32')
+
+
+class Layer(object):
+    """
+    One layer. filename is the wav file of the raw take, and prepare the
+    function that turns that take into the layer (trim and fade), which
+    are needed for the layer to be mapped.
+    """
+
+    def __init__(self, data, filename = None, prepare = None):
+        self.data = data
+        self.tier = 'hot'
+        self.length = len(data)
+        self.channels = data.shape[1]
+        self.filename = filename
+        self.prepare = prepare
+
+    @property
+    def nbytes(self):
+        if self.tier == 'mapped':
+            return 0
+        return self.data.nbytes
+
+    def array(self):
+        """The layer as float32 (the stored array itself when hot)."""
+        if self.tier == 'hot':
+            return self.data
+        if self.tier == 'mapped':
+            return self.prepare(to_float(self.data))
+        if self.data.dtype == np.int16:
+            return np.multiply(self.data, 1./int16_scale, dtype = 'float32')
+        return self.data.astype('float32')
+
+    def compact(self, fmt):
+        if fmt == 'int16':
+            data = np.clip(np.rint(self.data*int16_scale), -32768, 32767).astype('int16')
+        else:
+            data = self.data.astype(fmt)
+        self.data = data
+        self.tier = 'compact'
+
+    def map(self):
+        if self.filename is None or self.prepare is None:
+            return False
+        take = wav_memmap(self.filename)
+        if take is None:
+            return False
+        self.data = take
+        self.tier = 'mapped'
+        return True
+
+
+class LayerStore(object):
+    """
+    Sequence of layers within budget bytes of RAM (None: no limit),
+    colder layers compacted to compact_format (None: mapped right away).
+
+    Iterating or indexing gives float32 arrays. Only the dispatcher
+    thread uses it.
+
+    The stores made by lane() hold layers of their own within the budget
+    of this one: the layers of all lanes count towards it, oldest first,
+    and only the most recent of them all stays hot.
+    """
+
+    def __init__(self, budget = None, compact_format = 'int16', parent = None):
+        if compact_format is not None and compact_format not in compact_formats:
+            raise ValueError('Unknown layer format %r'%compact_format)
+        self.budget = budget
+        self.compact_format = compact_format
+        self.parent = parent
+        self.layers = []
+
+    def lane(self):
+        """A store for the layers of one lane, sharing the budget of this one."""
+        return LayerStore(self.budget, self.compact_format, parent = self)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, i):
+        return self.layers[i].array()
+
+    def __iter__(self):
+        for layer in self.layers:
+            yield layer.array()
+
+    @property
+    def nbytes(self):
+        return sum(layer.nbytes for layer in self.layers)
+
+    @property
+    def channels(self):
+        return self.layers[0].channels
+
+    def lengths(self):
+        return [layer.length for layer in self.layers]
+
+    def tiers(self):
+        return [layer.tier for layer in self.layers]
+
+    def append(self, data, filename = None, prepare = None):
+        layer = Layer(data, filename, prepare)
+        self.layers.append(layer)
+        if self.parent is None:
+            self.fit_budget()
+        else:
+            self.parent.layers.append(layer)
+            self.parent.fit_budget()
+
+    def pop(self):
+        layer = self.layers.pop()
+        if self.parent is not None:
+            self.parent.layers.remove(layer)
+        return layer.array()
+
+    def fit_budget(self):
+        if self.budget is None:
+            return
+        # Oldest first, and never the most recent layer
+        for layer in self.layers[:-1]:
+            if self.nbytes <= self.budget:
+                return
+            if layer.tier == 'hot' and self.compact_format is not None:
+                layer.compact(self.compact_format)
+        for layer in self.layers[:-1]:
+            if self.nbytes <= self.budget:
+                return
+            if layer.tier != 'mapped':
+                layer.map()
+        if self.nbytes > self.budget:
+            logging.warning('Layers take %.0f MB, over the budget of %.0f MB'%(
+                self.nbytes/1e6, self.budget/1e6))
@@ -0,0 +1,153 @@
+"""
+Table-driven state machine.
+
+States and triggers are declared like in the transitions package:
+
+    states = ['rec', 'play', ...]
+    transitions = [
+        # trigger               # source(s)         # destination   # action
+        ['release_rec_button',  'play',             'pre_rec'],
+        ['clear',               ['play', 'rec'],    'metronome',    'clear_layers'],
+    ]
+
+and compiled once into integers: states and triggers are numbered, and
+the transitions become one flat table of destination states, indexed by
+trigger*n_states + source (-1: the trigger is ignored in that state).
+Firing a trigger is a lookup in that table and calls to callbacks bound
+when the machine was built, so it takes the same time whatever the number
+of states and allocates nothing.
+
+Callbacks are methods of the model, found by name:
+
+    on_exit_<state>, on_enter_<state>, then the action of the transition
+        run on the thread that fired the trigger, before fire() returns.
+        They only do what the state change needs right away.
+    show_<state>
+        runs after entering state, on the effects thread, with the debug
+        log of the transition: what the state looks like from outside
+        (LEDs), which nothing waits for.
+
+Like in the transitions package, model.state is the name of the current
+state and every trigger is a method of the model (unless the model has a
+method of that name already). A transition to the state it comes from
+only runs its action. Without a thread (threaded = False, for
+simulations), effects run right after the transition.
+"""
+import queue
+import logging
+import threading
+
+
+class StateMachine(object):
+
+    def __init__(self, model, states, transitions, initial, threaded = True):
+        self.model = model
+        self.threaded = threaded
+        self.names = [initial] + [s for s in states if s != initial]
+        self.ids = dict((name, i) for i, name in enumerate(self.names))
+        self.triggers = []
+        for transition in transitions:
+            if transition[0] not in self.triggers:
+                self.triggers.append(transition[0])
+        self.trigger_ids = dict((name, i) for i, name in enumerate(self.triggers))
+        self.n_states = len(self.names)
+
+        size = len(self.triggers)*self.n_states
+        self.table = [-1]*size
+        self.actions = [None]*size
+        for transition in transitions:
+            trigger, sources, dest = transition[:3]
+            if isinstance(sources, str):
+                sources = [sources]
+            for source in sources:
+                code = self.trigger_ids[trigger]*self.n_states + self.ids[source]
+                if self.table[code] >= 0:
+                    raise ValueError('Two transitions for %s from %s'%(trigger, source))
+                self.table[code] = self.ids[dest]
+                if len(transition) > 3:
+                    self.actions[code] = getattr(model, transition[3])
+        self.on_exit = [getattr(model, 'on_exit_'+s, None) for s in self.names]
+        self.on_enter = [getattr(model, 'on_enter_'+s, None) for s in self.names]
+        self.show = [getattr(model, 'show_'+s, None) for s in self.names]
+
+        # Bound once, firing them builds nothing
+        self.fire_functions = [self.fire_function(t) for t in range(len(self.triggers))]
+        for name, fire in zip(self.triggers, self.fire_functions):
+            if not hasattr(model, name):
+                setattr(model, name, fire)
+
+        self.lock = threading.RLock() # callbacks may fire triggers
+        self.state = 0
+        model.state = initial
+        self.effects = queue.SimpleQueue() # transition codes
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(name = 'effects', target = self.run, daemon = True)
+            self.thread.start()
+
+    def fire_function(self, trigger):
+        def fire():
+            return self.fire(trigger)
+        return fire
+
+    def trigger(self, name):
+        """Fire the trigger called name, True if it applied in the current state."""
+        return self.fire(self.trigger_ids[name])
+
+    def set_state(self, name):
+        """Go to the state called name, without any callback."""
+        with self.lock:
+            self.state = self.ids[name]
+            self.model.state = name
+
+    def fire(self, trigger):
+        """Fire trigger (its number), True if it applied in the current state."""
+        # Not a with statement, whose exit call allocates
+        self.lock.acquire()
+        try:
+            source = self.state
+            code = trigger*self.n_states + source
+            dest = self.table[code]
+            if dest < 0:
+                return False
+            if dest != source:
+                if self.on_exit[source] is not None:
+                    self.on_exit[source]()
+                self.state = dest
+                self.model.state = self.names[dest]
+                if self.on_enter[dest] is not None:
+                    self.on_enter[dest]()
+            if self.actions[code] is not None:
+                self.actions[code]()
+            # Under the lock, so effects run in the order of the transitions
+            if self.threaded:
+                self.effects.put(code)
+        finally:
+            self.lock.release()
+        if not self.threaded:
+            self.run_effects(code)
+        return True
+
+    def run(self):
+        while True:
+            code = self.effects.get()
+            if code is None:
+                return
+            try:
+                self.run_effects(code)
+            except Exception:
+                logging.exception('State effects failed')
+
+    def run_effects(self, code):
+        trigger, source = divmod(code, self.n_states)
+        dest = self.table[code]
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug('%s: %s -> %s'%(self.triggers[trigger], self.names[source], self.names[dest]))
+        if dest != source and self.show[dest] is not None:
+            self.show[dest]()
+
+    def stop(self):
+        if self.thread is not None:
+            self.effects.put(None)
+            self.thread.join()
+            self.thread = None
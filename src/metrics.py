@@ -0,0 +1,228 @@
+"""
+Counters and histograms for the audio hot path.
+
+Everything is preallocated: recording a value is a bisect into a fixed
+list of bin edges and a few integer increments, so the audio thread
+never grows a container or creates an array. Values are written by a
+single thread each (the audio thread, or the dispatcher for mix times)
+and read by summary()/dump() without locks; a summary may be off by the
+block being processed at that moment.
+"""
+import json
+import logging
+from bisect import bisect_right
+from time import perf_counter
+
+# Seconds, 10 bins per decade from 10 us to 1 s
+time_bins = [1e-5*10**(i/10.) for i in range(51)]
+# Callback duration over block duration
+load_bins = [i/20. for i in range(1, 41)]
+# Number of tasks waiting for the dispatcher
+depth_bins = list(range(1, 65))
+
+# sounddevice.CallbackFlags attributes counted as xruns
+xrun_flags = ['input_underflow', 'input_overflow', 'output_underflow', 'output_overflow']
+
+
+class Stopwatch(object):
+    """
+    Durations of the successive phases of something (e.g. the startup of
+    the looper), from the perf_counter() time start on, and times at which
+    events happened since start.
+    """
+
+    def __init__(self, start = None):
+        self.start = perf_counter() if start is None else start
+        self.last = self.start
+        self.laps = [] # (phase, seconds)
+        self.marks = [] # (event, seconds since start)
+
+    def lap(self, name, end = None):
+        """Phase name ended at end (default: now)."""
+        end = perf_counter() if end is None else end
+        self.laps.append((name, end-self.last))
+        self.last = end
+
+    def mark(self, name):
+        self.marks.append((name, perf_counter()-self.start))
+
+    def has(self, name):
+        return any(n == name for n, t in self.marks)
+
+    def summary(self):
+        lines = ['%-16s %7.1f ms'%(name, 1e3*t) for name, t in self.laps]
+        lines.append('%-16s %7.1f ms'%('total', 1e3*(self.last-self.start)))
+        lines += ['%-16s at %4.0f ms'%(name, 1e3*t) for name, t in self.marks]
+        return '\n'.join(lines)
+
+    def as_dict(self):
+        return {'laps': dict(self.laps), 'marks': dict(self.marks)}
+
+
+class Histogram(object):
+    """Counts of values in fixed bins, bin i holds edges[i-1] <= value < edges[i]."""
+
+    def __init__(self, edges, unit = ''):
+        self.edges = list(edges)
+        self.unit = unit
+        self.counts = [0]*(len(self.edges)+1)
+        self.n = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value):
+        self.counts[bisect_right(self.edges, value)] += 1
+        self.n += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.n = 0
+        self.total = 0.
+        self.max = 0.
+
+    @property
+    def mean(self):
+        return self.total/self.n if self.n else 0.
+
+    def percentile(self, q):
+        """
+        Upper edge of the bin holding the q-th percentile, or the maximum
+        if it is lower (past the last bin, or all values low in the bin).
+        """
+        if self.n == 0:
+            return 0.
+        target = q/100.*self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(self.edges[i], self.max) if i < len(self.edges) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'unit': self.unit,
+            'n': self.n,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'edges': self.edges,
+            'counts': list(self.counts),
+        }
+
+
+class Metrics(object):
+    """
+    Hot path metrics of the looper:
+
+        callback         time spent in each audio callback
+        callback_load    the same, as a fraction of the block duration
+        callback_jitter  how far callbacks stray from one block apart
+        boundary_jitter  change, from one loop boundary to the next, in how
+                         long before being played the boundary is computed
+        queue_depth      tasks waiting for the dispatcher at each block
+        mix              time to mix new layers into the master loop
+        task             time taken by each dispatched task
+        input_latency    time from a button edge to its action being applied
+        control          time to handle a batch of network commands (control.py)
+    """
+
+    histogram_names = ['callback', 'callback_load', 'callback_jitter',
+                       'boundary_jitter', 'queue_depth', 'mix', 'task', 'input_latency',
+                       'control']
+    counter_names = ['blocks', 'frames', 'boundaries', 'xruns'] + xrun_flags
+
+    def __init__(self):
+        self.callback = Histogram(time_bins, 's')
+        self.callback_load = Histogram(load_bins)
+        self.callback_jitter = Histogram(time_bins, 's')
+        self.boundary_jitter = Histogram(time_bins, 's')
+        self.queue_depth = Histogram(depth_bins)
+        self.mix = Histogram(time_bins, 's')
+        self.task = Histogram(time_bins, 's')
+        self.input_latency = Histogram(time_bins, 's')
+        self.control = Histogram(time_bins, 's')
+        self.counters = dict.fromkeys(self.counter_names, 0)
+
+        self.last_block_start = None
+        self.last_block_duration = 0.
+        self.last_headroom = None
+        self.started = perf_counter()
+        self.startup = None # Stopwatch of the startup, if any
+
+    @property
+    def histograms(self):
+        return [(name, getattr(self, name)) for name in self.histogram_names]
+
+    def block(self, start, end, frames, block_duration, queue_depth):
+        """One audio callback, from perf_counter() start to end."""
+        counters = self.counters
+        counters['blocks'] += 1
+        counters['frames'] += frames
+        self.callback.add(end-start)
+        if block_duration > 0:
+            self.callback_load.add((end-start)/block_duration)
+        if self.last_block_start is not None:
+            self.callback_jitter.add(abs(start-self.last_block_start-self.last_block_duration))
+        self.last_block_start = start
+        self.last_block_duration = block_duration
+        self.queue_depth.add(queue_depth)
+
+    def boundary(self, headroom):
+        """A loop boundary, computed headroom seconds before it is played."""
+        self.counters['boundaries'] += 1
+        if self.last_headroom is not None:
+            self.boundary_jitter.add(abs(headroom-self.last_headroom))
+        self.last_headroom = headroom
+
+    def xrun(self, status):
+        """Count the flags of a sounddevice callback status."""
+        counters = self.counters
+        counters['xruns'] += 1
+        for flag in xrun_flags:
+            if getattr(status, flag, False):
+                counters[flag] += 1
+
+    def reset(self):
+        for name, histogram in self.histograms:
+            histogram.reset()
+        for name in self.counter_names:
+            self.counters[name] = 0
+        self.last_block_start = None
+        self.last_headroom = None
+        self.started = perf_counter()
+
+    def summary(self):
+        lines = ['%d blocks, %d xruns (%s) in %.0f s'%(
+            self.counters['blocks'],
+            self.counters['xruns'],
+            ', '.join('%s %d'%(flag, self.counters[flag]) for flag in xrun_flags),
+            perf_counter()-self.started)]
+        for name, h in self.histograms:
+            if h.unit == 's':
+                lines.append('%-16s n %6d  mean %7.2f ms  p99 %7.2f ms  max %7.2f ms'%(
+                    name, h.n, 1e3*h.mean, 1e3*h.percentile(99), 1e3*h.max))
+            else:
+                lines.append('%-16s n %6d  mean %7.2f     p99 %7.2f     max %7.2f'%(
+                    name, h.n, h.mean, h.percentile(99), h.max))
+        return '\n'.join(lines)
+
+    def as_dict(self):
+        d = {
+            'duration': perf_counter()-self.started,
+            'counters': dict(self.counters),
+            'histograms': dict((name, h.as_dict()) for name, h in self.histograms),
+        }
+        if self.startup is not None:
+            d['startup'] = self.startup.as_dict()
+        return d
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent = 2)
+        logging.debug('Metrics written to %s'%filename)
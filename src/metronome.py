@@ -0,0 +1,156 @@
+"""
+Metronome bars, rendered once per tempo and kept in an LRU cache.
+
+A bar holds one click per subdivision of every beat, each click on the
+frame the timeline gives it within the bar (ceil of its exact position,
+see timeline.py) and cut where the next one starts. Clicks are scaled by
+the accent of their beat (by default, the first beat of the bar is
+louder), and off-beat subdivisions by subdivision_level.
+
+Holding a tempo button changes the bpm every 60 ms: bars are prefetched
+ahead of it (prefetch(), from the dispatcher thread) so that bar() only
+finds a finished, read-only Loop in the cache, without allocating any
+audio.
+"""
+import hashlib
+import threading
+from fractions import Fraction
+from collections import OrderedDict
+import numpy as np
+import dsp
+from timeline import Timeline, Loop
+
+
+class Metronome(object):
+    """
+    Clicks of click (an (n_samples, channels) or (n_samples,) array) at
+    sample_rate, on channels channels.
+
+    Up to cache_bytes of bars are kept, least recently used first out.
+    With assets (an AssetCache), bars are looked for on disk before being
+    rendered, and save() keeps them there.
+    """
+
+    def __init__(self, sample_rate, click, channels = 2, beats_per_bar = 4, accents = None,
+                 subdivisions = 1, subdivision_level = 0.25, cache_bytes = 32e6,
+                 assets = None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.cache_bytes = cache_bytes
+        self.assets = assets
+        self.bars = OrderedDict() # key: Loop
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.set_click(click)
+        self.configure(beats_per_bar, accents, subdivisions, subdivision_level)
+
+    def set_click(self, click):
+        """Click with another sample from the next bar asked for on."""
+        click = np.array(click, dtype = 'float32')
+        if click.ndim == 1:
+            click = click[:,np.newaxis]
+        click = dsp.match_channels(click, self.channels)
+        click.flags.writeable = False
+        self.click = click
+        # Only bars of the same click are found in the caches
+        self.click_digest = hashlib.sha1(click.tobytes()).hexdigest()[:16]
+
+    def configure(self, beats_per_bar = None, accents = None, subdivisions = None,
+                  subdivision_level = None):
+        """
+        Change the time signature (beats_per_bar), the accent of every beat
+        of the bar (a sequence of gains, default: 1 then 0.5) or the number
+        of clicks per beat. Parameters left to None are kept.
+        """
+        if beats_per_bar is not None:
+            self.beats_per_bar = beats_per_bar
+            if accents is None:
+                accents = [1.] + [0.5]*(beats_per_bar-1)
+        if accents is not None:
+            if len(accents) != self.beats_per_bar:
+                raise ValueError('%d accents for %d beats per bar'%(
+                    len(accents), self.beats_per_bar))
+            self.accents = tuple(float(a) for a in accents)
+        if subdivisions is not None:
+            if subdivisions < 1:
+                raise ValueError('At least one click per beat')
+            self.subdivisions = subdivisions
+        if subdivision_level is not None:
+            self.subdivision_level = float(subdivision_level)
+
+    def key(self, bpm):
+        return ('metronome_bar', self.sample_rate, self.channels, bpm, self.beats_per_bar,
+                self.accents, self.subdivisions, self.subdivision_level, self.click_digest)
+
+    def bar(self, bpm):
+        """The Loop of a bar at bpm."""
+        key = self.key(bpm)
+        with self.lock:
+            loop = self.bars.get(key)
+            if loop is not None:
+                self.bars.move_to_end(key)
+                self.hits += 1
+                return loop
+            self.misses += 1
+        return self.make(bpm, key)
+
+    def prefetch(self, bpms):
+        """Render the bars of bpms that aren't cached yet, keep the others."""
+        for bpm in bpms:
+            key = self.key(bpm)
+            with self.lock:
+                cached = key in self.bars
+                if cached:
+                    self.bars.move_to_end(key)
+            if not cached:
+                self.make(bpm, key)
+
+    def save(self, bpm):
+        """Keep the bar of bpm on disk, for the next start."""
+        key = self.key(bpm)
+        if self.assets is not None and not self.assets.has(key):
+            self.assets.save(self.assets.filename(key), self.bar(bpm).lanes[0].buffer)
+
+    def make(self, bpm, key):
+        timeline = Timeline(self.sample_rate, bpm, self.beats_per_bar)
+        if self.assets is not None:
+            bar = self.assets.array(key, lambda: self.render(timeline), keep = False, store = False)
+        else:
+            bar = self.render(timeline)
+            bar.flags.writeable = False
+        # Another thread may have made it meanwhile
+        return self.add(key, Loop.from_array(bar, timeline.period(self.beats_per_bar)))
+
+    def add(self, key, loop):
+        with self.lock:
+            if key in self.bars:
+                return self.bars[key]
+            self.bars[key] = loop
+            self.nbytes += loop.lanes[0].buffer.nbytes
+            # Never evict the bar just added
+            while self.nbytes > self.cache_bytes and len(self.bars) > 1:
+                old_key, old = self.bars.popitem(last = False)
+                self.nbytes -= old.lanes[0].buffer.nbytes
+        return loop
+
+    def clicks(self, timeline):
+        """(frame in the bar, gain) of every click of a bar."""
+        n = self.subdivisions
+        clicks = []
+        for beat in range(self.beats_per_bar):
+            for i in range(n):
+                level = self.accents[beat]*(1. if i == 0 else self.subdivision_level)
+                clicks.append((timeline.frame(beat + Fraction(i, n)), level))
+        return clicks
+
+    def render(self, timeline):
+        clicks = self.clicks(timeline)
+        length = timeline.length(self.beats_per_bar)
+        bar = np.zeros((length, self.channels), dtype = 'float32')
+        ends = [start for start, level in clicks[1:]] + [length]
+        for (start, level), end in zip(clicks, ends):
+            n = min(len(self.click), end-start)
+            np.multiply(self.click[:n], np.float32(level), out = bar[start:start+n])
+        return bar
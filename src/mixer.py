@@ -0,0 +1,58 @@
+import logging
+import numpy as np
+import dsp
+from layers import LayerStore
+
+
+class Mixer(object):
+    """
+    Incremental mixdown of the recorded layers into the master loop.
+
+    Layers are given already trimmed and faded; they are kept as they are,
+    so adding or removing one only costs a pass over the master loop for
+    that layer. The whole mix is only rebuilt when the loop length changes.
+
+    self.loop may be playing while the next mix is computed, so it is never
+    modified: every change produces a new buffer (read-copy-update).
+
+    Layers are kept in a LayerStore, which bounds the RAM they take.
+    """
+
+    def __init__(self, store = None):
+        self.layers = LayerStore() if store is None else store
+        self.loop = None
+
+    def __len__(self):
+        return len(self.layers)
+
+    def add(self, layer, filename = None, prepare = None):
+        """
+        Mix layer into the loop. filename is the wav file of its raw take,
+        from which prepare() gives the layer back (see layers.py).
+        """
+        self.layers.append(layer, filename, prepare)
+        if self.loop is None or len(layer) > len(self.loop):
+            self.rebuild()
+        else:
+            self.loop = dsp.add_tiled(self.loop.copy(), layer)
+
+    def pop(self):
+        layer = self.layers.pop()
+        if len(self.layers) == 0 or len(layer) == len(self.loop) and \
+                max(self.layers.lengths()) < len(layer):
+            # The loop gets shorter
+            self.rebuild()
+        else:
+            self.loop = dsp.add_tiled(self.loop.copy(), layer, subtract = True)
+        return layer
+
+    def rebuild(self):
+        if len(self.layers) == 0:
+            self.loop = None
+            return
+        logging.debug('Rebuilding mix of %d layers'%len(self.layers))
+        n_samples = max(self.layers.lengths())
+        loop = np.zeros((n_samples, self.layers.channels), dtype = 'float32')
+        for l in self.layers:
+            dsp.add_tiled(loop, l)
+        self.loop = loop
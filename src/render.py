@@ -0,0 +1,212 @@
+"""
+Offline render of a scripted session.
+
+A session script gives the tempo, the takes played into the looper and
+button events at beat positions. The script runs on the simulation
+harness (see simulation.py), which is the same Looper, engine, dsp and
+mixing code as live mode with no buttons or sound card: the run is as
+fast as the CPU allows, and bit-exact from one run to the next. The
+output is written to a WAV file (float by default, so it can be
+compared sample for sample):
+
+    python3 render.py session.json out.wav
+    python3 render.py session.json out.wav --profile
+
+A script is a JSON object:
+
+    {
+        "bpm": 100,
+        "latency": 0,
+        "sample_rate": 48000,
+        "channels": 2,
+        "blocksize": 256,
+        "takes": {"bass": "bass.wav", "drums": "drums.wav"},
+        "events": [
+            {"beat": 0, "click": "play"},
+            {"beat": 2, "click": "rec"},
+            {"beat": 4, "play": "bass"},
+            {"beat": 7, "click": "play"},
+            {"beat": 12, "click": "rec"},
+            {"beat": 16, "play": "drums", "gain": 0.5},
+            {"beat": 19, "click": "play"},
+            {"beat": 26, "hold": "back", "seconds": 1.0}
+        ],
+        "end": 40
+    }
+
+Beats count from the start of the render at the bpm of the script (the
+metronome starts on the first beat when play is clicked at beat 0);
+events can be given in seconds with "time" instead of "beat". Actions
+are click, press, release and hold (a button: rec, play, back or forw,
+held for "seconds"), and play (a take, from the takes or a file name,
+with an optional gain). Like buttons on a device, events take effect
+between audio blocks: at the first block boundary at or after their
+frame. File names are relative to the script. The render stops at the
+"end" beat (or "end_time" seconds).
+
+The looper runs at the sample rate and on the channels of the script (by
+default those of config.AudioConfig), takes of other sample rates or
+channels are converted when they are read (see assets.read_sound).
+Everything the looper played is written to the output; stems and the
+journal go to the session directory, a temporary one by default.
+"""
+import os
+import sys
+import json
+import time
+import math
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+from fractions import Fraction
+import numpy as np
+import core
+from assets import read_sound
+from config import AudioConfig
+from timeline import Timeline
+from simulation import Simulation
+
+buttons = ['rec', 'play', 'back', 'forw']
+actions = ['click', 'press', 'release', 'hold', 'play']
+
+
+class Script(object):
+    """A session script, with its takes read."""
+
+    def __init__(self, script, directory = '.'):
+        self.bpm = script.get('bpm', core.initial_bpm)
+        self.latency = script.get('latency', 0)
+        self.config = AudioConfig(**dict((name, script[name]) for name in
+            ['sample_rate', 'channels', 'blocksize'] if name in script))
+        self.sample_rate = self.config.sample_rate
+        self.timeline = Timeline(self.sample_rate, self.bpm)
+        self.directory = directory
+        self.takes = {}
+        for name, filename in script.get('takes', {}).items():
+            self.takes[name] = self.read(filename)
+        self.events = sorted((self.event(event) for event in script.get('events', [])),
+                             key = lambda event: event[0])
+        if 'end' in script:
+            self.end = self.frame({'beat': script['end']})
+        elif 'end_time' in script:
+            self.end = self.frame({'time': script['end_time']})
+        else:
+            raise ValueError('The script has no end (beat) or end_time (seconds)')
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            script = json.load(f)
+        return cls(script, os.path.dirname(os.path.abspath(filename)))
+
+    def frame(self, event):
+        if 'beat' in event:
+            return self.timeline.frame(Fraction(str(event['beat'])))
+        if 'time' in event:
+            return int(round(event['time']*self.sample_rate))
+        raise ValueError('Event without beat or time: %r'%event)
+
+    def event(self, event):
+        """(frame, action, argument, event) of a script event."""
+        action = [a for a in actions if a in event]
+        if len(action) != 1:
+            raise ValueError('An event needs one of %s: %r'%(actions, event))
+        action = action[0]
+        argument = event[action]
+        if action == 'play':
+            if argument not in self.takes:
+                self.takes[argument] = self.read(argument)
+        elif argument not in buttons:
+            raise ValueError('Unknown button %r, use one of %s'%(argument, buttons))
+        return (self.frame(event), action, argument, event)
+
+    def read(self, filename):
+        return read_sound(os.path.join(self.directory, filename), self.sample_rate,
+                          self.config.channels)
+
+
+def render(script, session_directory = None):
+    """
+    Run script (a Script) and return everything the looper played, an
+    (n_frames, channels) float32 array. The session is recorded in
+    session_directory, by default a temporary one that is removed after.
+    """
+    sim = Simulation(latency = script.latency, recording_directory = session_directory,
+                     config = script.config, bpm = script.bpm)
+    try:
+        for frame, action, argument, event in script.events:
+            run_to(sim, frame)
+            if action == 'play':
+                sim.play(script.takes[argument]*np.float32(event.get('gain', 1.)))
+            elif action == 'hold':
+                sim.hold(argument, event.get('seconds', core.long_press_time))
+            else:
+                getattr(sim, action)(argument)
+        run_to(sim, script.end)
+        return sim.output[:script.end]
+    finally:
+        sim.close()
+
+
+def run_to(sim, frame):
+    """Run whole blocks until frame is reached."""
+    if frame > sim.frame:
+        blocksize = sim.audio.blocksize
+        sim.run_frames(int(math.ceil((frame - sim.frame)/blocksize))*blocksize)
+
+
+def digest(output):
+    return hashlib.sha1(np.ascontiguousarray(output).tobytes()).hexdigest()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = 'Render a scripted looper session offline',
+        epilog = 'See the top of render.py for the script format.')
+    parser.add_argument('script', help = 'session script (JSON)')
+    parser.add_argument('output', help = 'WAV file to write')
+    parser.add_argument('--subtype', default = 'FLOAT',
+                        help = 'WAV subtype, e.g. PCM_16 (default: FLOAT, bit-exact)')
+    parser.add_argument('--session-directory', metavar = 'DIRECTORY',
+                        help = 'keep the stems and journal there (default: a temporary directory)')
+    parser.add_argument('--profile', nargs = '?', const = 25, type = int, metavar = 'N',
+                        help = 'profile the render and print the N slowest functions')
+    parser.add_argument('-v', '--verbose', action = 'store_true', help = 'log the looper')
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    script = Script.load(args.script)
+    directory = args.session_directory
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix = 'pi-looper-render-')
+    else:
+        os.makedirs(directory, exist_ok = True)
+
+    start = time.perf_counter()
+    try:
+        if args.profile:
+            import cProfile
+            import pstats
+            profile = cProfile.Profile()
+            output = profile.runcall(render, script, directory)
+        else:
+            output = render(script, directory)
+        elapsed = time.perf_counter() - start
+    finally:
+        if args.session_directory is None:
+            shutil.rmtree(directory, ignore_errors = True)
+
+    import soundfile as sf
+    sf.write(args.output, output, script.sample_rate, subtype = args.subtype)
+    duration = len(output)/script.sample_rate
+    print('%s: %.1f s rendered in %.2f s (%.0fx real time), sha1 %s'%(
+        args.output, duration, elapsed, duration/elapsed, digest(output)))
+    if args.profile:
+        pstats.Stats(profile, stream = sys.stdout).sort_stats('cumulative').print_stats(args.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Session files, written in the background.
+
+A session directory holds
+
+    loop_XXX.wav    every take (stem), as recorded
+    master.wav      everything the looper played (master_1.wav... for
+                    the runs of a resumed session)
+    session.jsonl   the journal: one JSON event per line, appended as the
+                    session goes (bpm, layers with their track and start
+                    frame, undos and clears, track gains, resumes)
+
+The audio thread only copies its output into a preallocated ring buffer;
+the writer thread drains it into master.wav in chunks, in between writing
+stems and journal events in order of submission. A stem is always on disk
+before the journal event that refers to it.
+
+After a crash, the journal is read up to its last complete line, and the
+wav headers the writer had no time to finish are repaired, so the session
+can be reloaded (see Looper.load_session).
+"""
+import os
+import json
+import queue
+import struct
+import logging
+import threading
+import numpy as np
+
+journal_name = 'session.jsonl'
+master_name = 'master.wav'
+journal_version = 1
+
+
+class SessionWriter(object):
+    """
+    Writes the files of the session in directory. Without a thread
+    (threaded = False, for simulations) everything is written right away.
+    """
+
+    def __init__(self, directory, sample_rate, channels = 2, threaded = True,
+                 chunk_time = 0.5, buffer_time = 10.):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.threaded = threaded
+        self.chunk_frames = int(chunk_time*sample_rate)
+        self.chunk_time = chunk_time
+
+        # Output of the looper, written by the audio thread only
+        self.ring = np.zeros((int(buffer_time*sample_rate), channels), dtype = 'float32')
+        self.n_written = 0 # frames put in the ring, by the audio thread
+        self.n_read = 0 # frames written to master.wav, by the writer
+        self.n_dropped = 0
+
+        self.jobs = queue.SimpleQueue()
+        self.thread = None
+        self.master = None
+        self.journal_file = None
+
+    def start(self):
+        self.journal_file = open(os.path.join(self.directory, journal_name), 'a')
+        if self.threaded:
+            # soundfile is imported there too, off the startup path
+            self.thread = threading.Thread(name = 'writer', target = self.run, daemon = True)
+            self.thread.start()
+        else:
+            self.open_master()
+
+    def open_master(self):
+        import soundfile as sf
+        # A resumed session keeps the master of every earlier run
+        filename = os.path.join(self.directory, master_name)
+        root, ext = os.path.splitext(filename)
+        n = 1
+        while os.path.exists(filename):
+            filename = '%s_%d%s'%(root, n, ext)
+            n += 1
+        self.master = sf.SoundFile(filename, 'w', self.sample_rate, self.channels, 'PCM_16')
+
+    def stop(self):
+        if self.thread is not None:
+            self.jobs.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.master is not None:
+            self.drain()
+            self.master.close()
+            self.master = None
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+        if self.n_dropped:
+            logging.warning('%d frames of output could not be written to %s'%(
+                self.n_dropped, master_name))
+
+    def submit(self, function, *args):
+        if self.threaded:
+            self.jobs.put((function, args))
+        else:
+            function(*args)
+
+    def journal(self, event, **fields):
+        """Append an event to the journal."""
+        fields['event'] = event
+        self.submit(self.write_event, fields)
+
+    def write_stem(self, filename, sound):
+        self.submit(self.write_wav, filename, sound)
+
+    def master_block(self, block):
+        """Called from the audio thread with every block of output."""
+        n = len(block)
+        size = len(self.ring)
+        if self.n_written + n - self.n_read > size:
+            self.n_dropped += n
+            return
+        start = self.n_written % size
+        m = min(n, size - start)
+        self.ring[start:start+m] = block[:m]
+        self.ring[:n-m] = block[m:]
+        self.n_written += n
+        if not self.threaded and self.n_written - self.n_read >= self.chunk_frames:
+            # In chunks too, flushing every block is most of a simulation's time
+            self.drain()
+
+    def run(self):
+        self.open_master()
+        while True:
+            try:
+                job = self.jobs.get(timeout = self.chunk_time)
+            except queue.Empty:
+                job = ()
+            self.drain()
+            if job is None:
+                return
+            if job:
+                function, args = job
+                try:
+                    function(*args)
+                except Exception:
+                    logging.exception('Writing the session failed')
+
+    def drain(self):
+        """Write the output gathered in the ring to master.wav."""
+        n_written = self.n_written
+        size = len(self.ring)
+        while self.n_read < n_written:
+            start = self.n_read % size
+            n = min(n_written - self.n_read, size - start)
+            self.master.write(self.ring[start:start+n])
+            self.n_read += n
+        self.master.flush()
+
+    def write_event(self, event):
+        self.journal_file.write(json.dumps(event) + '\n')
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+    def write_wav(self, filename, sound):
+        import soundfile as sf
+        # In chunks, to keep draining the output in between
+        with sf.SoundFile(filename, 'w', self.sample_rate, sound.shape[1], 'PCM_16') as f:
+            for start in range(0, len(sound), self.chunk_frames):
+                f.write(sound[start:start+self.chunk_frames])
+                if self.threaded:
+                    self.drain()
+        logging.debug('Wrote %s'%os.path.basename(filename))
+
+
+def read_journal(filename):
+    """
+    Events of a journal. A crash may have cut its last line, which is then
+    ignored, as is everything after a line that can't be read.
+    """
+    with open(filename, 'rb') as f:
+        lines = f.read().split(b'\n')
+    events = []
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line.decode('utf-8')))
+        except ValueError:
+            if i == len(lines)-1:
+                logging.warning('Ignoring the truncated last line of %s'%filename)
+            else:
+                logging.warning('Unreadable line %d in %s, ignoring the rest'%(i+1, filename))
+            break
+    return events
+
+
+class SessionState(object):
+    """What the events of a journal add up to."""
+
+    def __init__(self, events):
+        self.sample_rate = None # of the first run, which every other one must match
+        self.channels = None
+        self.bpm = None
+        self.layers = [] # layer events, in order, without the undone ones
+        self.tracks = {} # track: {'gain', 'mute', 'pan'}
+        # Every run counts frames from 0, layer starts are moved to the
+        # frames of the first run
+        shift = 0
+        for event in events:
+            kind = event.get('event')
+            if kind == 'session':
+                if self.sample_rate is None:
+                    self.sample_rate = event['sample_rate']
+                    self.channels = event.get('channels')
+                shift = 0
+            elif kind == 'resume':
+                shift = event['first_start'] - event['origin']
+            elif kind == 'bpm':
+                self.bpm = event['bpm']
+            elif kind == 'layer':
+                self.layers.append(dict(event, start = event['start'] + shift))
+            elif kind == 'undo':
+                if self.layers:
+                    self.layers.pop()
+            elif kind == 'clear':
+                self.layers = []
+            elif kind == 'track':
+                self.tracks[event['track']] = dict(
+                    (k, event[k]) for k in ['gain', 'mute', 'pan'])
+
+
+def load(directory):
+    """SessionState of the session in directory."""
+    return SessionState(read_journal(os.path.join(directory, journal_name)))
+
+
+def find_last(recording_directory, exclude = None):
+    """Most recent session directory with a journal, or None."""
+    sessions = sorted(
+        d for d in os.listdir(recording_directory)
+        if os.path.isfile(os.path.join(recording_directory, d, journal_name)))
+    sessions = [os.path.join(recording_directory, d) for d in sessions]
+    sessions = [d for d in sessions if exclude is None or
+                os.path.abspath(d) != os.path.abspath(exclude)]
+    return sessions[-1] if sessions else None
+
+
+def repair_wav(filename):
+    """
+    Fix the sizes in the header of a wav file whose writer did not close it
+    (they are only written on close), so that it holds every complete frame.
+    Returns False if it isn't a wav file.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, 'r+b') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:] != b'WAVE':
+            return False
+        block_align = 1
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return False
+            chunk, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk == b'fmt ':
+                fmt = f.read(chunk_size)
+                block_align = struct.unpack('<H', fmt[12:14])[0]
+            elif chunk == b'data':
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
+        offset = f.tell()
+        data_size = (size - offset)//block_align*block_align
+        if chunk_size == 0 or chunk_size > size - offset:
+            logging.warning('Repairing the header of %s'%filename)
+            f.seek(offset - 4)
+            f.write(struct.pack('<I', data_size))
+            f.seek(4)
+            f.write(struct.pack('<I', offset + data_size - 8))
+    return True
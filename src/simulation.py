@@ -0,0 +1,124 @@
+"""
+Hardware-free simulation harness for the Looper.
+
+Runs a Looper on gpiozero's mock pins, an in-memory audio device and a
+virtual clock, so that a whole session runs faster than real time on any
+Linux box:
+
+    sim = Simulation()
+    sim.click('play')            # metronome
+    sim.run_beats(2)
+    sim.click('rec')             # pre_rec, recording starts on the next bar
+    sim.play(take, sim.next_bar_frame())
+    sim.run_bars(2)
+    sim.click('play')            # pre_play, the take is added on the next bar
+    sim.run_bars(2)
+    sim.output                   # everything the looper played
+
+render.py runs such sessions from a script, on the command line.
+"""
+import shutil
+import tempfile
+from audio import MemoryAudio
+from clock import VirtualClock
+from config import AudioConfig
+from hardware import Hardware
+import core
+
+
+class Simulation(object):
+
+    def __init__(self, blocksize = 256, recording_directory = None, latency = 0,
+                 loopback = None, resume = None, config = None, bpm = None):
+        """
+        config (an AudioConfig) sets the sample rate and channels, the
+        blocks are of blocksize frames unless it has a block size. bpm
+        is the tempo the metronome starts at (see core.Looper).
+
+        Without recording_directory (or resume), the session is recorded
+        in a temporary directory, removed by close().
+        """
+        if config is None:
+            config = AudioConfig(blocksize = blocksize)
+        elif not config.blocksize:
+            config = AudioConfig(**dict(config.as_dict(), blocksize = blocksize))
+        self.config = config
+        self.clock = VirtualClock()
+        self.hardware = Hardware.mock(self.clock)
+        self.audio = MemoryAudio(config.sample_rate, config.channels, config.blocksize,
+                                 self.clock, loopback)
+        self.temporary_directory = None
+        if recording_directory is None and resume is None:
+            recording_directory = self.temporary_directory = tempfile.mkdtemp(prefix = 'pi-looper-')
+        try:
+            self.looper = core.Looper(
+                hardware = self.hardware,
+                audio = self.audio,
+                clock = self.clock,
+                recording_directory = recording_directory,
+                latency = latency,
+                resume = resume,
+                config = config,
+                bpm = bpm)
+        except Exception:
+            self.remove_temporary_directory()
+            raise
+
+    @property
+    def output(self):
+        return self.audio.output
+
+    @property
+    def frame(self):
+        return self.audio.frame
+
+    def press(self, button):
+        self.hardware.press(button)
+
+    def release(self, button):
+        self.hardware.release(button)
+
+    def click(self, button):
+        self.press(button)
+        self.release(button)
+
+    def hold(self, button, seconds):
+        """Press button, and release it once the clock has moved by seconds."""
+        self.clock.call_later(seconds, lambda: self.release(button))
+        self.press(button)
+
+    def play(self, sound, frame = None):
+        """Play sound into the looper's input, from frame (default: now)."""
+        self.audio.play(sound, frame)
+
+    def run(self, seconds):
+        self.audio.run(seconds)
+
+    def run_frames(self, frames):
+        self.audio.run_frames(frames)
+
+    def run_beats(self, n_beats):
+        self.run_frames(self.looper.timeline.length(n_beats))
+
+    def run_bars(self, n_bars):
+        self.run_beats(4*n_bars)
+
+    def next_bar_frame(self):
+        """Frame at which the loop (or metronome bar) playing now restarts."""
+        return self.looper.engine.pass_end
+
+    def close(self):
+        self.looper.kill()
+        self.hardware.close()
+        self.remove_temporary_directory()
+
+    def remove_temporary_directory(self):
+        if self.temporary_directory is not None:
+            shutil.rmtree(self.temporary_directory, ignore_errors = True)
+            self.temporary_directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,135 @@
+"""
+Exact loop timing.
+
+Beat and loop lengths are kept as fractions of samples, so that nothing
+is rounded more than once: a loop of period P samples starts its k-th
+pass on frame ceil(k*P), whatever k is. Its buffer holds ceil(P) samples
+and passes are that long or one sample shorter, so that it never drifts
+from the metronome, however long it plays.
+
+Loops are made of lanes, each repeating on its own period with modulo
+indexing: layers of 1, 2, 3 or 4 bars play side by side without being
+tiled to a common length.
+"""
+import math
+from fractions import Fraction
+import numpy as np
+
+
+def ceil_div(a, b):
+    return -(-a // b)
+
+
+class Timeline(object):
+    """Beats of a given tempo, in (fractional) samples."""
+
+    def __init__(self, sample_rate, bpm, beats_per_bar = 4):
+        self.sample_rate = sample_rate
+        self.bpm = bpm
+        self.beats_per_bar = beats_per_bar
+        self.samples_per_beat = Fraction(60*sample_rate)/Fraction(bpm)
+
+    def period(self, n_beats):
+        """Exact length of n_beats beats, in samples."""
+        return n_beats*self.samples_per_beat
+
+    def frame(self, beat):
+        """Frame of a beat, counted from frame 0 at beat 0."""
+        return math.ceil(beat*self.samples_per_beat)
+
+    def length(self, n_beats):
+        """Number of samples needed to hold n_beats beats."""
+        return self.frame(n_beats)
+
+    def next_frame(self, offset, n_beats = 1):
+        """First frame at or after offset on which a multiple of n_beats beats starts."""
+        period = self.period(n_beats)
+        k = (offset-1)*period.denominator // period.numerator + 1
+        return math.ceil(k*period)
+
+    def beats(self, n_samples):
+        """Nearest whole number of beats in n_samples, at least one."""
+        return max(1, round(Fraction(n_samples)/self.samples_per_beat))
+
+
+class Lane(object):
+    """
+    buffer, played every period samples (a Fraction) from the origin of its
+    loop. track is the index of the track whose gains it is mixed with.
+    """
+
+    def __init__(self, buffer, period = None, track = None):
+        self.buffer = buffer
+        self.period = Fraction(len(buffer) if period is None else period)
+        self.num = self.period.numerator
+        self.den = self.period.denominator
+        self.track = track
+        if len(buffer) < ceil_div(self.num, self.den):
+            raise ValueError('Lane buffer shorter than its period')
+
+    def bounds(self, offset):
+        """First frame of the pass holding offset, and first frame of the next one."""
+        k = offset*self.den // self.num
+        return ceil_div(k*self.num, self.den), ceil_div((k+1)*self.num, self.den)
+
+    def read(self, offset, out):
+        """Copy the samples played from offset (frames since the origin) on into out."""
+        n = len(out)
+        written = 0
+        while written < n:
+            start, end = self.bounds(offset + written)
+            position = offset + written - start
+            m = min(n - written, end - start - position)
+            out[written:written+m] = self.buffer[position:position+m]
+            written += m
+        return out
+
+
+class Loop(object):
+    """
+    Lanes played together. Loop boundaries come every period samples (by
+    default the longest lane's) from origin, an absolute frame, or from
+    the frame the loop starts playing at when origin is None.
+
+    Like buffers, loops are never modified once given to the engine.
+    """
+
+    def __init__(self, lanes, period = None, origin = None):
+        self.lanes = lanes
+        self.period = max(l.period for l in lanes) if period is None else Fraction(period)
+        self.num = self.period.numerator
+        self.den = self.period.denominator
+        self.origin = origin
+        # Either all lanes belong to tracks, or none does
+        if lanes[0].track is None:
+            self.tracks = None
+        else:
+            self.tracks = np.array([l.track for l in lanes])
+
+    @classmethod
+    def from_array(cls, buffer, period = None):
+        return cls([Lane(buffer, period)])
+
+    def __len__(self):
+        """Length of the longest pass."""
+        return ceil_div(self.num, self.den)
+
+    @property
+    def channels(self):
+        return self.lanes[0].buffer.shape[1]
+
+    def bounds(self, offset):
+        """First frame of the pass holding offset, and first frame of the next one."""
+        k = offset*self.den // self.num
+        return ceil_div(k*self.num, self.den), ceil_div((k+1)*self.num, self.den)
+
+    def render(self, offset, n, gains = None):
+        """The n frames played from offset (frames since the origin), mixed with gains."""
+        out = np.zeros((n, self.channels), dtype = 'float32')
+        block = np.empty((n, self.channels), dtype = 'float32')
+        for lane in self.lanes:
+            lane.read(offset, block)
+            if lane.track is not None and gains is not None:
+                block *= gains[lane.track]
+            out += block
+        return out
@@ -0,0 +1,140 @@
+"""
+Tracks of the looper.
+
+Every track has a gain, a mute and a pan, and mixes its layers into one
+lane per loop length (a Mixer each): layers of 1, 2, 3 or 4 bars repeat
+on their own periods (see timeline.py) instead of being tiled to the
+longest. The engine mixes all lanes block by block with a (tracks,
+channels) gains matrix:
+
+    out[n, c] = sum over lanes l of lane_l[n, c]*gains[track of l, c]
+
+so changing a gain or muting a track takes effect at the next audio
+block, without any rebuild. Like the loops, published gains matrices are
+never modified afterwards.
+"""
+import numpy as np
+from mixer import Mixer
+from timeline import Lane, Loop
+
+
+class Track(object):
+
+    def __init__(self, store_factory = None):
+        self.store_factory = store_factory
+        self.store = None if store_factory is None else store_factory()
+        self.lanes = {} # period: Mixer of the layers of that length
+        self.gain = 1.
+        self.mute = False
+        self.pan = 0. # -1 (left) to 1 (right)
+
+    def __len__(self):
+        return sum(len(m) for m in self.lanes.values())
+
+    def lane(self, period):
+        if period not in self.lanes:
+            # All lanes of the track keep their layers in its store
+            self.lanes[period] = Mixer(None if self.store is None else self.store.lane())
+        return self.lanes[period]
+
+    def clear(self):
+        self.store = None if self.store_factory is None else self.store_factory()
+        self.lanes = {}
+
+    def gains(self, channels):
+        """
+        Gain of every channel. The pan is a balance: the centre leaves
+        both channels at the track gain, panning turns one side down.
+        """
+        if self.mute:
+            return np.zeros(channels, dtype = 'float32')
+        gains = np.full(channels, self.gain, dtype = 'float32')
+        if channels == 2:
+            gains[0] *= min(1., 1.-self.pan)
+            gains[1] *= min(1., 1.+self.pan)
+        return gains
+
+
+class Tracks(object):
+    """
+    n_tracks tracks, whose layers are kept in a store made by
+    store_factory() for each track (see layers.py), shared by the lanes of
+    the track. Only used from the dispatcher thread.
+
+    self.loop is the Loop of all lanes, whose passes are counted from
+    self.origin: the frame at which the first layer was recorded.
+    """
+
+    def __init__(self, n_tracks = 4, channels = 2, store_factory = None):
+        self.channels = channels
+        self.tracks = [Track(store_factory) for i in range(n_tracks)]
+        self.history = [] # (track, period) of every layer, in order of recording
+        self.origin = None
+        self.loop = None
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __getitem__(self, i):
+        return self.tracks[i]
+
+    @property
+    def n_layers(self):
+        return len(self.history)
+
+    def gains(self):
+        """Gains matrix, (tracks, channels)."""
+        return np.array([t.gains(self.channels) for t in self.tracks], dtype = 'float32')
+
+    def add(self, track, layer, period, start, filename = None, prepare = None):
+        """
+        Add a layer of period samples (a Fraction, len(layer) rounded up)
+        recorded from the absolute frame start on. filename is the wav file
+        of its raw take, from which prepare() gives the layer back.
+        """
+        if self.origin is None:
+            self.origin = start
+        # The lane may be at any point of its period when the layer starts
+        offset = start - self.origin
+        shift = offset - Lane(layer, period).bounds(offset)[0]
+        if shift:
+            layer = np.roll(layer, shift, axis = 0)
+            if prepare is not None:
+                prepare = rolled(prepare, shift)
+        self.tracks[track].lane(period).add(layer, filename, prepare)
+        self.history.append((track, period))
+        self.update()
+
+    def pop(self):
+        """Remove the last recorded layer, whichever its track."""
+        track, period = self.history.pop()
+        layer = self.tracks[track].lanes[period].pop()
+        if not self.history:
+            self.origin = None
+        self.update()
+        return layer
+
+    def clear(self):
+        """Remove every layer, the tracks keep their gain, mute and pan."""
+        for track in self.tracks:
+            track.clear()
+        self.history = []
+        self.origin = None
+        self.loop = None
+
+    def update(self):
+        lanes = []
+        for i, track in enumerate(self.tracks):
+            for period, mixer in sorted(track.lanes.items()):
+                if mixer.loop is not None:
+                    lanes.append(Lane(mixer.loop, period, track = i))
+        if not lanes:
+            self.loop = None
+            return
+        self.loop = Loop(lanes, origin = self.origin)
+
+
+def rolled(prepare, shift):
+    def prepare_rolled(take):
+        return np.roll(prepare(take), shift, axis = 0)
+    return prepare_rolled
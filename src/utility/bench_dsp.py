@@ -0,0 +1,56 @@
+# Microbenchmarks of the dsp kernels against the code they replaced
+# in core.py (per-sample fade mask loop, float64 trim, np.tile).
+#
+# usage: python3 bench_dsp.py
+
+import sys
+import timeit
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import dsp
+
+sample_rate = 44100
+fade_samples = int(0.01*sample_rate)
+latency_samples = int(0.05*sample_rate)
+loop = np.random.uniform(-0.5, 0.5, (5*sample_rate, 2)).astype('float32')
+n_samples = len(loop) + sample_rate//10 # needs padding
+
+
+def python_fade_masks():
+    fadein_mask = np.ones((fade_samples,2))
+    fadeout_mask = np.ones((fade_samples,2))
+    for i in range(fade_samples):
+        fadein_mask[i]*=i/fade_samples
+        fadeout_mask[-1-i]*=i/fade_samples
+
+
+def float64_trim():
+    trimmed_loop = np.zeros((n_samples,2))
+    trimmed_loop[:len(loop)-latency_samples] += loop[latency_samples:len(loop)]
+
+
+def numpy_tile():
+    np.tile(loop[:sample_rate], (round(len(loop)/sample_rate),1))
+
+
+out = np.empty_like(loop)
+master = np.zeros_like(loop)
+benchmarks = [
+    ('fade masks (python loop)', python_fade_masks),
+    ('fade_curve (cached)', lambda: dsp.fade_curve(fade_samples)),
+    ('fade_curve (uncached)', lambda: dsp.fade_curve.__wrapped__(fade_samples)),
+    ('trim (float64 zeros)', float64_trim),
+    ('dsp.trim (padded)', lambda: dsp.trim(loop, n_samples, latency_samples)),
+    ('dsp.trim (view)', lambda: dsp.trim(loop, len(loop)//2, latency_samples)),
+    ('dsp.fade (copy)', lambda: dsp.fade(loop, fade_samples)),
+    ('dsp.fade (out=)', lambda: dsp.fade(loop, fade_samples, out=out)),
+    ('np.tile', numpy_tile),
+    ('dsp.tile (out=)', lambda: dsp.tile(loop[:sample_rate], len(loop), out=out)),
+    ('dsp.add_tiled', lambda: dsp.add_tiled(master, loop[:sample_rate])),
+]
+
+for name, function in benchmarks:
+    n = 20
+    t = min(timeit.repeat(function, number=n, repeat=5))/n
+    print('%-26s %8.3f ms'%(name, 1e3*t))
@@ -0,0 +1,72 @@
+# Memory taken by 50 recorded layers, with the layers kept as float32
+# arrays (as before layers.py) and with a LayerStore budget, compacting
+# old layers to int16 or float16 or mapping them onto their wav files.
+# Also times a full rebuild of the mix, and its largest difference with
+# the float32 mix.
+#
+# usage: python3 bench_layer_memory.py [seconds per layer] [budget in MB]
+
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import soundfile as sf
+from mixer import Mixer
+from layers import LayerStore
+
+sample_rate = 44100
+n_layers = 50
+layer_time = float(sys.argv[1]) if len(sys.argv) > 1 else 8.
+budget = float(sys.argv[2])*1e6 if len(sys.argv) > 2 else 32e6
+
+directory = tempfile.mkdtemp(prefix='pi-looper-bench-')
+filenames = [path.join(directory, 'loop_{:03d}.wav'.format(i)) for i in range(n_layers)]
+rng = np.random.default_rng(0)
+for filename in filenames:
+    take = rng.uniform(-0.02, 0.02, (int(layer_time*sample_rate), 2)).astype('float32')
+    sf.write(filename, take, sample_rate)
+
+
+def prepare(take):
+    return take
+
+
+def record(store):
+    """Mixes the 50 takes, returns the memory held and the mix."""
+    tracemalloc.start()
+    mixer = Mixer(store)
+    for filename in filenames:
+        take, sr = sf.read(filename, dtype='float32')
+        mixer.add(take, filename, prepare)
+        del take
+    held = tracemalloc.get_traced_memory()[0]
+    ts = time.perf_counter()
+    mixer.rebuild()
+    rebuild_time = time.perf_counter()-ts
+    tracemalloc.stop()
+    return held, rebuild_time, mixer
+
+
+print('%d layers of %.0f s, %.0f MB as float32, budget %.0f MB' % (
+    n_layers, layer_time, n_layers*layer_time*sample_rate*2*4/1e6, budget/1e6))
+reference = None
+for name, store in [
+        ('float32, no budget', LayerStore()),
+        ('int16', LayerStore(budget, 'int16')),
+        ('float16', LayerStore(budget, 'float16')),
+        ('memmap', LayerStore(budget, None))]:
+    held, rebuild_time, mixer = record(store)
+    if reference is None:
+        reference = mixer.loop
+    tiers = store.tiers()
+    print('%-20s %6.1f MB held (%2d hot, %2d compact, %2d mapped), '
+          'rebuild %5.0f ms, max error %.1e' % (
+        name, held/1e6, tiers.count('hot'), tiers.count('compact'),
+        tiers.count('mapped'), 1e3*rebuild_time, np.abs(mixer.loop-reference).max()))
+    del mixer, store
+
+shutil.rmtree(directory)
@@ -0,0 +1,127 @@
+# Worst-case delay of loop boundaries while the looper logs to a slow
+# console and animates its LEDs: logging straight to the stream handler
+# and LEDs driven by the threads that change them (as before), against
+# the queue of indicators.py (records and LED commands written by the
+# output thread, chatty debug messages rate limited).
+#
+# An audio thread runs 256 frame blocks in real time at 44.1 kHz. On
+# every beat (100 bpm) it crosses a boundary, where it logs a debug line
+# and toggles an LED. Meanwhile an input thread logs a tempo step and
+# turns an LED off and on every 60 ms, and runs an LED animation every 2
+# s, and a dispatcher thread logs a timing line every 0.5 s. The console
+# takes 2 ms per write, and stalls for 50 ms on every 25th one (an SD
+# card flush).
+#
+# The delay of a boundary is from the time its block is due to the end of
+# its work, as seen on the audio thread: over a block (5.8 ms) it is an
+# underrun.
+#
+# usage: python3 bench_logging.py [seconds]
+
+import sys
+import time
+import logging
+import threading
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import indicators
+from hardware import Hardware
+
+duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10.
+sample_rate = 44100
+blocksize = 256
+block_time = blocksize/sample_rate
+blocks_per_beat = int(round(60./100*sample_rate/blocksize))
+write_time = 2e-3
+stall_time = 50e-3
+stall_every = 25
+
+
+class SlowConsole(object):
+
+    def __init__(self):
+        self.n = 0
+
+    def write(self, text):
+        self.n += 1
+        time.sleep(stall_time if self.n % stall_every == 0 else write_time)
+
+    def flush(self):
+        pass
+
+
+def run(leds, stop):
+    def inputs():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            logging.debug('bpm = %d'%(100 + n % 40))
+            leds.forw_led.off()
+            leds.forw_led.on()
+            if n % 33 == 0:
+                if isinstance(leds, indicators.LEDs):
+                    leds.square()
+                else:
+                    leds.led_square()
+            time.sleep(0.06)
+
+    def dispatcher():
+        while not stop.is_set():
+            logging.debug('func:%r took: %.0f ms'%('update_loop', 3.))
+            time.sleep(0.5)
+
+    threads = [threading.Thread(name = 'inputs', target = inputs),
+               threading.Thread(name = 'dispatcher', target = dispatcher)]
+    for t in threads:
+        t.start()
+    delays = []
+    block = np.zeros((blocksize, 2), dtype = 'float32')
+    start = time.perf_counter()
+    n_blocks = int(duration/block_time)
+    for k in range(n_blocks):
+        due = start + k*block_time
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        block += 1e-3 # the mix
+        if k % blocks_per_beat == 0:
+            logging.debug('Boundary at frame %d'%(k*blocksize))
+            leds.play_led.toggle()
+            delays.append(time.perf_counter() - due)
+    stop.set()
+    for t in threads:
+        t.join()
+    return np.array(delays)
+
+
+def report(name, delays):
+    print('%-32s boundary delay: median %6.2f ms  p99 %6.2f ms  max %6.2f ms, %d over a block'%(
+        name, 1e3*np.median(delays), 1e3*np.percentile(delays, 99), 1e3*delays.max(),
+        (delays > block_time).sum()))
+
+
+hardware = Hardware.mock()
+format = '(%(threadName)-10s) %(message)s'
+root = logging.getLogger()
+
+# Before: the handler writes on the thread that logs
+console = SlowConsole()
+handler = logging.StreamHandler(console)
+handler.setFormatter(logging.Formatter(format))
+root.handlers = [handler]
+root.setLevel(logging.DEBUG)
+report('stream handler, LEDs in place', run(hardware, threading.Event()))
+written = console.n
+
+# After: queued
+console = SlowConsole()
+worker = indicators.Worker()
+worker.start()
+rate_limit = indicators.RateLimit()
+indicators.queue_logging(worker, logging.DEBUG, format, stream = console, rate_limit = rate_limit)
+report('queued, rate limited', run(indicators.LEDs(hardware, worker), threading.Event()))
+worker.stop()
+print('lines written: %d before, %d after (%d dropped by the rate limit)'%(
+    written, console.n, rate_limit.dropped))
+hardware.close()
@@ -0,0 +1,102 @@
+# Time to dispatch each trigger of the looper's state machine: the former
+# transitions.Machine (with the DEBUG logging the looper had on, and at
+# WARNING) against the compiled table of machine.py (effects on their
+# thread, as on the device, and run inline, as in simulations, with
+# logging off).
+#
+# Each trigger is fired from its source state, over and over; callbacks
+# of the model do nothing, so only the dispatch is timed. The median and
+# 99th percentile of single calls are printed, with the memory traced
+# while a trigger is fired (peak, temporaries included).
+#
+# usage: python3 bench_machine.py [repeat]
+
+import os
+import sys
+import time
+import logging
+import tracemalloc
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from transitions import Machine
+import core
+from machine import StateMachine
+
+repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+# (trigger, source state) going round a recording, and one ignored
+fired = [('release_rec_button', 'play'), ('start_recording', 'pre_rec'),
+         ('release_play_button', 'rec'), ('end_recording', 'pre_play'),
+         ('release_back_button', 'play')]
+
+# Logging goes nowhere, but is formatted when on (the looper's format)
+handler = logging.StreamHandler(open(os.devnull, 'w'))
+handler.setFormatter(logging.Formatter(core.log_format))
+logging.getLogger().handlers = [handler]
+
+
+class Model(object):
+    pass
+
+for state in ['init'] + core.Looper.states:
+    for kind in ['on_exit_', 'on_enter_', 'show_']:
+        setattr(Model, kind + state, lambda self: None)
+for transition in core.Looper.transitions:
+    if len(transition) > 3:
+        setattr(Model, transition[3], lambda self: None)
+
+
+def former(level):
+    model = Model()
+    machine = Machine(model = model, states = core.Looper.states,
+                      transitions = [t for t in core.Looper.transitions if len(t) == 3],
+                      initial = 'init', ignore_invalid_triggers = True)
+    def setup():
+        logging.getLogger('transitions').setLevel(level)
+    return setup, machine.set_state, dict((t, getattr(model, t)) for t, s in fired), None
+
+
+def compiled(threaded):
+    machine = StateMachine(Model(), core.Looper.states, core.Looper.transitions, 'init',
+                           threaded = threaded)
+    def setup():
+        logging.getLogger().setLevel(logging.WARNING)
+    return (setup, machine.set_state,
+            dict((t, machine.fire_functions[machine.trigger_ids[t]]) for t, s in fired), machine)
+
+
+def bench(setup, set_state, triggers):
+    setup()
+    results = []
+    for trigger, source in fired:
+        fire = triggers[trigger]
+        times = np.empty(repeat)
+        for i in range(repeat):
+            set_state(source)
+            ts = time.perf_counter()
+            fire()
+            times[i] = time.perf_counter() - ts
+        set_state(source)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        fire()
+        peak = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        results.append((trigger, source, np.median(times), np.percentile(times, 99), peak))
+    return results
+
+
+machines = [
+    ('transitions.Machine, DEBUG', former(logging.DEBUG)),
+    ('transitions.Machine, WARNING', former(logging.WARNING)),
+    ('StateMachine, effects thread', compiled(True)),
+    ('StateMachine, inline effects', compiled(False)),
+]
+for name, (setup, set_state, triggers, machine) in machines:
+    print(name)
+    for trigger, source, median, p99, peak in bench(setup, set_state, triggers):
+        print('    %-20s from %-9s %7.2f us median %7.2f us p99 %6d bytes peak'%(
+            trigger, source, 1e6*median, 1e6*p99, peak))
+    if machine is not None:
+        machine.stop()
@@ -0,0 +1,60 @@
+# Overhead of the hot path metrics (metrics.py) on the audio callback:
+# runs PlaybackEngine.callback on a 2 s loop with and without metrics,
+# then counts the memory blocks held by the metrics after recording 1000
+# and 100000 blocks: both should be the same handful of numbers.
+#
+# usage: python3 bench_metrics.py [blocksize] [seconds of audio]
+
+import sys
+import time
+import tracemalloc
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from engine import PlaybackEngine
+from metrics import Metrics
+from audio import StreamTime
+
+sample_rate = 44100
+blocksize = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+duration = float(sys.argv[2]) if len(sys.argv) > 2 else 600.
+
+
+def run(with_metrics):
+    engine = PlaybackEngine(sample_rate, blocksize=blocksize, headless=True)
+    if not with_metrics:
+        engine.metrics = None
+    engine.start_loop(np.random.uniform(-1, 1, (2*sample_rate, 2)).astype('float32'))
+    outdata = np.zeros((blocksize, 2), dtype='float32')
+    n_blocks = int(duration*sample_rate/blocksize)
+    ts = time.perf_counter()
+    for i in range(n_blocks):
+        engine.callback(outdata, blocksize, StreamTime(i*blocksize/sample_rate), None)
+    return (time.perf_counter()-ts)/n_blocks
+
+
+def held_blocks(n):
+    metrics = Metrics()
+    start = time.perf_counter()
+    metrics.block(start, start, blocksize, blocksize/sample_rate, 0) # warm up
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(n):
+        metrics.block(start, start+1e-4, blocksize, blocksize/sample_rate, i % 3)
+        metrics.boundary(0.01)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(s.count_diff for s in after.compare_to(before, 'filename')
+               if s.traceback[0].filename.endswith('metrics.py'))
+
+
+without = min(run(False) for i in range(3))
+with_metrics = min(run(True) for i in range(3))
+block_duration = blocksize/sample_rate
+print('%d frame blocks, %.0f s of audio' % (blocksize, duration))
+print('callback without metrics  %6.1f us' % (1e6*without))
+print('callback with metrics     %6.1f us' % (1e6*with_metrics))
+print('overhead                  %6.1f us (%.2f %% of a block)' % (
+    1e6*(with_metrics-without), 100*(with_metrics-without)/block_duration))
+print('memory blocks held by metrics after 1000 blocks: %d, after 100000: %d' % (
+    held_blocks(1000), held_blocks(100000)))
@@ -0,0 +1,49 @@
+# Compares the CPU used by the recorder between takes:
+# the former busy-wait on record_flag (0.1 ms sleeps) against the
+# Recorder, whose only work while idle is an early return in the
+# input callback (simulated here at the rate of 512 frame blocks).
+#
+# usage: python3 bench_recorder_idle.py [seconds]
+
+import sys
+import threading
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from daemons import Recorder, RecordBuffer
+from config import AudioConfig
+
+sample_rate = AudioConfig.sample_rate
+duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.
+timing_precision = 0.1e-3
+blocksize = 512
+
+
+def busy_wait(cpu):
+    record_flag = threading.Event()
+    t_end = time.time() + duration
+    ts = time.thread_time()
+    while not record_flag.is_set() and time.time() < t_end:
+        time.sleep(timing_precision)
+    cpu.append(time.thread_time()-ts)
+
+
+def idle_callbacks(cpu):
+    recorder = Recorder(RecordBuffer(sample_rate))
+    indata = np.zeros((blocksize, 2), dtype='float32')
+    t_end = time.time() + duration
+    ts = time.thread_time()
+    while time.time() < t_end:
+        recorder.process(indata, blocksize, time.time())
+        time.sleep(blocksize/sample_rate)
+    cpu.append(time.thread_time()-ts)
+
+
+for name, target in [('busy-wait on record_flag', busy_wait),
+                     ('event-driven Recorder', idle_callbacks)]:
+    cpu = []
+    t = threading.Thread(target=target, args=(cpu,))
+    t.start()
+    t.join()
+    print('%-25s %5.1f %% of a core'%(name, 100*cpu[0]/duration))
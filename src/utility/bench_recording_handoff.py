@@ -0,0 +1,50 @@
+# Measures what end_recording costs at the loop boundary:
+# the old WAV round trip (copy temp file + read it back) against
+# taking the recording from the in-memory RecordBuffer.
+#
+# usage: python3 bench_recording_handoff.py [directory]
+# Pass a directory on the SD card to get realistic numbers on the Pi.
+
+import sys
+import os
+import shutil
+import tempfile
+from os import path
+from time import perf_counter
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import soundfile as sf
+from daemons import RecordBuffer
+from config import AudioConfig
+
+sample_rate = AudioConfig.sample_rate
+directory = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp()
+N_tests = 5
+
+print('loop length | WAV round trip | RecordBuffer')
+for loop_time in [2, 5, 10, 30]:
+    sound = np.random.uniform(-0.5, 0.5, (loop_time*sample_rate, 2)).astype('float32')
+
+    temp_filename = path.join(directory, 'temp_recording_file.wav')
+    loop_filename = path.join(directory, 'loop_000.wav')
+    sf.write(temp_filename, sound, sample_rate)
+    buffer = RecordBuffer(len(sound))
+    buffer.write(sound)
+
+    wav_times = []
+    buffer_times = []
+    for i in range(N_tests):
+        ts = perf_counter()
+        shutil.copyfile(temp_filename, loop_filename)
+        sf.read(loop_filename, dtype='float32')
+        wav_times.append(perf_counter()-ts)
+
+        ts = perf_counter()
+        buffer.view().copy()
+        buffer_times.append(perf_counter()-ts)
+
+    print('%9d s | %11.1f ms | %9.2f ms'%(
+        loop_time, 1e3*np.median(wav_times), 1e3*np.median(buffer_times)))
+
+    os.remove(temp_filename)
+    os.remove(loop_filename)
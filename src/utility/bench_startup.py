@@ -0,0 +1,98 @@
+# Cold start of the looper, from launching python to the first metronome
+# beat, on the simulation backend (mock GPIO pins, in-memory audio, see
+# simulation.py). Every run is a new python process, with an empty asset
+# cache (cold) or with the cache of the previous run (warm):
+#
+#   python      interpreter startup, until the script runs
+#   import      import core, and everything it imports
+#   looper      Looper() (startup breakdown below)
+#   first beat  from launch until the first click is in the output,
+#               play being pressed as soon as Looper() returns
+#
+# It also times the import that startup no longer needs (soundfile, only
+# imported by the session writer thread, or to decode uncached assets).
+#
+# usage: python3 bench_startup.py [runs]
+
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from os import path
+
+src_directory = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def child(launched, cache_directory):
+    start = time.perf_counter()
+    python = time.time()-launched
+    sys.path.append(src_directory)
+    import core
+    imported = time.perf_counter()
+    deferred = 'soundfile' not in sys.modules
+    core.asset_cache_directory = cache_directory
+    from simulation import Simulation
+    import logging
+    logging.disable(logging.INFO)
+    sim = Simulation()
+    created = time.perf_counter()
+    sim.click('play')
+    while not sim.output.any():
+        sim.run_frames(256)
+    beat = time.perf_counter()
+    sim.run_frames(256) # runs the tasks that mark the first block and beat
+    print(json.dumps({
+        'python': python,
+        'import': imported-start,
+        'looper': created-imported,
+        'first beat': python+beat-start,
+        'deferred': deferred,
+        'startup': sim.looper.startup.summary()}))
+    sim.close()
+
+
+def run(cache_directory):
+    output = subprocess.check_output(
+        [sys.executable, path.abspath(__file__), '--child', repr(time.time()), cache_directory],
+        stderr = subprocess.DEVNULL)
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def import_time(module):
+    """Time to import module in a new process, once numpy is imported."""
+    output = subprocess.check_output([sys.executable, '-c',
+        'import time, numpy; t = time.perf_counter(); import %s; print(time.perf_counter()-t)' % module])
+    return float(output)
+
+
+def median(values):
+    return sorted(values)[len(values)//2]
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(float(sys.argv[2]), sys.argv[3])
+        sys.exit()
+
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    directory = tempfile.mkdtemp(prefix = 'pi-looper-bench-')
+    cache_directory = path.join(directory, 'cache')
+    results = {'cold': [], 'warm': []}
+    for i in range(n_runs):
+        shutil.rmtree(cache_directory, ignore_errors = True)
+        results['cold'].append(run(cache_directory))
+        results['warm'].append(run(cache_directory))
+
+    print('median of %d runs, ms   python  import  looper  first beat' % n_runs)
+    for name, runs in results.items():
+        print('%-22s %7.0f %7.0f %7.0f %11.0f' % ((name,) + tuple(
+            1e3*median([r[k] for r in runs]) for k in ['python', 'import', 'looper', 'first beat'])))
+    if all(r['deferred'] for r in results['warm']):
+        print('import soundfile, no longer on the startup path: %.0f ms' % (
+            1e3*median([import_time('soundfile') for i in range(n_runs)])))
+    else:
+        print('soundfile is still imported by import core')
+    print('\nstartup breakdown of the last warm run:\n%s' % results['warm'][-1]['startup'])
+    shutil.rmtree(directory)
@@ -0,0 +1,416 @@
+# Benchmark suite of the looper's hot paths, on synthetic takes (uniform
+# noise), with a regression check against a stored baseline.
+#
+# Operations, each run by the Looper's own methods on the state of a
+# session with a given number of layers (no device, no state machine):
+#
+#     trim                    Looper.trim of a take
+#     fade                    Looper.fade of a layer, in place
+#     update_loop             Looper.update_loop, one new layer
+#     monitor_take            Looper.monitor_take, the last take on top
+#     add_recording_to_loops  Looper.add_recording_to_loops, stem queued
+#     record                  Recorder.process of a take, block by block
+#     write_stem              SessionWriter.write_wav of a take
+#     mix_block               PlaybackEngine.render of one block
+#     monitor_block           the same, the last take played from the record buffer
+#
+# Every operation is swept over the parameters it depends on, one at a
+# time around the defaults (4 bars, 10 layers, 44.1 kHz, 100 bpm):
+# loop lengths of 1 to 64 bars, 1 to 100 layers, 44.1/48/96 kHz and 60
+# to 180 bpm. Layers go round the tracks, all of the same length.
+#
+# For each point, the time (min, median and mean of --repeat runs), the
+# peak of the memory traced while it runs (peak_bytes, temporaries
+# included) and the memory blocks it allocated and still holds after it
+# (retained_blocks and retained_bytes) are written as JSON. With
+# --compare, the results are checked against a baseline: a median time
+# or a peak above the baseline by more than the tolerance (and by more
+# than 50 us or 64 kB) is a regression, and the exit status is 1.
+#
+# usage: python3 bench_suite.py [-o results.json] [--compare baseline.json]
+#                               [--results results.json] [--quick]
+#                               [--repeat N] [--tolerance 0.25] [operation ...]
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+from datetime import datetime
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import core
+import daemons
+import dsp
+from audio import MemoryAudio
+from engine import PlaybackEngine
+from layers import LayerStore
+from metrics import Metrics
+from session import SessionWriter
+from timeline import Timeline, Loop
+from tracks import Tracks
+
+logging.getLogger().setLevel(logging.WARNING)
+
+defaults = {'bars': 4, 'layers': 10, 'sample_rate': 44100, 'bpm': 100}
+sweeps = {
+    'bars': [1, 2, 4, 8, 16, 32, 64],
+    'layers': [1, 10, 25, 50, 100],
+    'sample_rate': [44100, 48000, 96000],
+    'bpm': [60, 100, 180],
+}
+quick_sweeps = {
+    'bars': [1, 4, 16],
+    'layers': [1, 10],
+    'sample_rate': [44100, 96000],
+    'bpm': [100],
+}
+blocksize = 256
+time_slack = 50e-6 # seconds
+memory_slack = 64e3 # bytes
+
+
+def take(n_frames, seed = 0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-0.1, 0.1, (n_frames, 2)).astype('float32')
+
+
+class BenchLooper(core.Looper):
+    """
+    A Looper holding the state of a session with n_layers layers of
+    n_bars bars, at any sample rate, for its methods to be timed.
+    """
+
+    def __init__(self, sample_rate, bpm, n_bars, n_layers, directory):
+        self.sample_rate = sample_rate
+        self.bpm = bpm
+        self.timeline = Timeline(sample_rate, bpm)
+        self.latency_samples = int(core.default_latency*sample_rate)
+        self.fade_samples = int(core.fade_time*sample_rate)
+        self.fade_curves = (dsp.fade_curve(self.fade_samples, core.fade_shape, 'in'),
+                            dsp.fade_curve(self.fade_samples, core.fade_shape, 'out'))
+        self.take_lane = None
+        self.metrics = Metrics()
+        self.tracks = Tracks(core.n_tracks, 2,
+            lambda: LayerStore(core.layer_memory/core.n_tracks, core.layer_format))
+        self.engine = PlaybackEngine(sample_rate, blocksize = blocksize, headless = True)
+        self.recording_directory = directory
+        self.loop_filename = os.path.join(directory, 'loop_{:03d}.wav')
+        self.session = SessionWriter(directory, sample_rate, 2)
+        self.session.start()
+
+        n_beats = n_bars*self.timeline.beats_per_bar
+        self.period = self.timeline.period(n_beats)
+        self.length = self.timeline.length(n_beats)
+        # What the recorder captured: the take and the latency before it
+        self.take = take(self.length + self.latency_samples, seed = n_layers)
+        self.recording_buffer = daemons.RecordBuffer(len(self.take))
+        self.recording_buffer.write(self.take)
+        self.metronome_loop = Loop.from_array(np.zeros((self.timeline.length(4), 2), dtype = 'float32'))
+        self.loop = self.metronome_loop
+        self.loops = []
+        self.n_loop = 0
+        self.n_takes = 0
+        self.track = 0
+        self.take_start = 0
+        for i in range(n_layers):
+            self.add_layer()
+
+    def add_layer(self):
+        """A layer recorded on the next track, n_loop bars after the first one."""
+        self.track = self.n_loop % len(self.tracks)
+        self.take_start = self.timeline.frame(self.n_loop*self.timeline.beats_per_bar)
+        self.tracks.add(self.track, self.prepare_layer(take(len(self.take), self.n_loop)),
+                        self.period, self.take_start)
+        self.n_loop += 1
+        self.loop = self.tracks.loop
+        self.engine.set_current(self.loop, self.tracks.origin)
+
+    def remove_layer(self):
+        self.tracks.pop()
+        self.n_loop -= 1
+        self.loop = self.tracks.loop if self.n_loop else self.metronome_loop
+        self.engine.set_current(self.loop, self.tracks.origin or 0)
+
+    def wait_writer(self):
+        written = threading.Event()
+        self.session.submit(written.set)
+        written.wait()
+
+    def close(self):
+        self.session.stop()
+
+
+class Operation(object):
+    """
+    An operation on a BenchLooper: prepare() before every run, then run()
+    is measured, and restore() puts the state back for the next run.
+    """
+
+    params = ('bars', 'sample_rate')
+
+    def __init__(self, looper):
+        self.looper = looper
+
+    def prepare(self):
+        pass
+
+    def run(self):
+        pass
+
+    def restore(self):
+        pass
+
+
+class Trim(Operation):
+    params = ('bars', 'sample_rate', 'bpm')
+
+    def run(self):
+        self.looper.trim(self.looper.take)
+
+
+class Fade(Operation):
+
+    def prepare(self):
+        self.layer = self.looper.take[:self.looper.length].copy()
+
+    def run(self):
+        self.looper.fade(self.layer, out = self.layer)
+
+
+class UpdateLoop(Operation):
+    params = ('bars', 'layers', 'sample_rate')
+
+    def prepare(self):
+        looper = self.looper
+        looper.loops = [(None, looper.take.copy(), looper.n_loop % len(looper.tracks),
+                         looper.timeline.frame(looper.n_loop*looper.timeline.beats_per_bar))]
+        looper.n_loop += 1
+
+    def run(self):
+        self.looper.update_loop()
+
+    def restore(self):
+        self.looper.remove_layer()
+
+
+class MonitorTake(Operation):
+    params = ('bars', 'layers', 'sample_rate')
+
+    def run(self):
+        # At the boundary that ends the last take
+        self.looper.monitor_take(self.looper.take_start + self.looper.length)
+
+
+class AddRecordingToLoops(Operation):
+
+    def run(self):
+        self.looper.add_recording_to_loops()
+
+    def restore(self):
+        # The stem is written in the background, as on the device
+        self.looper.wait_writer()
+        self.looper.loops = []
+        self.looper.n_loop -= 1
+
+
+class Record(Operation):
+
+    def prepare(self):
+        looper = self.looper
+        self.buffer = daemons.RecordBuffer(len(looper.take))
+        self.recorder = daemons.Recorder(self.buffer, looper.sample_rate, blocksize,
+                                         audio = MemoryAudio(looper.sample_rate))
+        self.recorder.arm(0.)
+
+    def run(self):
+        process = self.recorder.process
+        take = self.looper.take
+        sample_rate = self.looper.sample_rate
+        for start in range(0, len(take), blocksize):
+            block = take[start:start+blocksize]
+            process(block, len(block), start/sample_rate)
+
+
+class WriteStem(Operation):
+
+    def run(self):
+        self.looper.session.write_wav(
+            os.path.join(self.looper.recording_directory, 'stem.wav'), self.looper.take)
+
+
+class MixBlock(Operation):
+    params = ('layers', 'sample_rate')
+
+    def run(self):
+        self.looper.engine.render(blocksize)
+
+
+class MonitorBlock(MixBlock):
+
+    def __init__(self, looper):
+        MixBlock.__init__(self, looper)
+        looper.monitor_take(looper.take_start + looper.length)
+        looper.engine.render(blocksize)
+
+
+operations = {
+    'trim': Trim,
+    'fade': Fade,
+    'update_loop': UpdateLoop,
+    'monitor_take': MonitorTake,
+    'add_recording_to_loops': AddRecordingToLoops,
+    'record': Record,
+    'write_stem': WriteStem,
+    'mix_block': MixBlock,
+    'monitor_block': MonitorBlock,
+}
+
+
+def points(operation, sweeps):
+    """Parameters of every run of operation: one parameter swept at a time."""
+    seen = []
+    for name in operation.params:
+        for value in sweeps[name]:
+            params = dict(defaults)
+            params[name] = value
+            if params not in seen:
+                seen.append(params)
+                yield params
+
+
+def measure(operation, repeat):
+    times = []
+    for i in range(repeat):
+        operation.prepare()
+        start = time.perf_counter()
+        operation.run()
+        times.append(time.perf_counter() - start)
+        operation.restore()
+
+    # Once more, traced: tracing slows everything down
+    operation.prepare()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    operation.run()
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    operation.restore()
+    retained = [s for s in after.compare_to(before, 'traceback') if s.count_diff > 0]
+    return {
+        'time': {'min': min(times), 'median': float(np.median(times)),
+                 'mean': float(np.mean(times))},
+        'peak_bytes': peak - current,
+        'retained_blocks': sum(s.count_diff for s in retained),
+        'retained_bytes': sum(s.size_diff for s in retained),
+    }
+
+
+def run(names, sweeps, repeat):
+    results = []
+    for name in names:
+        for params in points(operations[name], sweeps):
+            directory = tempfile.mkdtemp(prefix = 'pi-looper-bench-') + '/'
+            looper = BenchLooper(params['sample_rate'], params['bpm'], params['bars'],
+                                 params['layers'], directory)
+            try:
+                result = measure(operations[name](looper), repeat)
+            finally:
+                looper.close()
+                shutil.rmtree(directory)
+            result = dict(operation = name, params = params, **result)
+            results.append(result)
+            print('%-24s %-52s %9.3f ms %10.0f kB peak %6d blocks held' % (
+                name, describe(params), 1e3*result['time']['median'],
+                result['peak_bytes']/1e3, result['retained_blocks']))
+    return results
+
+
+def describe(params):
+    return ' '.join('%s=%s'%(k, params[k]) for k in sorted(params))
+
+
+def key(result):
+    return (result['operation'], describe(result['params']))
+
+
+def compare(results, baseline, tolerance):
+    """Print the changes from baseline, return the regressions."""
+    old = dict((key(r), r) for r in baseline['results'])
+    regressions = []
+    print('\n%-24s %-52s %8s %8s' % ('operation', 'parameters', 'time', 'peak'))
+    for result in results:
+        if key(result) not in old:
+            continue
+        before = old[key(result)]
+        t, t0 = result['time']['median'], before['time']['median']
+        m, m0 = result['peak_bytes'], before['peak_bytes']
+        slower = t > t0*(1+tolerance) and t - t0 > time_slack
+        bigger = m > m0*(1+tolerance) and m - m0 > memory_slack
+        flag = ' '.join(f for f, on in [('SLOWER', slower), ('MORE MEMORY', bigger)] if on)
+        print('%-24s %-52s %7.2fx %7.2fx %s' % (
+            result['operation'], describe(result['params']),
+            t/t0 if t0 else float('inf'), m/m0 if m0 else 1., flag))
+        if flag:
+            regressions.append((key(result), flag))
+    missing = set(old) - set(key(r) for r in results)
+    if missing:
+        print('%d points of the baseline were not run' % len(missing))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the looper hot paths')
+    parser.add_argument('operations', nargs = '*', metavar = 'operation',
+                        help = 'operations to run (default: all): %s' % ', '.join(operations))
+    parser.add_argument('-o', '--output', help = 'write the results to this JSON file')
+    parser.add_argument('--compare', metavar = 'BASELINE',
+                        help = 'flag regressions against these results')
+    parser.add_argument('--results', help = 'compare these results instead of running')
+    parser.add_argument('--quick', action = 'store_true', help = 'fewer points')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'timed runs per point')
+    parser.add_argument('--tolerance', type = float, default = 0.25,
+                        help = 'relative increase flagged as a regression')
+    args = parser.parse_args()
+    names = args.operations or list(operations)
+    for name in names:
+        if name not in operations:
+            parser.error('unknown operation %r' % name)
+
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)['results']
+    else:
+        results = run(names, quick_sweeps if args.quick else sweeps, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.now().isoformat(),
+                'machine': platform.machine(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'repeat': args.repeat,
+                'results': results,
+            }, f, indent = 1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('%d regressions' % len(regressions))
+            sys.exit(1)
+        print('no regressions')
+
+
+main()
@@ -0,0 +1,59 @@
+# Time spent at the loop boundary to add one layer, against the number
+# of layers already recorded: the former update_loop (every layer is
+# trimmed, faded and tiled again) against the incremental Mixer.
+#
+# usage: python3 bench_update_loop.py [loop seconds]
+
+import sys
+from os import path
+from time import perf_counter
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from mixer import Mixer
+
+sample_rate = 44100
+loop_time = float(sys.argv[1]) if len(sys.argv) > 1 else 4.8 # 2 bars at 100 bpm
+n_samples = int(loop_time*sample_rate)
+fade_samples = int(0.01*sample_rate)
+fadein_mask = np.linspace(0, 1, fade_samples, endpoint=False)[:,np.newaxis]
+
+
+def prepare(l):
+    # stands for trim + fade, which copied and modified every layer
+    l = l.copy()
+    l[:fade_samples] *= fadein_mask
+    l[-fade_samples:] *= fadein_mask[::-1]
+    return l
+
+
+def full_update_loop(loops):
+    loop = np.zeros((n_samples,2), dtype = 'float32')
+    for l in loops:
+        l = prepare(l)
+        loop += np.tile(l,(round(n_samples/len(l)),1))
+    return loop
+
+
+loops = []
+mixer = Mixer()
+print('layers | full rebuild | incremental | undo')
+for n_layers in range(1, 51):
+    take = np.random.uniform(-0.1, 0.1, (n_samples,2)).astype('float32')
+    loops.append(take)
+
+    ts = perf_counter()
+    full_update_loop(loops)
+    t_full = perf_counter()-ts
+
+    ts = perf_counter()
+    mixer.add(prepare(take))
+    t_incremental = perf_counter()-ts
+
+    ts = perf_counter()
+    layer = mixer.pop()
+    t_undo = perf_counter()-ts
+    mixer.add(layer)
+
+    if n_layers in [1, 2, 5, 10, 20, 30, 40, 50]:
+        print('%6d | %9.1f ms | %8.1f ms | %.1f ms'%(
+            n_layers, 1e3*t_full, 1e3*t_incremental, 1e3*t_undo))
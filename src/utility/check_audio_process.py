@@ -0,0 +1,259 @@
+# Checks of the audio engine in a process of its own (audioprocess.py):
+#
+#  - arrays are copied into shared memory once, and the copies removed
+#    once the arrays are gone and the audio process released them since
+#    the last loop they were published with
+#  - an EngineProcess on a TimedAudio device (in memory, in real time)
+#    plays the loops it is given sample for sample as Loop.render, from
+#    the first block on (its output read from a ring that goes round
+#    many times), swaps loops at their boundaries and calls back
+#    scheduled events once they are played
+#  - in duplex mode, the audio process records takes armed and disarmed
+#    at boundaries, as the looper does, straight into the shared record
+#    buffer: they hold the input frames between the two boundaries
+#  - the looper records and plays a take, on mock hardware and a
+#    TimedAudio device, with the engine in this process and in the audio
+#    process (which records the take itself), idle and while a thread
+#    of this process hogs the GIL and the garbage collector: with the
+#    audio process, the audio thread stays on time under load (few
+#    xruns, boundary jitter under two blocks). The numbers are printed,
+#    those of the engine in this process under load for contrast (only
+#    the audio process is asserted on: how bad the other one gets
+#    depends on the machine)
+#
+# Nothing is left in /dev/shm afterwards.
+#
+# usage: python3 check_audio_process.py [seconds played per run]
+
+import gc
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import soundfile as sf
+import core
+import audioprocess
+from audio import TimedAudio
+from audioprocess import EngineProcess, SharedArrays
+from config import AudioConfig
+from daemons import RecordBuffer, Recorder
+from hardware import Hardware
+from timeline import Lane, Loop
+
+sample_rate = 44100
+blocksize = 256
+block_time = blocksize/sample_rate
+output_time = audioprocess.output_time
+
+
+def shm_names():
+    return set(os.listdir('/dev/shm')) if path.isdir('/dev/shm') else set()
+
+
+def check_shared_arrays():
+    arrays = SharedArrays()
+    a = np.arange(1000, dtype = 'float32')
+    b = np.ones((10, 2), dtype = 'float32')
+    spec = arrays.share(a, 1)
+    assert arrays.share(a, 2) == spec # copied once
+    name = spec[0]
+    copy = np.ndarray(spec[1], dtype = spec[2], buffer = arrays.segments[name].shm.buf)
+    assert np.array_equal(copy, a)
+    del copy
+    # Gone, but the child may still play it
+    del a
+    gc.collect()
+    assert name in arrays.segments
+    # Released as of a loop before the last one it was published with
+    arrays.released([name], 1)
+    assert name in arrays.segments
+    arrays.released([name], 2)
+    assert name not in arrays.segments and name not in shm_names()
+    # Released while alive, published again: kept until released again
+    name = arrays.share(b, 3)[0]
+    arrays.released([name], 3)
+    arrays.share(b, 4)
+    del b
+    gc.collect()
+    assert name in arrays.segments
+    arrays.released([name], 4)
+    assert not arrays.segments and not arrays.alive
+    arrays.close()
+
+
+def check_engine():
+    rng = np.random.default_rng(0)
+    engine = EngineProcess(sample_rate, 2, blocksize, audio = TimedAudio(sample_rate, 2, blocksize),
+                           duplex = True)
+    blocks = []
+    boundaries = []
+    events = []
+    engine.output_callback = blocks.append
+    engine.boundary_callback = boundaries.append
+    audioprocess.output_time = 0.1 # goes round in the second played
+    first = Loop([Lane(rng.uniform(-1, 1, (10000, 2)).astype('float32'), 10000)], origin = 0)
+    second = Loop([Lane(rng.uniform(-1, 1, (7000, 2)).astype('float32'), 7000),
+                   Lane(rng.uniform(-1, 1, (14000, 2)).astype('float32'), 14000)], origin = 0)
+    engine.set_loop(first) # before start: from the first block on
+    engine.start()
+    time.sleep(0.5)
+    engine.set_loop(second)
+    engine.schedule(engine.frame + 20000, lambda: events.append(engine.frame))
+    time.sleep(0.5)
+    assert engine.loop is second
+    engine.stop()
+    audioprocess.output_time = output_time
+    assert boundaries[0] == 0
+    assert len(events) == 1 and events[0] >= boundaries[0] + 20000
+    out = np.concatenate(blocks)
+    # The second loop from one of the boundaries on, in phase
+    swaps = [f for f in boundaries if f % 10000 == 0 and
+             np.array_equal(out[:f], first.render(0, f)) and
+             np.array_equal(out[f:], second.render(f, len(out)-f))]
+    assert len(swaps) == 1, boundaries
+
+
+def check_recording():
+    audio = TimedAudio(sample_rate, 2, blocksize, latency = 0.02)
+    n_frames = 3*sample_rate
+    audio.play(np.repeat(np.arange(1, n_frames + 1, dtype = 'float32')[:, np.newaxis], 2, axis = 1), 0)
+    engine = EngineProcess(sample_rate, 2, blocksize, audio = audio, duplex = True)
+    buffer = RecordBuffer(sample_rate, 2, shared = True)
+    recorder = engine.record(Recorder(buffer, sample_rate, audio = audio))
+    boundaries = []
+
+    def boundary(frame):
+        boundaries.append(frame)
+        if len(boundaries) == 2:
+            recorder.arm(engine.frame_time(frame))
+        elif len(boundaries) == 3:
+            recorder.disarm(engine.frame_time(frame))
+
+    engine.boundary_callback = boundary
+    engine.set_loop(Loop([Lane(np.zeros((10000, 2), dtype = 'float32'), 10000)], origin = 0))
+    engine.start()
+    time.sleep(1.)
+    assert recorder.wait(timeout = 1.) and recorder.state == 'idle'
+    engine.stop()
+    start, stop = boundaries[1:3]
+    take = buffer.view()[:, 0].copy()
+    buffer.close()
+    assert len(take) == stop - start, (len(take), start, stop)
+    # Captured a block and the output latency before they are played
+    delay = (0.02 + block_time)*sample_rate
+    assert abs(take[0] - 1 - start - delay) <= 1, (take[0], start)
+    assert np.array_equal(take, np.arange(take[0], take[0] + len(take)))
+
+
+class Load(object):
+    """A thread that holds the GIL and fills the heap: parsing, mixing..."""
+
+    def __init__(self):
+        self.running = threading.Event()
+        self.thread = threading.Thread(name = 'load', target = self.run, daemon = True)
+
+    def start(self):
+        self.running.set()
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        self.thread.join()
+
+    def run(self):
+        junk = []
+        while self.running.is_set():
+            junk.append([{'i': i} for i in range(1000)])
+            if len(junk) > 300:
+                del junk[:]
+                gc.collect()
+            sum(i*i for i in range(20000))
+
+
+def click(hardware, button):
+    hardware.press(button)
+    time.sleep(0.05)
+    hardware.release(button)
+
+
+def run_looper(audio_process, loaded, seconds):
+    """Record and play a take, returns the metrics of the audio thread."""
+    core.audio_process = audio_process
+    audio = TimedAudio(sample_rate, 2, blocksize, latency = 0.02)
+    audio.play(np.random.default_rng(0).uniform(-0.1, 0.1, (int((seconds + 10)*sample_rate), 2))
+               .astype('float32'), 0)
+    hardware = Hardware.mock()
+    directory = tempfile.mkdtemp()
+    looper = core.Looper(hardware, audio, recording_directory = directory + '/',
+                         latency = 0, config = AudioConfig(blocksize = blocksize, latency = 0.02),
+                         bpm = 240) # a bar a second
+    assert looper.audio_process == audio_process
+    time.sleep(0.5)
+    click(hardware, 'play') # the metronome
+    time.sleep(1.)
+    if audio_process:
+        looper.engine.audio_metrics(reset = True)
+    else:
+        looper.metrics.reset()
+    load = Load()
+    if loaded:
+        load.start()
+    click(hardware, 'rec')
+    time.sleep(2.)
+    click(hardware, 'play')
+    time.sleep(seconds)
+    metrics = looper.engine.audio_metrics()[0] if audio_process else looper.metrics.as_dict()
+    if loaded:
+        load.stop()
+    state, n_layers = looper.state, looper.tracks.n_layers
+    looper.kill()
+    hardware.close()
+    take, sr = sf.read(looper.loop_filename.format(0), dtype = 'float32')
+    shutil.rmtree(directory)
+    assert state == 'play' and n_layers == 1, (state, n_layers)
+    assert np.abs(take).max() > 0.05 # the input, not silence
+    return metrics
+
+
+def report(name, metrics):
+    histograms = metrics['histograms']
+    counters = metrics['counters']
+    jitter, boundary = histograms['callback_jitter'], histograms['boundary_jitter']
+    print('%-30s callback jitter p99 %5.2f ms max %5.2f ms, boundary jitter max %5.2f ms '
+          '(%d boundaries), %d xruns in %d blocks'%(
+              name, 1e3*jitter['p99'], 1e3*jitter['max'], 1e3*boundary['max'], boundary['n'],
+              counters['xruns'], counters['blocks']))
+
+
+if __name__ == '__main__':
+    # The audio process is spawned: this module is imported again there
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 12.
+    logging.disable(logging.WARNING)
+    before = shm_names()
+    check_shared_arrays()
+    print('arrays shared once, removed once released: ok')
+    check_engine()
+    print('engine process plays loops as rendered: ok')
+    check_recording()
+    print('takes recorded in the audio process, on the frames of boundaries: ok')
+    results = {}
+    for audio_process in [False, True]:
+        for loaded in [False, True]:
+            metrics = run_looper(audio_process, loaded, seconds)
+            name = '%s, %s'%('audio process' if audio_process else 'one process',
+                             'loaded' if loaded else 'idle')
+            report(name, metrics)
+            results[audio_process, loaded] = metrics
+    metrics = results[True, True]
+    assert metrics['counters']['xruns'] <= 0.01*metrics['counters']['blocks']
+    assert metrics['histograms']['boundary_jitter']['n'] >= seconds/4
+    assert metrics['histograms']['boundary_jitter']['max'] < 2*block_time
+    print('takes recorded, audio process on time under load: ok')
+    assert shm_names() <= before, shm_names() - before
+    print('shared memory removed: ok')
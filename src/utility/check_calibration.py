@@ -0,0 +1,44 @@
+# Checks of the latency calibration (calibration.py) on MemoryAudio
+# devices whose output is fed back into their input N frames later
+# (loopback), for several block sizes and sample rates:
+#
+#  - calibrate() measures exactly N frames, from no delay to delays of
+#    several blocks, and delays that are not multiples of the block size
+#  - measure_delay finds the lag of a shifted copy of the test signal to
+#    the sample, with noise added to the copy
+#
+# usage: python3 check_calibration.py
+
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import calibration
+from audio import MemoryAudio
+
+
+def check_calibrate():
+    for sample_rate in [44100, 48000]:
+        for blocksize in [64, 256, 1000]:
+            for loopback in [0, 1, blocksize - 1, blocksize, 3*blocksize + 17, 4410]:
+                audio = MemoryAudio(sample_rate, 2, blocksize, loopback = loopback)
+                latency = calibration.calibrate(audio, sample_rate, 2, blocksize)
+                assert abs(latency*sample_rate - loopback) < 1e-6, \
+                    (sample_rate, blocksize, loopback, latency*sample_rate)
+
+
+def check_measure_delay():
+    rng = np.random.default_rng(0)
+    signal = calibration.test_signal(44100)
+    for delay in [0, 1, 333, 20000]:
+        recorded = np.zeros((len(signal) + 30000, 2), dtype = 'float32')
+        recorded[delay:delay+len(signal)] = 0.5*signal
+        recorded += rng.normal(0, 0.05, recorded.shape).astype('float32')
+        assert calibration.measure_delay(signal, recorded) == delay, delay
+
+
+if __name__ == '__main__':
+    check_calibrate()
+    print('loopbacks calibrated to the frame: ok')
+    check_measure_delay()
+    print('delays of noisy recordings: ok')
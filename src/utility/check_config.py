@@ -0,0 +1,150 @@
+# Checks of the audio configuration (config.py) and of the looper at
+# other sample rates, channel counts and block sizes:
+#
+#  - settings are read from a file, then overridden by the command line
+#  - resampled sounds keep their length ratio to the sample and are
+#    within 1e-4 of the signal they sample, sounds are converted to mono
+#    or more channels
+#  - a simulated session at 48 kHz with 64 frame blocks, at 96 kHz, in
+#    mono and on 4 channels plays the metronome click (resampled from
+#    44.1 kHz) on every beat and loops its take
+#  - a session isn't resumed at another sample rate, and latencies are
+#    calibrated per sample rate
+#
+# usage: python3 check_config.py
+
+import sys
+import json
+import shutil
+import logging
+import tempfile
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import soundfile as sf
+import calibration
+import dsp
+from audio import argument_parser
+from config import AudioConfig
+from simulation import Simulation
+
+logging.disable(logging.WARNING)
+click = sf.read(path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                          'data', 'high_hat_001.wav'))[0]
+directory = tempfile.mkdtemp(prefix = 'pi-looper-check-')
+
+
+def check_settings():
+    filename = path.join(directory, 'audio.json')
+    with open(filename, 'w') as f:
+        json.dump({'sample_rate': 48000, 'blocksize': 128, 'channels': 1}, f)
+    config = AudioConfig.load(filename)
+    assert (config.sample_rate, config.blocksize, config.channels, config.latency) == \
+        (48000, 128, 1, AudioConfig.latency)
+    sys.argv = ['core.py', '--config', filename, '--blocksize', '64', '-o', 'USB']
+    config = AudioConfig.from_args(argument_parser('').parse_args())
+    assert (config.sample_rate, config.blocksize, config.device) == (48000, 64, (None, 'USB'))
+    assert AudioConfig.load(path.join(directory, 'none.json')).sample_rate == 44100
+    try:
+        AudioConfig(samplerate = 48000)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def check_conversions():
+    for a, b in [(44100, 48000), (48000, 44100), (44100, 96000), (96000, 44100)]:
+        for n in [1, 441, 10000, a]:
+            t = np.arange(n)/a
+            sound = np.stack([np.sin(2*np.pi*440*t), np.sin(2*np.pi*1000*t)], 1).astype('float32')
+            out = dsp.resample(sound, a, b)
+            assert out.dtype == np.float32 and len(out) == -(-n*b//a), (a, b, n)
+            if n == a:
+                t = np.arange(len(out))/b
+                expected = np.stack([np.sin(2*np.pi*440*t), np.sin(2*np.pi*1000*t)], 1)
+                middle = slice(b//10, -b//10)
+                assert np.abs(out[middle] - expected[middle]).max() < 1e-4, (a, b)
+    stereo = np.array([[1., 3.], [2., 4.]], dtype = 'float32')
+    assert np.array_equal(dsp.match_channels(stereo, 1), [[2.], [3.]])
+    assert np.array_equal(dsp.match_channels(stereo[:, :1], 3), [[1.]*3, [2.]*3])
+    assert np.array_equal(dsp.match_channels(stereo, 4), [[1., 3., 1., 3.], [2., 4., 2., 4.]])
+    assert dsp.match_channels(stereo, 2) is stereo
+
+
+def check_session(config):
+    # Kept to be resumed, the sessions all start at the same (virtual) time
+    sim = Simulation(config = config, recording_directory = tempfile.mkdtemp(dir = directory))
+    looper = sim.looper
+    sample_rate, channels = config.sample_rate, config.channels
+    assert looper.metronome.click.shape[1] == channels
+    assert len(looper.metronome.click) == -(-len(click)*sample_rate//44100)
+    sim.click('play')
+    start = sim.frame
+    sim.run_beats(8)
+    clicks = sim.output[start:, 0]
+    # Clicks start after at least 64 silent samples (a click mixed down to
+    # mono has zeros of its own)
+    nonzero = (clicks != 0).astype(int)
+    before = np.convolve(nonzero, np.ones(65, dtype = int))[:len(nonzero)] - nonzero
+    onsets = np.flatnonzero(nonzero & (before == 0))
+    # From the release of play, once the button has settled
+    beats = [looper.engine.origin - start + looper.timeline.frame(b) for b in range(7)]
+    assert list(onsets[:7]) == beats, (config, onsets, beats)
+
+    # A take of one bar, then looped
+    sim.run_beats(2)
+    sim.click('rec')
+    bar = looper.timeline.length(4)
+    take = np.random.default_rng(0).uniform(-0.1, 0.1, (2*bar, channels)).astype('float32')
+    sim.play(take, sim.next_bar_frame())
+    sim.run_frames(sim.next_bar_frame() - sim.frame + bar//2)
+    sim.click('play')
+    sim.run_frames(sim.next_bar_frame() - sim.frame + 1)
+    sim.run_frames(sim.next_bar_frame() - sim.frame + 1)
+    first = sim.frame - 1
+    sim.run_bars(2)
+    output = sim.output
+    assert output.shape[1] == channels
+    assert looper.n_loop == 1
+    assert np.array_equal(output[first:first+bar], output[first+bar:first+2*bar])
+    assert np.abs(output[first:first+bar]).max() > 0.05
+    session_directory = looper.recording_directory
+    sim.close()
+    return session_directory
+
+
+def check_resume(session_directory):
+    try:
+        Simulation(resume = session_directory, config = AudioConfig(sample_rate = 44100)).close()
+    except RuntimeError as e:
+        return str(e)
+    assert False
+
+
+def check_calibration():
+    filename = path.join(directory, 'latency.json')
+    with open(filename, 'w') as f:
+        json.dump({'card|64': {'latency': 0.01, 'sample_rate': 44100}}, f)
+    assert calibration.stored_latency('card', 64, 44100, filename = filename) == 0.01
+    assert calibration.stored_latency('card', 64, 48000, default = 0.05, filename = filename) == 0.05
+    calibration.save('card', 64, 48000, 0.008, filename = filename)
+    assert calibration.stored_latency('card', 64, 48000, filename = filename) == 0.008
+    assert calibration.stored_latency('card', 64, 44100, filename = filename) == 0.01
+
+
+check_settings()
+print('settings: ok')
+check_conversions()
+print('resampling and channels: ok')
+for config in [AudioConfig(sample_rate = 48000, blocksize = 64),
+               AudioConfig(sample_rate = 96000),
+               AudioConfig(channels = 1),
+               AudioConfig(sample_rate = 48000, channels = 4)]:
+    session_directory = check_session(config)
+    print('session at %d Hz on %d channels, %s frame blocks: ok' % (
+        config.sample_rate, config.channels, config.blocksize or 256))
+print('resume at another sample rate refused: %s' % check_resume(session_directory))
+check_calibration()
+print('latency per sample rate: ok')
+shutil.rmtree(directory)
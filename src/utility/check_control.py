@@ -0,0 +1,252 @@
+# Checks of the OSC control server (control.py), from a client on the
+# loopback interface:
+#
+#  - OSC messages and bundles encode and decode back, malformed data is
+#    refused
+#  - a looper on mock hardware and a TimedAudio device (in real time) is
+#    driven over UDP: triggers, tempo, a take recorded and undone, track
+#    settings, state, layers and metrics queries; wrong commands get an
+#    error back
+#  - subscribers get a beat on every beat, in order, at the tempo
+#  - while the client sends thousands of commands a second (single
+#    messages and bundles), every one is handled, in batches, and the
+#    audio thread stays on time (few xruns, callback jitter as idle)
+#
+# usage: python3 check_control.py [seconds of commands]
+
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import core
+import control
+from audio import TimedAudio
+from config import AudioConfig
+from hardware import Hardware
+
+sample_rate = 44100
+blocksize = 256
+
+
+def check_codec():
+    for args in [[], [1, -2, 0.5, 'abc', 'abcd', b'\x01\x02\x03', True, False],
+                 ['', -2**31, 2**31-1, 1e-3]]:
+        data = control.encode_message('/a/b', args)
+        assert len(data) % 4 == 0
+        (address, decoded), = control.decode(data)
+        assert address == '/a/b' and len(decoded) == len(args)
+        for a, b in zip(args, decoded):
+            assert a == b if not isinstance(a, float) else abs(a - b) < 1e-6*abs(a), (a, b)
+    messages = [('/x', [i, 'y']) for i in range(10)]
+    assert control.decode(control.encode_bundle(messages)) == messages
+    assert control.decode(b'/old\0\0\0\0') == [('/old', [])]
+    data = control.encode_message('/a', [1, 'text'])
+    for bad in [data[:-4], data[:10], b'abc', b'/a\0\0,q\0\0', control.encode_bundle(messages)[:-3]]:
+        try:
+            control.decode(bad)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('decoded %r'%bad)
+
+
+class Client(asyncio.DatagramProtocol):
+    """OSC client on the loopback interface, replies sorted by address."""
+
+    def __init__(self):
+        self.replies = {} # address: asyncio.Queue of (time received, args)
+
+    def datagram_received(self, data, address):
+        for address, args in control.decode(data):
+            self.queue(address).put_nowait((time.perf_counter(), args))
+
+    def queue(self, address):
+        if address not in self.replies:
+            self.replies[address] = asyncio.Queue()
+        return self.replies[address]
+
+    def send(self, address, *args):
+        self.transport.sendto(control.encode_message(address, args))
+
+    def send_bundle(self, messages):
+        self.transport.sendto(control.encode_bundle(messages))
+
+    async def reply(self, address, timeout = 2.):
+        return (await asyncio.wait_for(self.queue(address).get(), timeout))[1]
+
+    async def request(self, address, *args, reply = None):
+        self.send(address, *args)
+        return await self.reply(reply or address)
+
+    async def sync(self):
+        """Once everything sent before is applied."""
+        return await self.request('/looper/ping', reply = '/looper/pong')
+
+    async def state(self):
+        return (await self.request('/looper/state'))[0]
+
+    async def wait_state(self, state, timeout = 3.):
+        end = time.perf_counter() + timeout
+        while await self.state() != state:
+            assert time.perf_counter() < end, state
+            await asyncio.sleep(0.05)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+
+async def drive(looper, seconds):
+    server = looper.control
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(
+        Client, remote_addr = ('127.0.0.1', server.port))
+
+    assert await client.sync() == []
+    assert await client.request('/looper/ping', 1, 'a', reply = '/looper/pong') == [1, 'a']
+    assert await client.request('/looper/state') == ['init', 0, looper.bpm]
+    client.send('/looper/trigger', 'release_play_button')
+    await client.wait_state('metronome')
+    assert await client.request('/looper/bpm', 240) == [240]
+    assert looper.bpm == 240
+
+    # Wrong commands
+    for message, reason in [(('/looper/nothing',), 'unknown address'),
+                            (('/looper/trigger', 'end_recording'), 'unknown trigger'),
+                            (('/looper/gain', 9, 1.), 'no track'),
+                            (('/looper/pan', 0, 2.), 'pan out'),
+                            (('/looper/bpm', 1000), 'bpm out'),
+                            (('/looper/gain', 0), 'argument')]:
+        address, error = await client.request(*message, reply = '/looper/error')
+        assert address == message[0] and reason in error, (message, error)
+
+    # Beat clock
+    client.send('/looper/subscribe')
+    await asyncio.sleep(2.1)
+    client.send('/looper/unsubscribe')
+    await client.sync()
+    beats = []
+    queue = client.queue('/looper/beat')
+    while not queue.empty():
+        beats.append(queue.get_nowait())
+    assert len(beats) >= 7, beats
+    numbers = [args[0] for t, args in beats]
+    assert numbers == list(range(numbers[0], numbers[0] + len(beats))), numbers
+    assert all(args[1] == args[0] % 4 and args[2] == 240. and 0 < args[3] < 0.1 for t, args in beats)
+    intervals = np.diff([t for t, args in beats])
+    assert abs(np.median(intervals) - 0.25) < 0.005, intervals
+    print('beat clock: ok, %d beats %.1f ms apart (median), heard %.1f ms after sent'%(
+        len(beats), 1e3*np.median(intervals), 1e3*beats[-1][1][3]))
+
+    # A take, then undone
+    client.send('/looper/trigger', 'release_rec_button')
+    await client.wait_state('rec')
+    await asyncio.sleep(1.)
+    client.send('/looper/trigger', 'release_play_button')
+    await client.wait_state('play')
+    assert await client.request('/looper/layers') == [1, 1, 0, 0, 0]
+    assert (await client.request('/looper/bpm', 120, reply = '/looper/error'))[1] == \
+        'the tempo is set in the metronome state'
+
+    # Track settings, the last of a batch
+    client.send_bundle([('/looper/gain', [1, 0.1]), ('/looper/gain', [1, 0.5]),
+                        ('/looper/mute', [2, True]), ('/looper/pan', [3, -1.])])
+    assert await client.request('/looper/track', 2) == [2]
+    tracks = looper.tracks
+    assert (tracks[1].gain, tracks[2].mute, tracks[3].pan, looper.track) == (0.5, True, -1., 2)
+    client.send('/looper/undo')
+    await client.sync()
+    assert await client.request('/looper/layers') == [0, 0, 0, 0, 0]
+    print('triggers, tempo, layers and tracks over UDP: ok')
+
+    # Playback while flooded with commands
+    metrics = json.loads((await client.request('/looper/metrics'))[0])
+    assert metrics['control']['commands'] > 0 and metrics['histograms']['control']['n'] > 0
+    assert 'audio' in metrics or not looper.audio_process
+    before = server.counters['commands']
+    reset_metrics(looper)
+    await asyncio.sleep(seconds)
+    idle = audio_metrics(looper)
+    looper.metrics.control.reset()
+    start = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - start < seconds:
+        for i in range(20):
+            client.send('/looper/gain', i % 4, 1. - i/40.)
+        client.send_bundle([('/looper/pan', [i % 4, i/100.]) for i in range(80)])
+        sent += 100
+        if sent % 2000 == 0:
+            await client.sync() # don't outrun the socket buffer
+            sent += 1
+        else:
+            await asyncio.sleep(0.001)
+    await client.sync()
+    sent += 1
+    elapsed = time.perf_counter() - start
+    batch_time = looper.metrics.control.percentile(99)
+    flooded = audio_metrics(looper)
+    handled = server.counters['commands'] - before
+    assert handled == sent, (handled, sent)
+    assert server.counters['batches'] < server.counters['commands']
+    transport.close()
+    return idle, flooded, sent/elapsed, batch_time
+
+
+def reset_metrics(looper):
+    if looper.audio_process:
+        looper.engine.audio_metrics(reset = True)
+    else:
+        looper.metrics.reset()
+
+
+def audio_metrics(looper):
+    metrics = looper.engine.audio_metrics(reset = True)[0] if looper.audio_process \
+        else looper.metrics.as_dict()
+    if not looper.audio_process:
+        looper.metrics.reset()
+    return metrics
+
+
+def report(name, metrics):
+    jitter = metrics['histograms']['callback_jitter']
+    print('%-20s callback jitter p99 %5.2f ms max %5.2f ms, %d xruns in %d blocks'%(
+        name, 1e3*jitter['p99'], 1e3*jitter['max'], metrics['counters']['xruns'],
+        metrics['counters']['blocks']))
+
+
+def check_looper(seconds):
+    core.control_port = 0 # any free port
+    audio = TimedAudio(sample_rate, 2, blocksize, latency = 0.02)
+    audio.play(np.random.default_rng(0).uniform(-0.1, 0.1, (60*sample_rate, 2)).astype('float32'), 0)
+    hardware = Hardware.mock()
+    directory = tempfile.mkdtemp()
+    looper = core.Looper(hardware, audio, recording_directory = directory + '/',
+                         latency = 0, config = AudioConfig(blocksize = blocksize, latency = 0.02))
+    try:
+        idle, flooded, rate, batch_time = asyncio.run(drive(looper, seconds))
+        counters = looper.control.counters
+        print('%.0f commands/s handled, in batches of %.1f on average, %.3f ms per batch (p99)'%(
+            rate, counters['commands']/counters['batches'], 1e3*batch_time))
+    finally:
+        looper.kill()
+        hardware.close()
+        shutil.rmtree(directory)
+    report('idle', idle)
+    report('flooded', flooded)
+    assert flooded['counters']['xruns'] <= 0.01*flooded['counters']['blocks']
+    assert rate > 5000
+    print('playback on time under %d commands/s: ok'%rate)
+
+
+if __name__ == '__main__':
+    # The audio process is spawned: this module is imported again there
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.
+    logging.disable(logging.WARNING)
+    check_codec()
+    print('OSC messages and bundles: ok')
+    check_looper(seconds)
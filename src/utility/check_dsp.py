@@ -0,0 +1,131 @@
+# Randomized checks of the trim, fade and tile operations (dsp.py), for
+# float16, float32 and float64 audio, mono and stereo, of any length
+# (empty ones included):
+#
+#  - outputs have exactly the length asked for and the dtype of the input
+#  - the input is never modified, unless it is passed as out
+#  - trim returns a view of the input when no padding is needed and a
+#    copy otherwise; with out, everything is written to out (the padding
+#    zeroed) and out is returned; fade and tile always return new arrays
+#    without out, out itself with it, and fade in place with out = loop
+#  - the samples are those of plain indexing, loops and gain curves:
+#    trim pads with zeros, tile repeats by modulo indexing, add_tiled
+#    adds (or subtracts) loop at every multiple of its length to out, in
+#    place and cut at the end of out, and fades ramp from 0 and to 0
+#
+# usage: python3 check_dsp.py [number of random cases]
+
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import dsp
+
+n_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+rng = np.random.default_rng(0)
+dtypes = ['float16', 'float32', 'float64']
+
+
+def random_loop(dtype):
+    n = int(rng.choice([0, 1, 2, rng.integers(3, 2000)]))
+    channels = int(rng.choice([1, 2]))
+    return rng.uniform(-1, 1, (n, channels)).astype(dtype)
+
+
+def shares_memory(a, b):
+    return a.size > 0 and np.shares_memory(a, b)
+
+
+def check_trim(loop):
+    original = loop.copy()
+    n_samples = int(rng.integers(0, 2*len(loop) + 10))
+    offset = int(rng.integers(0, len(loop) + 10))
+    expected = np.zeros((n_samples, loop.shape[1]), dtype = loop.dtype)
+    available = max(0, min(len(loop) - offset, n_samples))
+    expected[:available] = loop[offset:offset+available]
+
+    result = dsp.trim(loop, n_samples, offset)
+    assert result.shape == expected.shape and result.dtype == loop.dtype
+    assert np.array_equal(result, expected)
+    if available == n_samples:
+        assert result.base is loop or n_samples == 0 # a view
+    else:
+        assert not shares_memory(result, loop)
+
+    out = rng.uniform(-1, 1, expected.shape).astype(loop.dtype) # leftovers are zeroed
+    assert dsp.trim(loop, n_samples, offset, out = out) is out
+    assert np.array_equal(out, expected)
+    assert np.array_equal(loop, original)
+
+
+def check_fade(loop):
+    original = loop.copy()
+    n_samples = int(rng.integers(0, len(loop) + 10))
+    n = min(n_samples, len(loop))
+    where = [('in', 'out'), ('in',), ('out',)][rng.integers(3)]
+    shape = str(rng.choice(dsp.fade_shapes))
+    expected = loop.copy()
+    if n:
+        if 'in' in where:
+            expected[:n] *= dsp.fade_curve(n, shape, 'in')
+        if 'out' in where:
+            expected[len(loop)-n:] *= dsp.fade_curve(n, shape, 'out')
+
+    result = dsp.fade(loop, n_samples, where, shape)
+    assert result.shape == loop.shape and result.dtype == loop.dtype
+    assert not shares_memory(result, loop)
+    assert np.array_equal(result, expected)
+    if n and 'in' in where:
+        assert np.all(result[0] == 0)
+    if n and 'out' in where:
+        assert np.all(result[-1] == 0)
+    assert np.array_equal(loop, original)
+
+    out = np.empty_like(loop)
+    assert dsp.fade(loop, n_samples, where, shape, out = out) is out
+    assert np.array_equal(out, expected) and np.array_equal(loop, original)
+    assert dsp.fade(loop, n_samples, where, shape, out = loop) is loop
+    assert np.array_equal(loop, expected)
+
+
+def check_tile(loop):
+    if len(loop) == 0:
+        return
+    original = loop.copy()
+    n_samples = int(rng.integers(0, 5*len(loop) + 10))
+    expected = loop[np.arange(n_samples) % len(loop)]
+
+    result = dsp.tile(loop, n_samples)
+    assert result.shape == expected.shape and result.dtype == loop.dtype
+    assert not shares_memory(result, loop)
+    assert np.array_equal(result, expected)
+    out = np.empty_like(expected)
+    assert dsp.tile(loop, n_samples, out = out) is out
+    assert np.array_equal(out, expected)
+    assert np.array_equal(loop, original)
+
+
+def check_add_tiled(loop):
+    if len(loop) == 0:
+        return
+    original = loop.copy()
+    out = rng.uniform(-1, 1, (int(rng.integers(0, 5*len(loop) + 10)), loop.shape[1])) \
+        .astype(loop.dtype)
+    for subtract in [False, True]:
+        before = out.copy()
+        tiled = loop[np.arange(len(out)) % len(loop)]
+        expected = before - tiled if subtract else before + tiled
+        assert dsp.add_tiled(out, loop, subtract = subtract) is out
+        assert out.dtype == loop.dtype and len(out) == len(before)
+        assert np.array_equal(out, expected)
+        assert np.array_equal(loop, original)
+
+
+if __name__ == '__main__':
+    for i in range(n_cases):
+        loop = random_loop(dtypes[i % len(dtypes)])
+        check_trim(loop)
+        check_tile(loop)
+        check_add_tiled(loop)
+        check_fade(loop) # last: fades loop in place
+    print('trim, fade, tile and add_tiled on %d random loops: ok'%n_cases)
@@ -0,0 +1,127 @@
+# Checks of takes against playback on a MemoryAudio device, with the
+# PlaybackEngine on one duplex stream (open_duplex, the recorder given
+# its input blocks) and, for comparison, on separate output and input
+# streams, for several block sizes:
+#
+#  - takes armed and disarmed at the stream times of loop boundaries
+#    (engine.frame_time, as the looper does) hold exactly the input
+#    frames between the two boundaries, however many passes went by
+#  - with the output fed back into the input N frames later (loopback),
+#    a take starting on a boundary holds the loop from its first sample
+#    on at frame N of the take, which is the latency calibration.py
+#    measures and takes are trimmed by
+#  - on a duplex stream whose input blocks were captured before their
+#    output blocks are played (inputBufferAdcTime earlier than
+#    outputBufferDacTime, as on a sound card), takes start on the input
+#    frame captured at the stream time they were armed at
+#
+# usage: python3 check_duplex.py
+
+import sys
+from fractions import Fraction
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from audio import MemoryAudio, StreamTime
+from daemons import RecordBuffer, Recorder
+from engine import PlaybackEngine
+from timeline import Loop
+
+sample_rate = 44100
+period = Fraction(3000000, 997) # frames, not a whole number
+n_takes = 30
+
+
+def numbered(n):
+    """n stereo frames whose samples are their own index + 1 (exact in float32)."""
+    return np.repeat(np.arange(1, n + 1, dtype = 'float32')[:, np.newaxis], 2, axis = 1)
+
+
+def record(blocksize, duplex, loopback = None, delay = None):
+    """
+    Takes of one pass, one every three passes, as (start frame, stop
+    frame, take), and the output of the session. With delay, the duplex
+    callback is called here, with input blocks captured delay frames
+    before their output blocks are played.
+    """
+    audio = MemoryAudio(sample_rate, 2, blocksize, loopback = loopback)
+    n_frames = int((3*n_takes + 2)*period)
+    if loopback is None:
+        audio.play(numbered(n_frames + 3*blocksize + 100), 0)
+    engine = PlaybackEngine(sample_rate, 2, blocksize, audio = audio, duplex = duplex)
+    buffer = RecordBuffer(2*int(period))
+    recorder = Recorder(buffer, sample_rate, blocksize, audio = audio)
+    takes = []
+    frames = []
+
+    def boundary(frame):
+        n = len(frames)
+        frames.append(frame)
+        if n % 3 == 0 and n:
+            assert recorder.state == 'idle'
+            takes.append((frames[n-2], frames[n-1], buffer.view().copy()))
+        if n % 3 == 1:
+            recorder.arm(engine.frame_time(frame))
+        elif n % 3 == 2:
+            recorder.disarm(engine.frame_time(frame))
+
+    engine.boundary_callback = boundary
+    engine.start_loop(Loop.from_array(numbered(int(period) + 1), period))
+    if duplex:
+        engine.input_callback = recorder.process
+    else:
+        recorder.start()
+    if delay is None:
+        engine.start()
+        audio.run_frames(n_frames)
+        engine.stop()
+    else:
+        for frame in range(0, n_frames, blocksize):
+            t = StreamTime(frame/sample_rate)
+            t.inputBufferAdcTime = (frame - delay)/sample_rate
+            outdata = np.zeros((blocksize, 2), dtype = 'float32')
+            engine.duplex_callback(audio.input[frame:frame+blocksize], outdata, blocksize, t, None)
+    recorder.stop()
+    assert len(takes) == n_takes, len(takes)
+    return takes, audio.output
+
+
+def check_input(blocksize, duplex):
+    takes, output = record(blocksize, duplex)
+    for start, stop, take in takes:
+        assert len(take) == stop - start, (start, stop, len(take))
+        assert np.array_equal(take, numbered(stop)[start:]), (blocksize, duplex, start)
+    return takes
+
+
+def check_loopback(blocksize, duplex, loopback):
+    takes, output = record(blocksize, duplex, loopback)
+    for start, stop, take in takes:
+        assert len(take) == stop - start
+        assert np.array_equal(take, output[start-loopback:stop-loopback]), (blocksize, loopback)
+        assert take[loopback, 0] == 1 # the first sample of the loop
+        assert np.array_equal(take[loopback:], output[start:stop-loopback])
+
+
+def check_adc_time(blocksize, delay):
+    # The input frame captured when output frame f is played is f + delay
+    takes, output = record(blocksize, True, delay = delay)
+    for start, stop, take in takes:
+        assert len(take) == stop - start
+        assert np.array_equal(take, numbered(stop + delay)[start+delay:]), (blocksize, delay, start)
+
+
+if __name__ == '__main__':
+    for blocksize in [64, 256, 1000]:
+        separate = check_input(blocksize, False)
+        duplex = check_input(blocksize, True)
+        assert all(a[:2] == b[:2] and np.array_equal(a[2], b[2]) for a, b in zip(separate, duplex))
+        for loopback in [blocksize, blocksize + 37, 3*blocksize]:
+            check_loopback(blocksize, True, loopback)
+            check_loopback(blocksize, False, loopback)
+    print('takes aligned on the frames of loop boundaries, on duplex and separate streams: ok')
+    print('loopback heard that many frames into takes: ok')
+    for blocksize in [64, 256]:
+        for delay in [blocksize, 2*blocksize + 100]:
+            check_adc_time(blocksize, delay)
+    print('takes start on the frame captured when they were armed: ok')
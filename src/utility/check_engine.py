@@ -0,0 +1,126 @@
+# Long-run checks of the PlaybackEngine (engine.py), without any audio
+# device: the headless render() and the stream callback itself (given
+# output buffers and stream times as sounddevice would) are driven for
+# thousands of passes of loops whose periods are not whole numbers of
+# frames (beats and bars of the timeline, and an odd fraction), with
+# blocks of a fixed size and of random sizes:
+#
+#  - boundary_callback is called at every pass, on frame ceil(k*P) of
+#    pass k and on no other frame, however many passes went by
+#  - every frame of the output is the sample of the loop due then: the
+#    sample at its offset since the start of its pass
+#  - a loop published for the next boundary takes over on that boundary,
+#    and its passes are counted from there on just as exactly
+#
+# usage: python3 check_engine.py [number of passes]
+
+import sys
+import math
+import random
+from fractions import Fraction
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from audio import MemoryAudio, StreamTime
+from engine import PlaybackEngine
+from timeline import Timeline, Loop
+
+sample_rate = 44100
+n_passes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+rng = random.Random(0)
+
+
+def numbered(period):
+    """A loop whose samples are their own index + 1 (exact in float32)."""
+    n = math.ceil(period)
+    buffer = np.repeat(np.arange(1, n + 1, dtype = 'float32')[:, np.newaxis], 2, axis = 1)
+    return Loop.from_array(buffer, period)
+
+
+def starts(origin, period, end):
+    """First frames of the passes from origin on, before end: ceil(k*P)."""
+    return [origin + math.ceil(k*period) for k in range((end - origin - 1)//period + 1)]
+
+
+def expected_output(starts, n_frames):
+    """The samples due on frames 0 to n_frames, passes starting at starts."""
+    frames = np.arange(n_frames)
+    starts = np.asarray(starts)
+    return (frames - starts[np.searchsorted(starts, frames, side = 'right') - 1] + 1) \
+        .astype('float32')
+
+
+def run(engine, n_frames, blocksizes, drive):
+    blocks = []
+    n = 0
+    while n < n_frames:
+        frames = blocksizes[len(blocks) % len(blocksizes)]
+        blocks.append(drive(engine, frames))
+        n += frames
+    return np.concatenate(blocks) # to the end of the last block
+
+
+def render(engine, frames):
+    return engine.render(frames)
+
+
+def callback(engine, frames):
+    outdata = np.empty((frames, engine.channels), dtype = 'float32')
+    engine.callback(outdata, frames, StreamTime(engine.frame/sample_rate), None)
+    return outdata
+
+
+def make_engine(drive):
+    if drive is render:
+        return PlaybackEngine(sample_rate, headless = True)
+    # Not started: the callback is only ever called from here
+    return PlaybackEngine(sample_rate, blocksize = 256, audio = MemoryAudio(sample_rate))
+
+
+def check_passes(period, blocksizes, drive):
+    engine = make_engine(drive)
+    boundaries = []
+    engine.boundary_callback = boundaries.append
+    engine.start_loop(numbered(period))
+    n_frames = int(n_passes*period)
+    out = run(engine, n_frames, blocksizes, drive)[:n_frames]
+    expected = starts(0, period, engine.frame) # those of the frames rendered past n_frames too
+    assert len(expected) >= n_passes
+    assert boundaries == expected, period
+    assert np.array_equal(out[:, 0], expected_output(expected, n_frames)), period
+    assert np.array_equal(out[:, 0], out[:, 1])
+
+
+def check_swap(first, second, blocksizes, drive):
+    engine = make_engine(drive)
+    boundaries = []
+    engine.boundary_callback = boundaries.append
+    engine.start_loop(numbered(first))
+    half = int(n_passes//2*first)
+    out = [run(engine, half, blocksizes, drive)]
+    engine.set_loop(numbered(second))
+    # Swapped on the first boundary still to come: ceil(k*P) >= frame
+    swap = math.ceil(((engine.frame - 1)//first + 1)*first)
+    n_frames = swap + int(n_passes//2*second)
+    out.append(run(engine, n_frames - engine.frame, blocksizes, drive))
+    out = np.concatenate(out)[:n_frames]
+    expected = starts(0, first, swap) + starts(swap, second, engine.frame)
+    assert boundaries == expected, (first, second)
+    assert np.array_equal(out[:, 0], expected_output(expected, n_frames)), (first, second)
+
+
+if __name__ == '__main__':
+    bpm = rng.randrange(40, 301)
+    timeline = Timeline(sample_rate, bpm)
+    periods = [timeline.period(1), Fraction(441000, 997), timeline.period(4)]
+    for drive in [render, callback]:
+        for blocksizes in [[256], [rng.randrange(1, 4096) for i in range(100)]]:
+            for period in periods[:2]:
+                check_passes(period, blocksizes, drive)
+            check_swap(periods[1], periods[0], blocksizes, drive)
+        print('%s: %d passes of %s frame loops, boundaries and samples exact: ok'%(
+            drive.__name__, n_passes, ', '.join('%.2f'%p for p in periods[:2])))
+    # Bars are long: fewer passes, rendered in large blocks
+    n_passes //= 10
+    check_passes(periods[2], [4096], render)
+    print('render: %d bars at %d bpm: ok'%(n_passes, bpm))
@@ -0,0 +1,124 @@
+# Checks of the output thread (indicators.py):
+#
+#  - jobs run in order on the worker thread, timers at their time, and
+#    stopping the worker runs what was queued first
+#  - records are formatted where they are logged (thread name, arguments,
+#    tracebacks) and written in order by the worker
+#  - past the burst, debug records of one line are dropped for the rest
+#    of the interval, and the next one tells how many; warnings are never
+#    dropped
+#  - LED commands run on the worker, an animation lights every LED in turn
+#    and stops when the LEDs are turned off meanwhile
+#
+# usage: python3 check_indicators.py
+
+import io
+import sys
+import time
+import logging
+import threading
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import indicators
+from clock import VirtualClock
+from hardware import Hardware
+
+
+def check_worker():
+    worker = indicators.Worker()
+    worker.start()
+    log = []
+    start = time.time()
+    worker.later(0.05, lambda: log.append(('timer', time.time() - start)))
+    for i in range(100):
+        worker.put(lambda i=i: log.append((i, threading.current_thread().name)))
+    time.sleep(0.1)
+    logging.disable(logging.ERROR)
+    worker.put(lambda: 1/0) # logged, the worker carries on
+    worker.put(lambda: log.append('last'))
+    worker.stop()
+    logging.disable(logging.NOTSET)
+    assert log[:100] == [(i, 'output') for i in range(100)]
+    assert log[100][0] == 'timer' and 0.05 <= log[100][1] < 0.09, log[100]
+    assert log[101:] == ['last']
+
+
+def check_logging():
+    stream = io.StringIO()
+    worker = indicators.Worker()
+    worker.start()
+    rate_limit = indicators.RateLimit(burst = 3, interval = 0.2)
+    indicators.queue_logging(worker, logging.DEBUG, '%(threadName)s %(levelname)s %(message)s',
+                             stream = stream, rate_limit = rate_limit)
+    def chatty():
+        for i in range(10):
+            logging.debug('step %d', i)
+            logging.warning('warning %d'%i)
+    thread = threading.Thread(name = 'inputs', target = chatty)
+    thread.start()
+    thread.join()
+    try:
+        1/0
+    except ZeroDivisionError:
+        logging.exception('failed')
+    time.sleep(0.25)
+    chatty()
+    worker.stop()
+    lines = stream.getvalue().splitlines()
+    steps = [l for l in lines if 'step' in l]
+    assert steps == ['inputs DEBUG step 0', 'inputs DEBUG step 1', 'inputs DEBUG step 2',
+                     'MainThread DEBUG step 0 (7 more dropped)', 'MainThread DEBUG step 1',
+                     'MainThread DEBUG step 2'], steps
+    assert [l for l in lines if 'warning' in l] == \
+        ['inputs WARNING warning %d'%i for i in range(10)] + \
+        ['MainThread WARNING warning %d'%i for i in range(10)]
+    assert 'MainThread ERROR failed' in lines and 'ZeroDivisionError: division by zero' in lines
+    assert rate_limit.dropped == 14
+
+
+def check_leds():
+    clock = VirtualClock()
+    hardware = Hardware.mock(clock)
+    worker = indicators.Worker(clock, threaded = False)
+    leds = indicators.LEDs(hardware, worker)
+    lit = []
+    def sample():
+        lit.append([l.is_lit for l in leds.leds])
+    done = []
+    leds.square(then = lambda: done.append(clock.time()))
+    for i in range(5):
+        clock.advance(0.05)
+        sample()
+        clock.advance(0.05)
+    # rec, forw, play, back in turn
+    assert lit == [[True, False, False, False], [False, False, False, True],
+                   [False, True, False, False], [False, False, True, False],
+                   [False, False, False, False]], lit
+    assert done == [0.4]
+    # Stopped by other commands
+    leds.circle(then = lambda: done.append(clock.time()))
+    clock.advance(0.15)
+    leds.all_leds_off()
+    leds.back_led.on()
+    clock.advance(1.)
+    lit = []
+    sample()
+    assert lit == [[False, False, True, False]] and done == [0.4]
+
+    # On the output thread
+    worker = indicators.Worker()
+    worker.start()
+    leds = indicators.LEDs(hardware, worker)
+    leds.rec_led.blink(on_time = 0.01, off_time = 0.01, n = 1)
+    leds.play_led.on()
+    worker.stop()
+    assert hardware.play_led.is_lit
+    hardware.close()
+
+
+check_worker()
+print('worker jobs and timers: ok')
+check_logging()
+print('queued logging, rate limit: ok')
+check_leds()
+print('LEDs and animations: ok')
@@ -0,0 +1,185 @@
+# Checks of the button input layer (inputs.py) on gpiozero's mock pins:
+#
+#  - presses, releases and taps, long presses, auto-repeat and the
+#    all-buttons gesture come at the right (virtual) times
+#  - contact bounce gives a single edge, and a bounce that ends in the
+#    other state is caught once the button has settled
+#  - with the input thread and the wall clock, edges are handled in
+#    order and their latency is recorded
+#  - in a simulated looper, a held tempo button steps the bpm without
+#    blocking, a tap on back mutes the track on the next beat (not one
+#    that cancels a take) and a long press undoes the last layer
+#
+# usage: python3 check_inputs.py
+
+import sys
+import time
+import logging
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from clock import Clock, VirtualClock
+from hardware import Hardware
+from inputs import Inputs, events
+from metrics import Metrics
+from simulation import Simulation
+
+logging.disable(logging.INFO)
+
+
+def recorder(inputs, clock, log):
+    for event in events:
+        if event == 'all':
+            inputs.on(event, None, lambda event=event: log.append((event, None, clock.time())))
+        else:
+            inputs.on(event, None, lambda name, event=event: log.append((event, name, clock.time())))
+
+
+def names(log, event):
+    return [name for e, name, t in log if e == event]
+
+
+def check_events():
+    clock = VirtualClock()
+    hardware = Hardware.mock(clock)
+    inputs = Inputs(hardware, clock, threaded = False)
+    log = []
+    recorder(inputs, clock, log)
+    inputs.start()
+
+    # Click
+    hardware.press('rec'); clock.advance(0.1); hardware.release('rec'); clock.advance(1)
+    assert [e for e, n, t in log] == ['press', 'release', 'tap'], log
+    del log[:]
+
+    # Bounces, on pressing and on releasing
+    for level in [0, 1, 0, 1, 0]:
+        (hardware.press if level == 0 else hardware.release)('play')
+        clock.advance(0.002)
+    clock.advance(0.1)
+    for level in [1, 0, 1, 0, 1]:
+        (hardware.press if level == 0 else hardware.release)('play')
+        clock.advance(0.002)
+    clock.advance(1)
+    assert [e for e, n, t in log] == ['press', 'release', 'tap'], log
+    del log[:]
+
+    # A bounce that ends released: caught when the button has settled
+    hardware.press('back'); clock.advance(0.003); hardware.release('back')
+    clock.advance(1)
+    assert [e for e, n, t in log] == ['press', 'release', 'tap'], log
+    assert abs(log[1][2] - log[0][2] - 0.023) < 1e-9, log
+    del log[:]
+
+    # Long press, auto-repeat
+    start = clock.time()
+    hardware.press('forw'); clock.advance(1.); hardware.release('forw'); clock.advance(1)
+    repeats = [t-start for e, n, t in log if e == 'repeat']
+    expected = np.arange(0.3, 1.0, 0.06)
+    assert np.allclose(repeats, expected), repeats
+    assert np.allclose([t-start for e, n, t in log if e == 'long_press'], [0.8])
+    assert names(log, 'tap') == [], log
+    del log[:]
+
+    # All buttons: only the gesture once the last one is down
+    for name in ['rec', 'play', 'back', 'forw']:
+        hardware.press(name); clock.advance(0.05)
+    for name in ['rec', 'play', 'back', 'forw']:
+        hardware.release(name); clock.advance(0.05)
+    clock.advance(1)
+    assert names(log, 'all') == [None]
+    assert names(log, 'press') == ['rec', 'play', 'back']
+    assert names(log, 'release') == [] and names(log, 'tap') == []
+    del log[:]
+
+    # Quantized handlers are handed over
+    quantized = []
+    inputs.quantizer = lambda to, function: quantized.append(to)
+    inputs.on('tap', 'rec', lambda: None, quantize = 'bar')
+    hardware.press('rec'); clock.advance(0.1); hardware.release('rec')
+    assert quantized == ['bar']
+    inputs.stop()
+    hardware.close()
+
+
+def check_threaded():
+    clock = Clock()
+    hardware = Hardware.mock(clock)
+    metrics = Metrics()
+    inputs = Inputs(hardware, clock, long_press_time = 0.2, repeat_delay = 0.1,
+                    repeat_interval = 0.02, metrics = metrics)
+    log = []
+    recorder(inputs, clock, log)
+    inputs.start()
+    for i in range(20):
+        hardware.press('rec'); time.sleep(0.03); hardware.release('rec'); time.sleep(0.03)
+    hardware.press('forw'); time.sleep(0.5); hardware.release('forw'); time.sleep(0.1)
+    inputs.stop()
+    hardware.close()
+    assert names(log, 'tap').count('rec') == 20, log
+    assert names(log, 'long_press') == ['forw']
+    assert 15 <= names(log, 'repeat').count('forw') <= 21, names(log, 'repeat')
+    latency = metrics.input_latency
+    assert latency.n == len(log)
+    return latency
+
+
+def check_looper():
+    sim = Simulation()
+    looper = sim.looper
+    sim.click('play')
+    sim.run_beats(2)
+    # Tempo: a step on press, then one every 60 ms after 0.3 s
+    sim.hold('forw', 1.)
+    sim.run(1.2)
+    assert looper.bpm == 100 + 2*(1+12), looper.bpm
+    assert sim.hardware.back_led.is_lit
+
+    # One layer, then mute it on the next beat
+    sim.click('rec')
+    sim.play(np.full((10*44100, 2), 0.1, dtype = 'float32'), sim.next_bar_frame())
+    sim.run_frames(sim.next_bar_frame() - sim.frame + 1000)
+    sim.click('play')
+    sim.run_frames(sim.next_bar_frame() - sim.frame + 1000)
+    sim.run_frames(sim.next_bar_frame() - sim.frame + 1000)
+    assert looper.state == 'play' and looper.n_loop == 1
+    muted = []
+    toggle_mute = looper.toggle_mute
+    looper.toggle_mute = lambda track: (muted.append(looper.engine.frame), toggle_mute(track))
+    sim.run_frames(3000)
+    tapped = sim.frame
+    sim.click('back')
+    sim.run_beats(2)
+    engine = looper.engine
+    beat = engine.origin + looper.timeline.next_frame(tapped - engine.origin)
+    assert len(muted) == 1 and beat <= muted[0] < beat + sim.audio.blocksize, (muted, beat)
+    assert looper.tracks[0].mute
+
+    # A take cancelled with back mutes nothing
+    sim.click('back')
+    sim.run_beats(2)
+    assert not looper.tracks[0].mute and len(muted) == 2
+    sim.click('rec')
+    sim.run_frames(sim.next_bar_frame() - sim.frame + 1000)
+    sim.run_bars(1)
+    assert looper.state == 'rec'
+    sim.click('back')
+    sim.run_beats(2)
+    assert looper.state == 'play' and not looper.tracks[0].mute and len(muted) == 2, muted
+
+    # Long press of back: undo
+    sim.hold('back', 1.)
+    sim.run(1.2)
+    assert looper.n_loop == 0
+    assert len(muted) == 2 # no tap
+    assert looper.metrics.input_latency.n > 0
+    sim.close()
+
+
+check_events()
+print('events, bounces, long press, repeat, all buttons: ok')
+latency = check_threaded()
+print('input thread: ok, edge to handler %.0f us mean, %.0f us max' % (
+    1e6*latency.mean, 1e6*latency.max))
+check_looper()
+print('looper tempo hold, quantized mute, undo: ok')
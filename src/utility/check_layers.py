@@ -0,0 +1,67 @@
+# Checks of the RAM budget of the recorded layers (layers.py, tracks.py):
+#
+#  - the lanes of a track (layers of 1, 2, 3 and 4 bars) keep their
+#    layers in one store per track: the budget holds for the track as a
+#    whole, the oldest layers of any lane are compacted first, and only
+#    the most recent layer of the track stays hot
+#  - undoing every layer gives each one back as it was added (the last
+#    one exactly, the compacted ones within int16 precision) and empties
+#    the store, as does clearing the tracks
+#  - the loops mixed from the lanes are the sums of their layers
+#
+# usage: python3 check_layers.py
+
+import sys
+import logging
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from layers import LayerStore
+from tracks import Tracks
+
+periods = [1000, 2000, 3000, 4000]
+
+
+def check_budget():
+    rng = np.random.default_rng(0)
+    budget = 60000 # bytes, 2 float32 stereo layers of 4000 samples
+    tracks = Tracks(2, 2, lambda: LayerStore(budget, 'int16'))
+    added = []
+    for i in range(12):
+        period = periods[i % len(periods)]
+        layer = rng.uniform(-0.5, 0.5, (period, 2)).astype('float32')
+        tracks.add(0, layer, period, 0)
+        added.append(layer)
+        store = tracks[0].store
+        assert len(store) == i + 1
+        assert store.nbytes <= budget or store.tiers().count('hot') == 1, store.tiers()
+        # Oldest first, whichever their lane
+        tiers = store.tiers()
+        assert tiers[-1] == 'hot' and tiers == sorted(tiers), tiers # 'compact' < 'hot'
+        for period, mixer in tracks[0].lanes.items():
+            mix = np.zeros((period, 2), dtype = 'float32')
+            for l in mixer.layers:
+                mix += l
+            # mixed before they were compacted
+            assert np.allclose(mixer.loop, mix, atol = len(mixer)/32768.)
+    assert tracks[0].store.tiers().count('hot') == 1
+    assert tracks[1].store.nbytes == 0
+    for i, layer in reversed(list(enumerate(added))):
+        popped = tracks.pop()
+        if i == len(added) - 1:
+            assert np.array_equal(popped, layer)
+        else:
+            assert np.allclose(popped, layer, atol = 1./32768)
+        assert len(tracks[0].store) == i
+    assert not tracks[0].store.layers and all(len(m) == 0 for m in tracks[0].lanes.values())
+
+    for period in periods:
+        tracks.add(1, np.ones((period, 2), dtype = 'float32'), period, 0)
+    tracks.clear()
+    assert len(tracks[1].store) == 0 and not tracks[1].lanes
+
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING) # over budget: no wav files to map the layers onto
+    check_budget()
+    print('one budget per track, shared by its lanes: ok')
@@ -0,0 +1,223 @@
+# Checks of the table-driven state machine (machine.py) against the
+# transitions package it replaces:
+#
+#  - from every state, every trigger of the former transitions.Machine
+#    table gives the same state and the same on_exit_/on_enter_ callbacks
+#    (ignored triggers included), the only new pair being play released
+#    in pause, a state that wasn't reachable
+#  - effects (show_) run in order on the effects thread, and firing
+#    triggers allocates nothing
+#  - in a simulated looper, a long press of back in pre_rec undoes the
+#    last layer, one of rec clears every layer and goes back to the
+#    metronome, one of play stops playback and a tap of play starts the
+#    loop again from its start
+#
+# usage: python3 check_machine.py
+
+import sys
+import logging
+import threading
+import tracemalloc
+from itertools import product
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from transitions import Machine
+import core
+import session
+from machine import StateMachine
+from simulation import Simulation
+
+logging.disable(logging.INFO)
+logging.getLogger('transitions').setLevel(logging.ERROR) # ignored triggers
+
+# The table of the transitions.Machine, as it was
+former_transitions = [
+    ['release_play_button',         'init',         'metronome'],
+    ['release_rec_button',          'metronome',    'pre_rec'],
+    ['release_rec_button',          'play',         'pre_rec'],
+    ['start_recording',             'pre_rec',      'rec'],
+    ['release_play_button',         'pre_rec',      'play'],
+    ['release_back_button',         'pre_rec',      'play'],
+    ['release_play_button',         'rec',          'pre_play'],
+    ['release_rec_button',          'rec',          'pre_rec'],
+    ['release_back_button',         'rec',          'play'],
+    ['end_recording',               'pre_play',     'play'],
+    ['release_rec_button',          'pre_play',     'pre_rec'],
+    ['release_back_button',         'pre_play',     'play'],
+    ['resume',                      'init',         'play'],
+]
+
+
+class Model(object):
+    """Logs its callbacks."""
+
+    def __init__(self):
+        self.log = []
+        self.shown = []
+
+
+def logger(name, log):
+    def callback(self):
+        getattr(self, log).append((name, threading.current_thread().name))
+    return callback
+
+# On the class: transitions.Machine only binds methods
+for state in ['init'] + core.Looper.states:
+    for kind in ['on_exit_', 'on_enter_']:
+        setattr(Model, kind + state, logger(kind + state, 'log'))
+    setattr(Model, 'show_' + state, logger(state, 'shown'))
+for transition in core.Looper.transitions:
+    if len(transition) > 3:
+        setattr(Model, transition[3], logger(transition[3], 'log'))
+
+
+def check_table():
+    former, new = Model(), Model()
+    machine = Machine(model = former, states = core.Looper.states,
+                      transitions = former_transitions, initial = 'init',
+                      ignore_invalid_triggers = True)
+    compiled = StateMachine(new, core.Looper.states, core.Looper.transitions, 'init',
+                            threaded = False)
+    triggers = sorted(set(t[0] for t in former_transitions))
+    former_pairs = set((t[0], t[1]) for t in former_transitions)
+    # Triggers of the new transitions, or from pause (unreachable before)
+    added = set((trigger, source) for trigger, source in product(triggers, core.Looper.states)
+                if (trigger, source) not in former_pairs and compiled.table[
+                    compiled.trigger_ids[trigger]*compiled.n_states + compiled.ids[source]] >= 0)
+    assert added == set([('release_play_button', 'pause')]), added
+    n = 0
+    for state in ['init'] + core.Looper.states:
+        for trigger in triggers:
+            if (trigger, state) in added:
+                continue
+            machine.set_state(state)
+            compiled.set_state(state)
+            del former.log[:], new.log[:], new.shown[:]
+            applied = former.trigger(trigger)
+            assert getattr(new, trigger)() == applied, (state, trigger)
+            assert new.state == former.state, (state, trigger, new.state, former.state)
+            assert new.log == former.log, (state, trigger, new.log, former.log)
+            assert new.shown == ([(new.state, 'MainThread')] if applied else [])
+            n += 1
+    return n
+
+
+def check_effects():
+    model = Model()
+    compiled = StateMachine(model, core.Looper.states, core.Looper.transitions, 'init')
+    for trigger in ['release_play_button', 'release_rec_button', 'start_recording',
+                    'release_back_button', 'undo', 'stop', 'release_play_button']:
+        compiled.trigger(trigger)
+    compiled.stop()
+    assert model.shown == [(state, 'effects') for state in
+                           ['metronome', 'pre_rec', 'rec', 'play', 'pause', 'play']], model.shown
+    assert ('undo_last_layer', 'MainThread') in model.log
+
+    # Round the recording cycle, with a trigger ignored on the way
+    compiled = StateMachine(Model(), core.Looper.states, core.Looper.transitions, 'init',
+                            threaded = False)
+    compiled.set_state('play')
+    fires = [compiled.fire_functions[compiled.trigger_ids[name]] for name in
+             ['release_rec_button', 'start_recording', 'release_play_button',
+              'end_recording', 'release_back_button']]
+    compiled.model.log = compiled.model.shown = None # the callbacks would fill them
+    for name in ['on_exit', 'on_enter', 'show']:
+        setattr(compiled, name, [None]*compiled.n_states)
+    for fire in fires:
+        fire()
+    assert compiled.model.state == 'play'
+    # As much memory in use as to call a function that does nothing
+    peak = allocated(fires*10000)
+    assert peak == allocated([nothing]*50000), peak
+
+
+def nothing():
+    pass
+
+
+def allocated(functions):
+    """Most memory in use while calling functions, over what there was before."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for function in functions:
+        function()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return peak
+
+
+def check_looper():
+    sim = Simulation()
+    looper = sim.looper
+    bar = looper.timeline.length(4)
+    sim.click('play')
+    sim.run_beats(2)
+
+    def record(n_bars = 1):
+        # From the current state, one more layer of n_bars
+        sim.click('rec')
+        sim.play(np.random.default_rng(looper.n_takes).uniform(
+            -0.1, 0.1, (2*n_bars*bar, 2)).astype('float32'), sim.next_bar_frame())
+        sim.run_frames(sim.next_bar_frame() - sim.frame + bar//2)
+        for i in range(n_bars-1):
+            sim.run_bars(1)
+        sim.click('play')
+        sim.run_frames(sim.next_bar_frame() - sim.frame + 1000)
+        sim.run_frames(sim.next_bar_frame() - sim.frame + 1000)
+        assert looper.state == 'play'
+
+    record()
+    record()
+    assert looper.n_loop == 2
+
+    # Undo while waiting to record: still waiting, one layer less
+    sim.click('rec')
+    sim.run_frames(1000)
+    assert looper.state == 'pre_rec'
+    sim.hold('back', 1.)
+    sim.run(0.9)
+    assert looper.state == 'pre_rec' and looper.n_loop == 1
+    sim.click('play')
+    sim.run_frames(1000)
+    assert looper.state == 'play'
+
+    # Stop: silence, play: the loop again from its start
+    sim.hold('play', 1.)
+    sim.run(1.2)
+    assert looper.state == 'pause' and not sim.hardware.play_led.is_lit
+    stopped = sim.frame
+    sim.run_bars(1)
+    assert not sim.output[stopped:].any()
+    sim.click('play')
+    sim.run_frames(2*bar)
+    engine = looper.engine
+    assert looper.state == 'play' and sim.hardware.play_led.is_lit
+    start = engine.loop_start - bar # the pass before the current one
+    assert stopped + bar < start
+    loop = looper.tracks.loop.render(engine.loop_start - bar - engine.origin, bar,
+                                      looper.tracks.gains())
+    assert np.array_equal(sim.output[start:start+bar], loop)
+
+    # Clear: back to the metronome, then record again from scratch
+    sim.hold('rec', 1.)
+    sim.run(1.2)
+    sim.run_bars(1)
+    assert looper.state == 'metronome' and looper.n_loop == 0
+    assert looper.tracks.n_layers == 0 and looper.tracks.loop is None
+    assert sim.hardware.back_led.is_lit
+    clicks = sim.output[sim.frame - bar:]
+    assert np.array_equal(clicks, looper.metronome.bar(looper.bpm).render(
+        sim.frame - bar - engine.origin, bar))
+    record()
+    assert looper.n_loop == 1
+    state = session.load(looper.recording_directory)
+    assert len(state.layers) == 1 and state.layers[0]['file'] == 'loop_002.wav', state.layers
+    sim.close()
+
+
+print('%d state and trigger pairs as with transitions.Machine: ok' % check_table())
+check_effects()
+print('effects in order on their thread, nothing allocated by triggers: ok')
+check_looper()
+print('undo, stop and clear in a simulated looper: ok')
@@ -0,0 +1,51 @@
+# Checks of the histograms of the hot path metrics (metrics.py), on
+# random values against NumPy:
+#
+#  - values are counted in the bins of their edges, the mean and the
+#    maximum are exact
+#  - percentiles are the upper edge of the bin holding the exact
+#    percentile, never above the maximum: p99 <= max, also when all
+#    values sit low in their bin or past the last edge
+#
+# usage: python3 check_metrics.py
+
+import sys
+from bisect import bisect_right
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from metrics import Histogram, Metrics
+
+rng = np.random.default_rng(0)
+
+
+def check_histogram(edges, values):
+    histogram = Histogram(edges)
+    for v in values:
+        histogram.add(float(v))
+    assert histogram.n == len(values) and sum(histogram.counts) == len(values)
+    assert histogram.max == max(values)
+    assert abs(histogram.mean - np.mean(values)) < 1e-9*max(1., abs(np.mean(values)))
+    for q in [1, 50, 90, 99, 100]:
+        p = histogram.percentile(q)
+        assert p <= histogram.max, (q, p, histogram.max)
+        exact = np.percentile(values, q, method = 'inverted_cdf')
+        # The upper edge of its bin, or the maximum below that edge
+        i = bisect_right(edges, exact)
+        upper = edges[i] if i < len(edges) else histogram.max
+        assert p == min(upper, histogram.max), (q, p, exact, upper)
+    as_dict = histogram.as_dict()
+    assert as_dict['p50'] <= as_dict['p99'] <= as_dict['max']
+
+
+if __name__ == '__main__':
+    edges = Metrics().callback.edges
+    for i in range(200):
+        n = int(rng.integers(1, 2000))
+        scale = edges[int(rng.integers(len(edges)))]
+        values = list(rng.exponential(scale, n))
+        check_histogram(edges, values)
+    # All in one bin, well under its upper edge
+    check_histogram([1., 10.], [2., 2.5, 3.])
+    assert Histogram([1., 10.]).percentile(99) == 0.
+    print('histogram counts, mean, max and percentiles: ok')
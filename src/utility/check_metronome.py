@@ -0,0 +1,131 @@
+# Checks of the metronome (metronome.py):
+#
+#  - every click of a bar starts on the exact frame of its beat or
+#    subdivision within the bar, ceil((beat + i/subdivisions)*samples per
+#    beat), with its accent, for 40-300 bpm, 2 to 7 beats per bar and 1 to
+#    4 clicks per beat
+#  - played by the engine, with random block sizes, click k of bar m lands
+#    on frame ceil(m*bar period) + its frame in the bar
+#  - holding a tempo button (a step every 60 ms, the dispatcher prefetching
+#    bars ahead) only ever finds cached bars, and each step allocates less
+#    than a bar
+#  - a swapped click sample is used from the next bar on
+#
+# usage: python3 check_metronome.py
+
+import sys
+import math
+import queue
+import random
+import threading
+import tracemalloc
+from fractions import Fraction
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from metronome import Metronome
+from engine import PlaybackEngine
+
+sample_rate = 44100
+rng = random.Random(0)
+# Every sample of the click is different, so that a click out of place
+# by one sample is seen
+click = np.linspace(1., 0.5, 400, dtype = 'float32')
+
+
+def expected_clicks(bpm, beats_per_bar, subdivisions):
+    samples_per_beat = Fraction(60*sample_rate, bpm)
+    return [math.ceil((beat + Fraction(i, subdivisions))*samples_per_beat)
+            for beat in range(beats_per_bar) for i in range(subdivisions)]
+
+
+def check_bars():
+    metronome = Metronome(sample_rate, click)
+    for bpm in range(40, 301):
+        for beats_per_bar in [2, 3, 4, 5, 7]:
+            accents = [rng.choice([0.25, 0.5, 1.]) for i in range(beats_per_bar)]
+            subdivisions = rng.randint(1, 4)
+            metronome.configure(beats_per_bar, accents, subdivisions)
+            bar = metronome.bar(bpm).lanes[0].buffer
+            starts = expected_clicks(bpm, beats_per_bar, subdivisions)
+            assert len(bar) == math.ceil(beats_per_bar*Fraction(60*sample_rate, bpm))
+            expected = np.zeros_like(bar)
+            for k, start in enumerate(starts):
+                end = starts[k+1] if k+1 < len(starts) else len(bar)
+                n = min(len(click), end-start)
+                level = accents[k//subdivisions]*(1. if k % subdivisions == 0 else 0.25)
+                expected[start:start+n] = click[:n,np.newaxis]*np.float32(level)
+            assert np.array_equal(bar, expected), (bpm, beats_per_bar, subdivisions)
+
+
+def check_engine(bpm):
+    metronome = Metronome(sample_rate, click, subdivisions = 2)
+    loop = metronome.bar(bpm)
+    engine = PlaybackEngine(sample_rate, headless = True)
+    engine.start_loop(loop)
+    n_bars = 30
+    n = math.ceil(n_bars*loop.period)
+    blocks = []
+    while sum(len(b) for b in blocks) < n:
+        blocks.append(engine.render(rng.randrange(1, 2048)))
+    out = np.concatenate(blocks)[:n, 0]
+    onsets = list(np.flatnonzero((out != 0) & (np.roll(out, 1) == 0)))
+    expected = [math.ceil(m*loop.period) + start for m in range(n_bars)
+                for start in expected_clicks(bpm, 4, 2)]
+    assert onsets == expected, bpm
+
+
+def check_hold():
+    """A tempo button held from 40 to 300 bpm, and back."""
+    metronome = Metronome(sample_rate, click, cache_bytes = 32e6)
+    tasks = queue.Queue()
+
+    def dispatcher():
+        while True:
+            bpms = tasks.get()
+            metronome.prefetch(bpms)
+            tasks.task_done()
+    threading.Thread(target = dispatcher, daemon = True).start()
+
+    bpm = 100
+    metronome.bar(bpm)
+    tasks.put(range(bpm-8, bpm+9, 2))
+    tracemalloc.start()
+    largest = 0
+    for step in [2]*130 + [-2]*130:
+        tasks.join() # the dispatcher has had 60 ms
+        if not 40 <= bpm+step <= 300:
+            continue
+        bpm += step
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        metronome.bar(bpm)
+        tasks.put([bpm + step*i for i in range(1, 9) if 40 <= bpm + step*i <= 300])
+        largest = max(largest, tracemalloc.get_traced_memory()[1]-before)
+    tracemalloc.stop()
+    assert metronome.misses == 1, metronome.misses # the first bar
+    assert metronome.nbytes <= 32e6
+    smallest_bar = math.ceil(4*Fraction(60*sample_rate, 300))*2*4
+    assert largest < smallest_bar/10, largest
+    return largest
+
+
+def check_swap():
+    metronome = Metronome(sample_rate, click)
+    first = metronome.bar(120)
+    metronome.set_click(-click)
+    second = metronome.bar(120)
+    assert second is not first
+    assert np.array_equal(second.lanes[0].buffer, -first.lanes[0].buffer)
+    metronome.set_click(click)
+    assert np.array_equal(metronome.bar(120).lanes[0].buffer, first.lanes[0].buffer)
+
+
+check_bars()
+print('click positions: ok')
+for bpm in rng.sample(range(40, 301), 10):
+    check_engine(bpm)
+print('clicks played by the engine: ok')
+print('tempo buttons held: ok, at most %d bytes allocated per step' % check_hold())
+check_swap()
+print('click swapped: ok')
@@ -0,0 +1,110 @@
+# Checks of overdub monitoring (daemons.TakeLane, Looper.monitor_take):
+#
+#  - a TakeLane plays the record buffer as the layer update_loop will mix
+#    in (latency trimmed, faded in and out, rolled to where the take
+#    started in its pass), for any period, start and read, and is silent
+#    where the take isn't captured yet, once silenced and once the take
+#    went round the buffer
+#  - in a simulated looper, on simulated input, the pass right after a
+#    take already plays it on top of the loop, from the record buffer,
+#    and is the same, sample for sample, as the passes of the mixed loop
+#    that follow: the first take (the metronome stops), a second take of
+#    two bars over a loop of one bar, and a third one with input latency
+#
+# usage: python3 check_overdub.py
+
+import sys
+import logging
+from fractions import Fraction
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import dsp
+import daemons
+from simulation import Simulation
+from timeline import Lane
+
+logging.disable(logging.INFO)
+rng = np.random.default_rng(0)
+
+
+def check_lane():
+    fade = 300
+    fades = (dsp.fade_curve(fade, 'linear', 'in'), dsp.fade_curve(fade, 'linear', 'out'))
+    for period, start, latency in [(Fraction(10000), 0, 0), (Fraction(30001, 3), 1234, 57),
+                                   (Fraction(20000), 15000, 441), (Fraction(9999, 2), 7777, 0)]:
+        length = -(-period.numerator//period.denominator)
+        buffer = daemons.RecordBuffer(2*length)
+        take = rng.uniform(-0.1, 0.1, (length + latency + 100, 2)).astype('float32')
+        buffer.write(take)
+        lane = daemons.TakeLane(buffer, length, period, start = start, latency = latency,
+                                fades = fades)
+        # As Looper.prepare_layer and Tracks.add make it
+        layer = dsp.fade(dsp.trim(take, length, offset = latency), fade)
+        shift = start - Lane(layer, period).bounds(start)[0]
+        mixed = Lane(np.roll(layer, shift, axis = 0), period)
+        for i in range(50):
+            offset = int(rng.integers(0, 5*length))
+            n = int(rng.integers(1, 3*length))
+            assert np.array_equal(lane.read(offset, np.empty((n, 2), dtype = 'float32')),
+                                  mixed.read(offset, np.empty((n, 2), dtype = 'float32'))), \
+                (period, start, latency, offset, n)
+
+    # Captured so far only
+    buffer = daemons.RecordBuffer(20000)
+    take = rng.uniform(-0.1, 0.1, (10000, 2)).astype('float32')
+    buffer.write(take[:6000])
+    lane = daemons.TakeLane(buffer, 10000, 10000, latency = 100, fades = fades)
+    out = lane.read(0, np.empty((10000, 2), dtype = 'float32'))
+    assert np.array_equal(out[:5900], dsp.fade(take[100:6000], fade, ('in',)))
+    assert not out[5900:].any()
+    buffer.write(take[6000:])
+    assert lane.read(9000, np.empty((100, 2), dtype = 'float32')).any()
+    lane.silence()
+    assert not lane.read(0, np.empty((10000, 2), dtype = 'float32')).any()
+    lane = daemons.TakeLane(buffer, 10000, 10000)
+    buffer.write(take)
+    buffer.write(take[:1]) # a sample more than the buffer holds
+    assert not lane.read(0, np.empty((10000, 2), dtype = 'float32')).any()
+
+
+def check_looper(latency, n_bars, sim = None):
+    """Record a take of n_bars, returns the simulation."""
+    if sim is None:
+        sim = Simulation(latency = latency)
+        sim.click('play')
+        sim.run_beats(2)
+    looper = sim.looper
+    bar = looper.timeline.length(4)
+    n_layers = looper.tracks.n_layers
+    sim.click('rec')
+    start = sim.next_bar_frame()
+    sim.play(rng.uniform(-0.1, 0.1, ((n_bars+1)*bar, 2)).astype('float32'),
+             start + int(latency*looper.sample_rate))
+    sim.run_frames(start - sim.frame + bar//2)
+    sim.run_bars(n_bars - 1)
+    sim.click('play')
+    end = sim.next_bar_frame()
+    sim.run_frames(end - sim.frame + 1000)
+    # Heard straight from the record buffer, the layer isn't mixed in yet
+    lanes = looper.engine.loop.lanes
+    assert isinstance(lanes[-1], daemons.TakeLane) and len(lanes) == n_layers + 1
+    period = len(looper.engine.loop)
+    sim.run_frames(3*period)
+    assert looper.state == 'play' and looper.tracks.n_layers == n_layers + 1
+    assert not isinstance(looper.engine.loop.lanes[-1], daemons.TakeLane)
+    passes = [sim.output[end+k*period:end+(k+1)*period] for k in range(3)]
+    assert np.abs(passes[0]).max() > 0.05
+    assert np.array_equal(passes[0], passes[1]) and np.array_equal(passes[1], passes[2])
+    return sim
+
+
+check_lane()
+print('take lanes as the layers they make: ok')
+sim = check_looper(0, 1)
+print('first take heard on the next pass: ok')
+check_looper(0, 2, sim)
+print('two bars over one: ok')
+check_looper(0.01, 1, check_looper(0.01, 1)).close()
+sim.close()
+print('with input latency: ok')
@@ -0,0 +1,94 @@
+# Checks of the offline render (render.py), on a session script with two
+# takes and an undo:
+#
+#  - rendering the script twice gives bit-identical output
+#  - the command line writes that same output to a float WAV file
+#  - each layer is heard from the pass right after its take, the second
+#    one on top of the first, and once it is undone the loop is the
+#    first layer alone again
+#
+# usage: python3 check_render.py
+
+import sys
+import json
+import shutil
+import logging
+import tempfile
+import subprocess
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import soundfile as sf
+import render
+
+logging.disable(logging.WARNING)
+rng = np.random.default_rng(0)
+directory = tempfile.mkdtemp(prefix = 'pi-looper-check-')
+
+# 120 bpm: 22050 samples per beat, a bar of 88200
+bar = 88200
+sf.write(path.join(directory, 'a.wav'), rng.uniform(-0.1, 0.1, (bar + 4410, 2)), 44100,
+         subtype = 'FLOAT')
+sf.write(path.join(directory, 'b.wav'), rng.uniform(-0.1, 0.1, bar + 4410), 44100,
+         subtype = 'FLOAT') # mono
+script = {
+    'bpm': 120,
+    'takes': {'a': 'a.wav'},
+    'events': [
+        {'beat': 0, 'click': 'play'},
+        {'beat': 2, 'click': 'rec'},
+        {'beat': 4, 'play': 'a'},
+        {'beat': 7, 'click': 'play'},
+        {'beat': 14, 'click': 'rec'},
+        {'beat': 16, 'play': 'b.wav', 'gain': 0.5},
+        {'beat': 19, 'click': 'play'},
+        {'time': 15., 'hold': 'back', 'seconds': 1.},
+    ],
+    'end': 40,
+}
+script_filename = path.join(directory, 'session.json')
+with open(script_filename, 'w') as f:
+    json.dump(script, f)
+
+
+def check_repeat():
+    first = render.render(render.Script.load(script_filename))
+    second = render.render(render.Script.load(script_filename))
+    assert first.shape == (40*22050, 2) and first.dtype == np.float32
+    assert np.array_equal(first, second)
+    return first
+
+
+def check_cli(output):
+    filename = path.join(directory, 'out.wav')
+    result = subprocess.run(
+        [sys.executable, path.join(path.dirname(render.__file__), 'render.py'),
+         script_filename, filename], capture_output = True, text = True, check = True)
+    assert render.digest(output) in result.stdout, result.stdout
+    written, sr = sf.read(filename, dtype = 'float32')
+    assert sr == 44100 and np.array_equal(written, output)
+    return result.stdout.strip()
+
+
+def check_layers(output):
+    bars = [output[k*bar:(k+1)*bar] for k in range(10)]
+    # Bar 1 is recorded and the first layer plays from bar 2 on, straight
+    # from the record buffer until it is mixed in. Bar 4 is recorded, both
+    # layers play from bar 5 on. The undo is in bar 7, bar 9 is the first
+    # layer again (give or take the rounding of subtracting the second
+    # one). Passes start a block or so into the bars (where the metronome
+    # started), so the first half of a bar can still be the pass before.
+    assert np.abs(bars[4]).max() > 0.05
+    assert np.array_equal(bars[2][bar//2:], bars[3][bar//2:])
+    assert np.array_equal(bars[3], bars[4])
+    assert np.array_equal(bars[5][bar//2:], bars[6][bar//2:])
+    assert not np.allclose(bars[7], bars[4], atol = 1e-3)
+    assert np.allclose(bars[9], bars[4], rtol = 0, atol = 1e-6)
+
+
+output = check_repeat()
+print('bit-exact renders: ok')
+print('command line: ok, %s' % check_cli(output))
+check_layers(output)
+print('layers, overdub and undo: ok')
+shutil.rmtree(directory)
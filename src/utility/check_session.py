@@ -0,0 +1,165 @@
+# Checks of the session journal and its recovery (session.py), on a
+# simulated session (simulation.py): four takes on two tracks, an undo
+# and track gain and pan changes.
+#
+#  - the journal, cut at every byte, reads back as the events of its
+#    complete lines, and a line garbled in the middle stops the reading
+#  - stems left without their final header sizes (the writer did not
+#    close them) are repaired to hold every complete frame
+#  - a looper resumed from the session (twice, with a take recorded in
+#    between), and from copies of it cut short as after a crash, plays
+#    the layers the journal holds with the same track settings
+#
+# usage: python3 check_session.py [number of crash copies]
+
+import os
+import sys
+import json
+import shutil
+import struct
+import logging
+import tempfile
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import soundfile as sf
+from simulation import Simulation
+import session
+
+n_crashes = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+logging.disable(logging.WARNING)
+rng = np.random.default_rng(0)
+
+
+def record(sim, track, n_passes = 1):
+    """A take of n_passes passes of the loop (or metronome bar) on track."""
+    sim.looper.select_track(track)
+    sim.click('rec')
+    sim.play(rng.uniform(-0.1, 0.1, (10*44100, 2)).astype('float32'), sim.next_bar_frame())
+    for i in range(n_passes):
+        sim.run_frames(sim.next_bar_frame() - sim.frame + 1000)
+    sim.click('play')
+    sim.run_frames(sim.next_bar_frame() - sim.frame + 1000)
+
+
+def lanes(looper):
+    """(track, period): lane buffer, of every lane the looper plays."""
+    return dict(((lane.track, lane.period), lane.buffer) for lane in looper.tracks.loop.lanes)
+
+
+def check_lanes(expected, looper, what):
+    found = lanes(looper)
+    assert sorted(found) == sorted(expected), what
+    for key in expected:
+        # Stems are 16 bit
+        assert np.abs(found[key]-expected[key]).max() < 8/32768., (what, key)
+
+
+directory = tempfile.mkdtemp(prefix = 'pi-looper-check-')
+sim = Simulation(recording_directory = directory)
+sim.click('play')
+sim.run_beats(2)
+for track, n_passes in [(0, 1), (1, 2), (0, 1), (1, 1)]:
+    record(sim, track, n_passes)
+sim.looper.undo_last_layer()
+sim.run_beats(1)
+sim.looper.set_gain(1, 0.5)
+sim.looper.set_pan(0, -0.5)
+sim.run_beats(1)
+expected = lanes(sim.looper)
+gains = sim.looper.tracks.gains()
+session_directory = sim.looper.recording_directory
+sim.close()
+
+journal = path.join(session_directory, session.journal_name)
+with open(journal, 'rb') as f:
+    data = f.read()
+events = [json.loads(line) for line in data.decode().splitlines()]
+assert len(session.load(session_directory).layers) == 3
+
+
+# Truncated and garbled journals
+cut = tempfile.mkdtemp(prefix = 'pi-looper-check-')
+cut_journal = path.join(cut, session.journal_name)
+for n in range(len(data)+1):
+    with open(cut_journal, 'wb') as f:
+        f.write(data[:n])
+    found = session.read_journal(cut_journal)
+    n_complete = data[:n].count(b'\n')
+    assert found == events[:len(found)], n
+    assert len(found) in (n_complete, n_complete+1), n
+    session.SessionState(found)
+garbled = bytearray(data)
+line_start = data.index(b'\n', len(data)//2) + 1
+garbled[line_start] = ord('#')
+with open(cut_journal, 'wb') as f:
+    f.write(garbled)
+assert session.read_journal(cut_journal) == events[:data[:line_start].count(b'\n')]
+print('journal cut at each of %d bytes: ok' % len(data))
+
+
+# Stems whose header was not written
+stem = path.join(session_directory, 'loop_000.wav')
+take = sf.read(stem, dtype = 'int16')[0]
+unclosed = path.join(cut, 'unclosed.wav')
+shutil.copy(stem, unclosed)
+with open(unclosed, 'r+b') as f:
+    f.seek(4)
+    f.write(struct.pack('<I', 0))
+    f.seek(-len(take)*4-4, 2)
+    f.write(struct.pack('<I', 0))
+with open(unclosed, 'ab') as f:
+    f.write(b'\x01\x02\x03') # a frame that was being written
+assert session.repair_wav(unclosed)
+assert np.array_equal(sf.read(unclosed, dtype = 'int16')[0], take)
+assert session.repair_wav(stem) # leaves closed files alone
+assert np.array_equal(sf.read(stem, dtype = 'int16')[0], take)
+print('unclosed stem repaired: ok')
+
+
+# Resumed sessions
+def resume(directory):
+    sim = Simulation(resume = directory)
+    sim.run_bars(2)
+    return sim
+
+sim = resume(session_directory)
+assert sim.looper.state == 'play'
+check_lanes(expected, sim.looper, 'resumed')
+assert np.array_equal(sim.looper.tracks.gains(), gains)
+# Layers recorded after a resume land where they were played
+record(sim, 2)
+expected = lanes(sim.looper)
+sim.close()
+sim = resume(session_directory)
+check_lanes(expected, sim.looper, 'resumed twice')
+sim.close()
+print('session resumed: ok')
+
+# Crashes: the journal cut anywhere, the stem of the last layer unclosed
+for n in rng.choice(len(data), n_crashes, replace = False):
+    crashed = tempfile.mkdtemp(prefix = 'pi-looper-check-')
+    for name in os.listdir(session_directory):
+        if name.startswith('loop_'):
+            shutil.copy(path.join(session_directory, name), crashed)
+    with open(path.join(crashed, session.journal_name), 'wb') as f:
+        f.write(data[:n])
+    state = session.load(crashed)
+    if state.layers:
+        with open(path.join(crashed, state.layers[-1]['file']), 'r+b') as f:
+            f.seek(4)
+            f.write(struct.pack('<I', 0))
+    sim = resume(crashed)
+    n_layers = len(state.layers)
+    assert sim.looper.n_loop == n_layers, n
+    if n_layers:
+        assert sim.looper.tracks.n_layers == n_layers
+        assert sim.looper.state == 'play'
+    else:
+        assert sim.looper.state == 'init'
+    sim.close()
+    shutil.rmtree(crashed)
+print('%d crashed sessions resumed: ok' % n_crashes)
+
+shutil.rmtree(cut)
+shutil.rmtree(directory)
@@ -0,0 +1,99 @@
+# Checks of a whole session in the simulation harness (simulation.py),
+# on the samples the looper plays (sim.output), at a tempo whose bars are
+# not whole numbers of frames:
+#
+#  - metronome: from the press of play on, the metronome bar, pass after
+#    pass, and silence before
+#  - rec, then play: the metronome goes on while the first take of one
+#    bar is recorded (its passes counted from the start of the take),
+#    then the take replaces it, trimmed and faded, from the boundary play
+#    was pressed before, pass after pass
+#  - overdub: a second take over the loop is heard from the boundary
+#    after it on top of the first, sample for sample as the two layers
+#    mixed, while the loop alone plays during the take
+#
+# usage: python3 check_simulation.py
+
+import sys
+import logging
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import core
+import dsp
+from simulation import Simulation
+from timeline import Lane
+
+logging.disable(logging.INFO)
+rng = np.random.default_rng(0)
+bpm = 130 # a bar is 81415.38 frames
+
+
+def played(lane, origin, start, end):
+    """Frames start to end of lane, its passes counted from the frame origin."""
+    return lane.read(start - origin, np.empty((end - start, 2), dtype = 'float32'))
+
+
+def layer(sim, take, start, end):
+    """The layer made of the take played from start, recorded until end."""
+    timeline = sim.looper.timeline
+    captured = take[:end - start]
+    n_samples = timeline.length(timeline.beats(len(captured)))
+    return dsp.fade(dsp.trim(captured, n_samples), sim.looper.fade_samples,
+                    shape = core.fade_shape)
+
+
+def record(sim, take):
+    """Press rec, play take from the next boundary on, press play: start and end frames."""
+    sim.click('rec')
+    start = sim.next_bar_frame()
+    sim.play(take, start)
+    sim.run_frames(start - sim.frame + len(take)//2)
+    assert sim.looper.state == 'rec'
+    sim.click('play')
+    end = sim.next_bar_frame()
+    sim.run_frames(end - sim.frame)
+    return start, end
+
+
+def check_session():
+    with Simulation(latency = 0, bpm = bpm) as sim:
+        looper = sim.looper
+        period = looper.timeline.period(4)
+        bar = looper.timeline.length(4)
+
+        sim.run_beats(1)
+        press = sim.frame
+        sim.click('play')
+        sim.run_beats(2)
+        assert looper.state == 'metronome'
+        metronome = Lane(looper.metronome_bar().lanes[0].buffer, period)
+        origin = looper.engine.origin # a block after the press is handled
+        assert press < origin < press + looper.timeline.length(1)
+
+        first = rng.uniform(-0.2, 0.2, (bar, 2)).astype('float32')
+        start, end = record(sim, first)
+        first = Lane(layer(sim, first, start, end), period)
+        assert end - start in (bar, bar - 1)
+        sim.run_bars(3)
+        assert looper.state == 'play' and looper.tracks.n_layers == 1
+
+        second = rng.uniform(-0.2, 0.2, (bar, 2)).astype('float32')
+        overdub_start, overdub_end = record(sim, second)
+        mix = Lane(first.buffer + layer(sim, second, overdub_start, overdub_end), period)
+        sim.run_bars(4)
+        assert looper.state == 'play' and looper.tracks.n_layers == 2
+
+        out = sim.output
+        assert not out[:origin].any()
+        assert np.array_equal(out[origin:start], played(metronome, origin, origin, start))
+        # Published again as the take starts, the bar counts its passes from there
+        assert np.array_equal(out[start:end], played(metronome, start, start, end))
+        assert np.array_equal(out[end:overdub_end], played(first, start, end, overdub_end))
+        assert np.array_equal(out[overdub_end:], played(mix, start, overdub_end, len(out)))
+        assert np.abs(out[overdub_end:]).max() > 0.2 # both layers
+
+
+if __name__ == '__main__':
+    check_session()
+    print('metronome, take, loop and overdub played sample for sample: ok')
@@ -0,0 +1,109 @@
+# Randomized property checks of the rational timeline (timeline.py), over
+# every tempo the forw/back buttons allow (40-300 bpm):
+#
+#  - beat and pass starts never drift: pass k of a loop starts on frame
+#    ceil(k*P) for k up to hours of playback, and passes are ceil(P) or
+#    ceil(P)-1 frames long
+#  - lanes of 1, 2, 3 and 4 bars read back the sample given by modulo
+#    indexing, at any offset
+#  - PlaybackEngine output does not depend on how frames are split into
+#    blocks, and its loop boundaries land on ceil(k*P)
+#  - 3 bar and 4 bar lanes on two tracks mix as their own sum with gains
+#
+# usage: python3 check_timeline.py [number of random cases per bpm]
+
+import sys
+import math
+import random
+from fractions import Fraction
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from timeline import Timeline, Lane, Loop
+from engine import PlaybackEngine
+
+sample_rate = 44100
+n_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+bpms = range(40, 301)
+rng = random.Random(0)
+
+
+def check_passes(timeline):
+    for n_bars in [1, 2, 3, 4]:
+        period = timeline.period(4*n_bars)
+        loop = Loop.from_array(np.zeros((timeline.length(4*n_bars), 1)), period)
+        assert len(loop) == math.ceil(period)
+        for i in range(n_cases):
+            k = rng.randrange(0, int(4*3600*sample_rate/period)) # up to 4 hours
+            start, end = loop.bounds(math.ceil(k*period) + rng.randrange(0, math.floor(period)))
+            assert start == math.ceil(k*period), (timeline.bpm, n_bars, k)
+            assert end == math.ceil((k+1)*period)
+            assert end - start in (len(loop), len(loop)-1)
+    # Beats are where the bars say they are
+    for i in range(n_cases):
+        bar = rng.randrange(0, 10000)
+        assert timeline.frame(4*bar) == math.ceil(bar*timeline.period(4))
+
+
+def check_lanes(timeline):
+    for n_bars in [1, 2, 3, 4]:
+        period = timeline.period(4*n_bars)
+        buffer = np.arange(timeline.length(4*n_bars), dtype='float64')[:,np.newaxis]
+        lane = Lane(buffer, period)
+        for i in range(n_cases):
+            offset = rng.randrange(-10**7, 10**9)
+            n = rng.randrange(1, 3*len(buffer))
+            out = lane.read(offset, np.empty((n, 1)))
+            for j in [0, rng.randrange(n), n-1]:
+                o = offset + j
+                expected = o - math.ceil(math.floor(Fraction(o)/period)*period)
+                assert out[j, 0] == expected, (timeline.bpm, n_bars, o)
+
+
+def check_engine(bpm):
+    timeline = Timeline(sample_rate, bpm)
+    period = timeline.period(4)
+    bar = np.random.default_rng(bpm).uniform(-1, 1, (timeline.length(4), 2)).astype('float32')
+    outputs = []
+    for blocksizes in [[512], [rng.randrange(1, 4096) for i in range(50)]]:
+        engine = PlaybackEngine(sample_rate, headless=True)
+        boundaries = []
+        engine.boundary_callback = boundaries.append
+        engine.start_loop(Loop.from_array(bar, period))
+        blocks = []
+        n_frames = 0
+        while n_frames < 60*sample_rate:
+            n = blocksizes[len(blocks) % len(blocksizes)]
+            blocks.append(engine.render(n))
+            n_frames += n
+        outputs.append(np.concatenate(blocks)[:60*sample_rate])
+        assert boundaries == [math.ceil(k*period) for k in range(len(boundaries))], bpm
+    assert np.array_equal(outputs[0], outputs[1]), bpm
+
+
+def check_polymeter(bpm):
+    """3 bars against 4, on two tracks, mixed by the engine with their gains."""
+    timeline = Timeline(sample_rate, bpm)
+    noise = np.random.default_rng(bpm)
+    lanes = [Lane(noise.uniform(-1, 1, (timeline.length(4*n_bars), 2)).astype('float32'),
+                  timeline.period(4*n_bars), track = track)
+             for track, n_bars in enumerate([3, 4])]
+    gains = np.array([[0.5, 1.], [1., 0.25]], dtype='float32')
+    engine = PlaybackEngine(sample_rate, headless=True)
+    engine.set_gains(gains)
+    engine.start_loop(Loop(lanes))
+    n = int(timeline.period(4*12)) + 1000 # past the first common boundary
+    out = np.concatenate([engine.render(rng.randrange(1, 2048)) for i in range(n//1024*2)])[:n]
+    expected = sum(lane.read(0, np.empty((n, 2), dtype='float32'))*gains[lane.track]
+                   for lane in lanes)
+    assert np.allclose(out, expected, atol=1e-6), bpm
+
+
+for bpm in bpms:
+    timeline = Timeline(sample_rate, bpm)
+    check_passes(timeline)
+    check_lanes(timeline)
+for bpm in rng.sample(bpms, 10):
+    check_engine(bpm)
+    check_polymeter(bpm)
+print('timeline checks passed for %d to %d bpm' % (bpms[0], bpms[-1]))
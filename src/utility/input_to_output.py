@@ -4,47 +4,21 @@
 https://app.assembla.com/spaces/portaudio/git/source/master/test/patest_wire.c
 
 """
-import argparse
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 
 import sounddevice as sd
 import numpy  # Make sure NumPy is loaded before it is used in the callback
 assert numpy  # avoid "imported but unused" message (W0611)
+from audio import argument_parser
+from config import AudioConfig
 
 
-def int_or_str(text):
-    """Helper function for argument parsing."""
-    try:
-        return int(text)
-    except ValueError:
-        return text
-
-
-parser = argparse.ArgumentParser(add_help=False)
-parser.add_argument(
-    '-l', '--list-devices', action='store_true',
-    help='show list of audio devices and exit')
-args, remaining = parser.parse_known_args()
-if args.list_devices:
-    print(sd.query_devices())
-    parser.exit(0)
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    parents=[parser])
-parser.add_argument(
-    '-i', '--input-device', type=int_or_str,
-    help='input device (numeric ID or substring)')
-parser.add_argument(
-    '-o', '--output-device', type=int_or_str,
-    help='output device (numeric ID or substring)')
-parser.add_argument(
-    '-c', '--channels', type=int, default=2,
-    help='number of channels')
+parser = argument_parser(__doc__)
 parser.add_argument('--dtype', help='audio data type')
-parser.add_argument('--samplerate', type=float, help='sampling rate')
-parser.add_argument('--blocksize', type=int, help='block size')
-parser.add_argument('--latency', type=float, help='latency in seconds')
-args = parser.parse_args(remaining)
+args = parser.parse_args()
+config = AudioConfig.from_args(args)
 
 
 def callback(indata, outdata, frames, time, status):
@@ -54,10 +28,10 @@ def callback(indata, outdata, frames, time, status):
 
 
 try:
-    with sd.Stream(device=(args.input_device, args.output_device),
-                   samplerate=args.samplerate, blocksize=args.blocksize,
-                   dtype=args.dtype, latency=args.latency,
-                   channels=args.channels, callback=callback):
+    with sd.Stream(device=config.device,
+                   samplerate=config.sample_rate, blocksize=config.blocksize,
+                   dtype=args.dtype, latency=config.latency,
+                   channels=config.channels, callback=callback):
         print('#' * 80)
         print('press Return to quit')
         print('#' * 80)
@@ -0,0 +1,88 @@
+# Stress test of the master loop hand-off: several threads keep mixing
+# and publishing new loops (at the next boundary, or immediately) while
+# the headless engine renders as fast as it can.
+#
+# Every published loop is filled with a single value, slowly, before it
+# is published. If the audio thread ever played a half-built or modified
+# buffer, a loop pass would contain more than one value (or zeros).
+#
+# usage: python3 stress_loop_swap.py [seconds]
+
+import sys
+import threading
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from engine import PlaybackEngine
+from mixer import Mixer
+
+duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.
+sample_rate = 44100
+blocksize = 256
+
+engine = PlaybackEngine(sample_rate, blocksize=blocksize, headless=True)
+boundaries = []
+engine.boundary_callback = boundaries.append
+stop = threading.Event()
+
+
+def build(value, n_samples):
+    loop = np.empty((n_samples, 2), dtype='float32')
+    for start in range(0, n_samples, 1000):
+        loop[start:start+1000] = value
+        time.sleep(0)
+    return loop
+
+
+def publish_at_boundary(seed):
+    rng = np.random.default_rng(seed)
+    while not stop.is_set():
+        engine.set_loop(build(rng.integers(1, 1000), rng.integers(500, 5000)))
+
+
+def publish_now(seed):
+    rng = np.random.default_rng(seed)
+    while not stop.is_set():
+        engine.start_loop(build(rng.integers(1, 1000), rng.integers(500, 5000)))
+        time.sleep(0.001)
+
+
+def mix(seed):
+    # Layers of a single value keep every mix constant
+    rng = np.random.default_rng(seed)
+    mixer = Mixer()
+    while not stop.is_set():
+        if len(mixer) < 5 or rng.random() < 0.5:
+            mixer.add(np.full((2000, 2), rng.integers(1, 10), dtype='float32'))
+        else:
+            mixer.pop()
+        if len(mixer) > 0:
+            engine.set_loop(mixer.loop)
+
+
+engine.start_loop(build(1, 1000))
+threads = [threading.Thread(target=f, args=(i,))
+           for i, f in enumerate([publish_at_boundary, publish_at_boundary,
+                                  publish_now, mix, mix])]
+for t in threads:
+    t.start()
+
+blocks = []
+t_end = time.time() + duration
+while time.time() < t_end:
+    blocks.append(engine.render(blocksize)[:,0])
+stop.set()
+for t in threads:
+    t.join()
+
+output = np.concatenate(blocks)
+boundaries = [b for b in boundaries if b < len(output)] + [len(output)]
+torn = 0
+for start, end in zip(boundaries[:-1], boundaries[1:]):
+    values = output[start:end]
+    if values[0] == 0 or np.any(values != values[0]):
+        torn += 1
+print('%d frames, %d loop passes, %d torn passes'%(
+    len(output), len(boundaries)-1, torn))
+sys.exit(1 if torn else 0)
@@ -1,40 +1,34 @@
 # Note: input is plugged into output
+#
+# Measures the round-trip latency of the default sound card with
+# calibration.py and saves it, Looper.trim uses the saved value.
+# The sound card and its settings are those of the audio configuration
+# (see config.py), the block size can be given instead.
+# usage: python3 test_latency.py [blocksize]
 
 import sys
 from os import path
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
-from core import Looper
-from time import sleep
-import matplotlib.pyplot as plt
 import numpy as np
-
-N_tests = 2
-
-with Looper() as l:
-    sleep(3)
-    data_1 = l.loop
-    l.release_rec_button()
-    sleep(2)
-    l.release_play_button()
-    sleep(2)
-    data_2 = l.loop
-
-    l.release_rec_button()
-    sleep(2)
-    l.release_play_button()
-    sleep(2)
-    data_3 = l.loops[1]
-
-
-fig = plt.figure()
-plt.plot(data_1[:,0])
-plt.plot(data_2[:,0])
-fig.savefig('/home/pi/Desktop/plot.pdf')
-
-latency_samples = np.argmax(data_2) - np.argmax(data_1)
-latency_time = latency_samples/float(l.sample_rate)
-print('LATENCY 1 = %.0f ms'%(1e3*latency_time))
-
-latency_samples = np.argmax(data_3) - np.argmax(data_2)
-latency_time = latency_samples/float(l.sample_rate)
-print('LATENCY 2 = %.0f ms'%(1e3*latency_time))
+import calibration
+from audio import SoundDeviceAudio
+from config import AudioConfig
+
+N_tests = 3
+config = AudioConfig.load()
+if len(sys.argv) > 1:
+    config.blocksize = int(sys.argv[1])
+sample_rate = config.sample_rate
+blocksize = config.blocksize
+
+audio = SoundDeviceAudio(config.device)
+results = []
+for i in range(N_tests):
+    latency_time = calibration.calibrate(audio, sample_rate, config.channels,
+                                         blocksize = blocksize, latency = config.latency)
+    results.append(latency_time)
+    print('LATENCY %d = %.1f ms (%d samples)'%(i+1, 1e3*latency_time, round(latency_time*sample_rate)))
+
+latency_time = float(np.median(results))
+calibration.save(audio.name, blocksize, sample_rate, latency_time)
+print('Saved %.1f ms for %s, block size %d at %d Hz'%(1e3*latency_time, audio.name, blocksize, sample_rate))